@@ -0,0 +1,226 @@
+"""Tune PID gains from a relay feedback experiment.
+
+A RelayAutotuner measures a heater's ultimate gain and period, from which
+a tuning rule gives PID gains. Tuned gains are saved per device to a JSON
+config, which controllers load at startup.
+"""
+import json
+import math
+import os
+from datetime import datetime
+
+import scheduling
+import thermal
+
+
+# Tuning Rules
+
+# Ratios of Kp to the ultimate gain, and of Ti and Td to the ultimate period
+pid_tuning_rules = {
+    'ziegler_nichols': (0.6, 0.5, 0.125),
+    'ziegler_nichols_pi': (0.45, 1 / 1.2, 0.0),
+    'tyreus_luyben': (1 / 2.2, 2.2, 1 / 6.3),
+    'tyreus_luyben_pi': (1 / 3.2, 2.2, 0.0),
+    'some_overshoot': (1 / 3, 0.5, 1 / 3),
+    'no_overshoot': (0.2, 0.5, 1 / 3)
+}
+
+
+def compute_pid_gains(ultimate_gain, ultimate_period, rule='tyreus_luyben'):
+    """Compute (Kp, Ki, Kd) from the ultimate gain and period with a rule."""
+    try:
+        (kp_ratio, ti_ratio, td_ratio) = pid_tuning_rules[rule]
+    except KeyError:
+        raise ValueError('Unknown tuning rule: {}'.format(rule))
+
+    kp = kp_ratio * ultimate_gain
+    ki = kp / (ti_ratio * ultimate_period)
+    kd = kp * td_ratio * ultimate_period
+    return (kp, ki, kd)
+
+
+# Relay Feedback
+
+class RelayAutotuner(object):
+    """Estimate a heater's ultimate gain and period from relay feedback.
+
+    An InfiniteGainControl toggles the heater between relay_min and
+    relay_max around the target temperature, with the fan held at
+    fan_effort, until the temperature settles into a limit cycle. After
+    discard_cycles cycles, the amplitude and period of the next cycles give
+    the ultimate gain by describing function analysis, corrected for the
+    relay's hysteresis.
+    """
+    def __init__(
+        self, process_variable, heater, target, fan=None, fan_effort=0.0,
+        relay_min=0.0, relay_max=1.0, hysteresis=0.0, cycles=3,
+        discard_cycles=1, max_duration=3600, clock=None
+    ):
+        self.process_variable = process_variable
+        self.heater = heater
+        self.target = target
+        self.fan = fan
+        self.fan_effort = fan_effort
+        self.relay_min = relay_min
+        self.relay_max = relay_max
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.discard_cycles = discard_cycles
+        self.max_duration = max_duration
+        self.clock = clock if clock is not None else scheduling.system_clock
+        self.relay_control = thermal.InfiniteGainControl(
+            initial_setpoint=target, min_output=relay_min,
+            max_output=relay_max, hysteresis=hysteresis
+        )
+        self.reset()
+
+    def reset(self):
+        self.relay_control.last_effort = None
+        self.start_time = None
+        self.last_effort = None
+        self.extreme = None
+        self.heating_switch_times = []
+        self.minima = []
+        self.maxima = []
+
+    @property
+    def periods(self):
+        return [
+            end_time - start_time for (start_time, end_time) in zip(
+                self.heating_switch_times[:-1], self.heating_switch_times[1:]
+            )
+        ]
+
+    @property
+    def finished(self):
+        return (
+            len(self.periods) >= self.discard_cycles + self.cycles
+            and len(self.minima) >= self.cycles
+            and len(self.maxima) >= self.cycles
+        )
+
+    def update(self):
+        current_time = self.clock.monotonic()
+        if self.start_time is None:
+            self.start_time = current_time
+        temperature = self.process_variable.read()
+        if temperature is None:
+            return None
+
+        effort = self.relay_control.compute_control_effort(temperature)
+        self.heater.set_state(effort)
+        if self.fan is not None:
+            self.fan.set_state(self.fan_effort)
+        if effort != self.last_effort:
+            self.record_switch(current_time, effort)
+        # Lag makes the minimum occur while heating, and the maximum after
+        if self.extreme is not None:
+            if effort == self.relay_max:
+                self.extreme = min(self.extreme, temperature)
+            else:
+                self.extreme = max(self.extreme, temperature)
+        else:
+            self.extreme = temperature
+        self.last_effort = effort
+        return temperature
+
+    def record_switch(self, switch_time, effort):
+        if self.last_effort is not None and self.extreme is not None:
+            if self.last_effort == self.relay_max:
+                self.minima.append(self.extreme)
+            else:
+                self.maxima.append(self.extreme)
+        self.extreme = None
+        if effort == self.relay_max:
+            self.heating_switch_times.append(switch_time)
+
+    def iterate(self):
+        """Run the relay until finished, yielding before each update."""
+        self.reset()
+        try:
+            while not self.finished:
+                if (
+                    self.start_time is not None
+                    and self.clock.monotonic() - self.start_time
+                    > self.max_duration
+                ):
+                    raise RuntimeError(
+                        'Relay autotuning did not finish {} cycles within '
+                        '{:.0f} s!'.format(
+                            self.discard_cycles + self.cycles,
+                            self.max_duration
+                        )
+                    )
+
+                yield
+                self.update()
+        finally:
+            self.heater.set_state(0)
+            if self.fan is not None:
+                self.fan.set_state(0)
+
+    def compute_result(self, rule='tyreus_luyben'):
+        """Return the oscillation's measurements and the resulting gains."""
+        periods = self.periods[-self.cycles:]
+        minima = self.minima[-self.cycles:]
+        maxima = self.maxima[-self.cycles:]
+        amplitude = (
+            sum(maxima) / len(maxima) - sum(minima) / len(minima)
+        ) / 2
+        relay_amplitude = (self.relay_max - self.relay_min) / 2
+        hysteresis_amplitude = self.hysteresis / 2
+        if amplitude <= hysteresis_amplitude:
+            raise ValueError(
+                'Oscillation amplitude {:.3f} is within the relay '
+                'hysteresis!'.format(amplitude)
+            )
+
+        ultimate_gain = 4 * relay_amplitude / (
+            math.pi * math.sqrt(amplitude ** 2 - hysteresis_amplitude ** 2)
+        )
+        ultimate_period = sum(periods) / len(periods)
+        (kp, ki, kd) = compute_pid_gains(ultimate_gain, ultimate_period, rule)
+        return {
+            'rule': rule,
+            'kp': kp,
+            'ki': ki,
+            'kd': kd,
+            'target': self.target,
+            'amplitude': amplitude,
+            'ultimate_gain': ultimate_gain,
+            'ultimate_period': ultimate_period,
+            'duration': self.clock.monotonic() - self.start_time
+        }
+
+
+# Gain Configs
+
+def load_pid_gains(filename, device_name, default_gains):
+    """Load a device's tuned (Kp, Ki, Kd) from a JSON config.
+
+    Returns default_gains if the config has no gains for the device.
+    """
+    try:
+        with open(filename) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return default_gains
+
+    if device_name not in config:
+        return default_gains
+    device_config = config[device_name]
+    return (device_config['kp'], device_config['ki'], device_config['kd'])
+
+
+def save_pid_gains(filename, device_name, tuning):
+    """Save a device's tuning, which has kp, ki and kd, to a JSON config."""
+    try:
+        with open(filename) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        config = {}
+    config[device_name] = dict(tuning, tuned=datetime.now().isoformat())
+    temporary_filename = '{}.tmp'.format(filename)
+    with open(temporary_filename, 'w') as f:
+        json.dump(config, f, indent=2, sort_keys=True)
+    os.replace(temporary_filename, filename)
@@ -0,0 +1,183 @@
+"""Streaming filters for noisy process variable readings.
+
+Each filter takes one sample at a time in update and returns the filtered
+value, with a constant cost per sample. Invalid (None) samples pass through
+without changing the filter's state. The delay of each filter is its lag
+in samples for slowly-varying signals, e.g. the lag of its ramp response.
+"""
+import bisect
+import math
+
+
+class Filter(object):
+    """Generic streaming filter interface. Implement filter_sample."""
+    delay = 0.0
+
+    def reset(self):
+        pass
+
+    def filter_sample(self, sample):
+        return sample
+
+    def update(self, sample):
+        if sample is None:
+            return None
+
+        return self.filter_sample(sample)
+
+
+class FilterChain(Filter):
+    """Apply filters in sequence."""
+    def __init__(self, filters):
+        self.filters = [sample_filter for sample_filter in filters]
+
+    @property
+    def delay(self):
+        return sum(sample_filter.delay for sample_filter in self.filters)
+
+    def reset(self):
+        for sample_filter in self.filters:
+            sample_filter.reset()
+
+    def filter_sample(self, sample):
+        for sample_filter in self.filters:
+            sample = sample_filter.filter_sample(sample)
+        return sample
+
+
+class MovingAverageFilter(Filter):
+    """Average the last window samples, using a running sum.
+
+    The sum is recomputed each time the window wraps around, so that
+    floating-point errors do not accumulate.
+    """
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError('Window must be at least 1 sample!')
+        self.window = window
+        self.samples = [0.0] * window
+        self.reset()
+
+    @property
+    def delay(self):
+        return (self.window - 1) / 2
+
+    def reset(self):
+        self.count = 0
+        self.index = 0
+        self.total = 0.0
+
+    def filter_sample(self, sample):
+        if self.count < self.window:
+            self.count += 1
+        else:
+            self.total -= self.samples[self.index]
+        self.samples[self.index] = sample
+        self.total += sample
+        self.index += 1
+        if self.index == self.window:
+            self.index = 0
+            self.total = math.fsum(self.samples)
+        return self.total / self.count
+
+
+class ExponentialMovingAverageFilter(Filter):
+    """Exponentially weight samples, with new samples weighted by alpha."""
+    def __init__(self, alpha):
+        if not 0 < alpha <= 1:
+            raise ValueError('Alpha must be in (0, 1]!')
+        self.alpha = alpha
+        self.reset()
+
+    @classmethod
+    def from_time_constant(cls, time_constant, sample_interval):
+        """Make a filter with a time constant in units of sample_interval."""
+        return cls(1 - math.exp(-sample_interval / time_constant))
+
+    @property
+    def delay(self):
+        return (1 - self.alpha) / self.alpha
+
+    def reset(self):
+        self.value = None
+
+    def filter_sample(self, sample):
+        if self.value is None:
+            self.value = sample
+        else:
+            self.value += self.alpha * (sample - self.value)
+        return self.value
+
+
+class RunningMedianFilter(Filter):
+    """Take the median of the last window samples.
+
+    The window's samples are kept sorted, so each sample costs a binary
+    search and a shift of the small window.
+    """
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError('Window must be at least 1 sample!')
+        self.window = window
+        self.samples = [0.0] * window
+        self.reset()
+
+    @property
+    def delay(self):
+        return (self.window - 1) / 2
+
+    def reset(self):
+        self.count = 0
+        self.index = 0
+        self.sorted_samples = []
+
+    def filter_sample(self, sample):
+        if self.count < self.window:
+            self.count += 1
+        else:
+            oldest_sample = self.samples[self.index]
+            del self.sorted_samples[
+                bisect.bisect_left(self.sorted_samples, oldest_sample)
+            ]
+        self.samples[self.index] = sample
+        bisect.insort(self.sorted_samples, sample)
+        self.index += 1
+        if self.index == self.window:
+            self.index = 0
+        sorted_samples = self.sorted_samples
+        middle = self.count // 2
+        if self.count % 2:
+            return sorted_samples[middle]
+        return (sorted_samples[middle - 1] + sorted_samples[middle]) / 2
+
+
+class OutlierRejectionFilter(Filter):
+    """Reject samples which jump too far from the last accepted sample.
+
+    Rejected samples are replaced by the last accepted sample. After
+    max_rejections consecutive rejections, the next sample is accepted, so
+    that genuine step changes are followed.
+    """
+    def __init__(self, max_deviation, max_rejections=3):
+        self.max_deviation = max_deviation
+        self.max_rejections = max_rejections
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.rejections = 0
+        self.total_rejections = 0
+
+    def filter_sample(self, sample):
+        if (
+            self.value is not None
+            and abs(sample - self.value) > self.max_deviation
+            and self.rejections < self.max_rejections
+        ):
+            self.rejections += 1
+            self.total_rejections += 1
+            return self.value
+
+        self.value = sample
+        self.rejections = 0
+        return sample
@@ -1,5 +1,25 @@
-import RPi.GPIO as GPIO
-import Adafruit_ADS1x15
+import os
+import threading
+import time
+
+import numpy as np
+
+import scheduling
+
+# Hardware backend: 'rpi' for the Raspberry Pi, or 'simulated' for gpio_sim
+backend = os.environ.get('GPIO_BACKEND', 'rpi')
+if backend == 'rpi':
+    import RPi.GPIO as GPIO
+    import Adafruit_ADS1x15
+    ADS1115 = Adafruit_ADS1x15.ADS1115
+    default_clock = scheduling.system_clock
+elif backend == 'simulated':
+    import gpio_sim
+    GPIO = gpio_sim.GPIO
+    ADS1115 = gpio_sim.ADS1115
+    default_clock = gpio_sim.default_clock
+else:
+    raise ValueError('Unknown GPIO backend: {}'.format(backend))
 
 
 def cleanup():
@@ -73,7 +93,250 @@ gain_voltage_maxes = {
     16: 0.256
 }
 
-ADC = Adafruit_ADS1x15.ADS1115
+default_data_rate = 128  # samples/s; ADS1115 default
+
+
+# I2C Bus Arbitration
+
+class I2CBus(object):
+    """Serialize transactions on an I2C bus across threads.
+
+    Use the bus as a context manager to hold it for a transaction; nested
+    transactions on the same thread count as one. Utilization is the
+    fraction of time since the statistics were reset during which the bus
+    was held, including time spent waiting for conversions. Times are
+    measured on the clock which the bus's ADCs wait for conversions on.
+    """
+    def __init__(self, busnum=None, clock=None):
+        self.busnum = busnum
+        self.clock = clock if clock is not None else default_clock
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.transaction_start_time = None
+        self.reset_statistics()
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.depth += 1
+        if self.depth == 1:
+            self.transaction_start_time = self.clock.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0:
+            self.busy_time += (
+                self.clock.monotonic() - self.transaction_start_time
+            )
+            self.transactions += 1
+        self.lock.release()
+
+    def reset_statistics(self):
+        with self.lock:
+            self.statistics_start_time = self.clock.monotonic()
+            self.busy_time = 0.0
+            self.transactions = 0
+
+    @property
+    def utilization(self):
+        elapsed_time = self.clock.monotonic() - self.statistics_start_time
+        if elapsed_time <= 0:
+            return None
+        return min(1.0, self.busy_time / elapsed_time)
+
+    def as_dict(self):
+        return {
+            'busnum': self.busnum,
+            'transactions': self.transactions,
+            'busy_time': self.busy_time,
+            'utilization': self.utilization
+        }
+
+    def __str__(self):
+        utilization = self.utilization
+        return '{} transactions, {:.2f} s busy, {} utilization'.format(
+            self.transactions, self.busy_time,
+            '{:.1%}'.format(utilization) if utilization is not None else '-'
+        )
+
+
+i2c_buses = {}
+i2c_buses_lock = threading.Lock()
+
+
+def get_i2c_bus(busnum=None, clock=None):
+    """Return the shared I2CBus for a bus number (None for the default)."""
+    clock = clock if clock is not None else default_clock
+    with i2c_buses_lock:
+        if busnum not in i2c_buses:
+            i2c_buses[busnum] = I2CBus(busnum, clock=clock)
+        elif i2c_buses[busnum].clock is not clock:
+            raise ValueError(
+                'I2C bus {} is already timed by another clock'.format(busnum)
+            )
+        return i2c_buses[busnum]
+
+
+class ADCDevice(object):
+    """ADS1115 ADC whose transactions are serialized on its I2C bus.
+
+    Conversions are specified as (mux, differential, gain, data_rate)
+    configs, where mux is a channel, or a differential pair index if
+    differential is True. While the ADC converts continuously, single-shot
+    conversions of other configs restore continuous conversion afterwards,
+    and conversions of the continuous config read its latest result.
+    """
+    def __init__(self, address=0x48, busnum=None, clock=None, **kwargs):
+        self.address = address
+        self.clock = clock if clock is not None else default_clock
+        self.bus = get_i2c_bus(busnum, clock=self.clock)
+        if busnum is not None:
+            kwargs['busnum'] = busnum
+        self.device = ADS1115(address=address, **kwargs)
+        self.continuous_config = None
+        self.config_writes = 0
+        self.conversions = 0
+
+    def conversion_time(self, config):
+        (_, _, _, data_rate) = config
+        return 1.0 / (data_rate or default_data_rate)
+
+    def write_single_shot(self, config):
+        """Convert a config in single-shot mode. Hold the bus to call this."""
+        (mux, differential, gain, data_rate) = config
+        self.config_writes += 1
+        self.conversions += 1
+        if differential:
+            return self.device.read_adc_difference(
+                mux, gain=gain, data_rate=data_rate
+            )
+        return self.device.read_adc(mux, gain=gain, data_rate=data_rate)
+
+    def write_continuous(self, config):
+        """Start converting a config continuously. Hold the bus to call this.
+        """
+        (mux, differential, gain, data_rate) = config
+        self.config_writes += 1
+        if differential:
+            self.device.start_adc_difference(
+                mux, gain=gain, data_rate=data_rate
+            )
+        else:
+            self.device.start_adc(mux, gain=gain, data_rate=data_rate)
+        self.continuous_config = config
+
+    def write_stop(self):
+        """Stop continuous conversion. Hold the bus to call this."""
+        self.config_writes += 1
+        self.device.stop_adc()
+        self.continuous_config = None
+
+    def read_continuous(self):
+        """Read the latest continuous result. Hold the bus to call this."""
+        self.conversions += 1
+        return self.device.get_last_result()
+
+    def convert(self, config):
+        with self.bus:
+            if config == self.continuous_config:
+                return self.read_continuous()
+
+            result = self.write_single_shot(config)
+            if self.continuous_config is not None:
+                self.write_continuous(self.continuous_config)
+            return result
+
+    def scan(self, configs, samples=1):
+        """Convert each config samples times in a single bus transaction.
+
+        Each distinct config is written to the ADC at most once: configs are
+        converted in single-shot mode if one sample is needed, and otherwise
+        converted continuously, waiting a conversion between samples. The
+        ADC's continuous conversion state is restored afterwards. Returns a
+        dict of lists of samples, keyed by config.
+        """
+        results = {}
+        with self.bus:
+            previous_continuous_config = self.continuous_config
+            for config in configs:
+                if config in results:
+                    continue
+
+                if samples == 1 and config != self.continuous_config:
+                    results[config] = [self.write_single_shot(config)]
+                    continue
+
+                if config != self.continuous_config:
+                    # Starting conversion waits for the first conversion
+                    self.write_continuous(config)
+                values = [self.read_continuous()]
+                for _ in range(samples - 1):
+                    self.clock.sleep(self.conversion_time(config))
+                    values.append(self.read_continuous())
+                results[config] = values
+            if self.continuous_config != previous_continuous_config:
+                if previous_continuous_config is None:
+                    self.write_stop()
+                else:
+                    self.write_continuous(previous_continuous_config)
+        return results
+
+    # ADS1115 interface
+
+    def read_adc(self, channel, gain=1, data_rate=None):
+        return self.convert((channel, False, gain, data_rate))
+
+    def read_adc_difference(self, differential, gain=1, data_rate=None):
+        return self.convert((differential, True, gain, data_rate))
+
+    def start_adc(self, channel, gain=1, data_rate=None):
+        with self.bus:
+            self.write_continuous((channel, False, gain, data_rate))
+
+    def start_adc_difference(self, differential, gain=1, data_rate=None):
+        with self.bus:
+            self.write_continuous((differential, True, gain, data_rate))
+
+    def stop_adc(self):
+        with self.bus:
+            self.write_stop()
+
+    def get_last_result(self):
+        with self.bus:
+            return self.read_continuous()
+
+
+def scan_pins(pins, samples=None):
+    """Convert analog pins with one batched scan per ADC.
+
+    Each pin is sampled as many times as its oversampling, unless samples is
+    specified. Returns a list of each pin's samples, in the order of pins.
+    """
+    scans = {}
+    for pin in pins:
+        pin_samples = samples if samples is not None else pin.oversampling
+        scans.setdefault((pin.adc, pin_samples), []).append(
+            pin.conversion_config
+        )
+    results = {
+        (adc, scan_samples): adc.scan(configs, samples=scan_samples)
+        for ((adc, scan_samples), configs) in scans.items()
+    }
+    return [
+        results[(
+            pin.adc, samples if samples is not None else pin.oversampling
+        )][pin.conversion_config]
+        for pin in pins
+    ]
+
+
+def average_samples(samples):
+    if len(samples) == 1:
+        return samples[0]
+    return sum(samples) / len(samples)
+
+
+ADC = ADCDevice
 
 
 class PWMPin(State):
@@ -98,20 +361,90 @@ class PWMPin(State):
 
 
 class AnalogPin(object):
-    def __init__(self, adc, adc_pin, gain=1, adc_max=32767):
+    """Analog input pin on an ADC.
+
+    If refresh_interval is specified, conversions are cached and repeated
+    reads within refresh_interval seconds of a conversion return the cached
+    reading; this is useful for slowly-varying channels such as references.
+    If oversampling is greater than 1, each conversion is the average of
+    that many consecutive ADC conversions, with sub-LSB resolution.
+    """
+    def __init__(
+        self, adc, adc_pin, gain=1, adc_max=32767, data_rate=None,
+        refresh_interval=None, oversampling=1, clock=None
+    ):
+        if oversampling < 1:
+            raise ValueError('Oversampling must be at least 1!')
         self.adc = adc
+        self.clock = clock if clock is not None else default_clock
         self.adc_pin = adc_pin
         self.adc_max = float(adc_max)
         self.gain = gain
+        self.data_rate = data_rate
+        self.refresh_interval = refresh_interval
+        self.oversampling = oversampling
+        self.last_conversion = None
+        self.last_conversion_time = None
         try:
             self.voltage_max = gain_voltage_maxes[gain]
         except KeyError:
             raise ValueError('Unsupported ADC gain: {}'.format(gain))
         self.last_raw_reading = None
         self.last_reading = None
+        self.ring_buffer = None
+
+    @property
+    def conversion_config(self):
+        return (self.adc_pin, False, self.gain, self.data_rate)
+
+    def convert(self):
+        """Perform a blocking single-shot conversion."""
+        if self.oversampling > 1:
+            return self.convert_oversampled()
+        return self.adc.read_adc(
+            self.adc_pin, gain=self.gain, data_rate=self.data_rate
+        )
+
+    def convert_oversampled(self):
+        config = self.conversion_config
+        samples = self.adc.scan((config,), samples=self.oversampling)[config]
+        return average_samples(samples)
+
+    def start_continuous(self):
+        self.adc.start_adc(
+            self.adc_pin, gain=self.gain, data_rate=self.data_rate
+        )
+
+    def time_until_due(self, current_time):
+        if self.refresh_interval is None or self.last_conversion_time is None:
+            return 0
+        return max(
+            0, self.last_conversion_time + self.refresh_interval - current_time
+        )
+
+    def convert_if_due(self):
+        """Convert a new reading if the refresh interval has elapsed.
+
+        Returns whether a conversion was performed.
+        """
+        current_time = self.clock.monotonic()
+        if (
+            self.refresh_interval is not None
+            and self.last_conversion_time is not None
+            and current_time - self.last_conversion_time < self.refresh_interval
+        ):
+            return False
+
+        self.last_conversion = self.convert()
+        self.last_conversion_time = current_time
+        return True
 
     def read_raw(self):
-        raw_reading = self.adc.read_adc(self.adc_pin, gain=self.gain)
+        if self.ring_buffer is None:
+            self.convert_if_due()
+            raw_reading = self.last_conversion
+        else:
+            raw_reading = self.ring_buffer.last_value
         self.last_raw_reading = raw_reading
         return raw_reading
 
@@ -136,12 +469,179 @@ class DifferentialAnalogPin(AnalogPin):
                 'and referencing pin {}!'.format(self.adc_pin, self.ref_pin)
             )
 
-    def read_raw(self):
-        raw_reading = self.adc.read_adc_difference(
-            self.adc_pin_differential, gain=self.gain
+    @property
+    def conversion_config(self):
+        return (self.adc_pin_differential, True, self.gain, self.data_rate)
+
+    def convert(self):
+        if self.oversampling > 1:
+            return self.convert_oversampled()
+        return self.adc.read_adc_difference(
+            self.adc_pin_differential, gain=self.gain, data_rate=self.data_rate
         )
-        self.last_raw_reading = raw_reading
-        return raw_reading
+
+    def start_continuous(self):
+        self.adc.start_adc_difference(
+            self.adc_pin_differential, gain=self.gain, data_rate=self.data_rate
+        )
+
+
+# Analog Sampling
+
+class RingBuffer(object):
+    """Fixed-size buffer of timestamped samples which overwrites the oldest."""
+    def __init__(self, size=1024, dtype=np.int32):
+        self.size = size
+        self.times = np.zeros(size)
+        self.values = np.zeros(size, dtype=dtype)
+        self.count = 0
+        self.last_time = None
+        self.last_value = None
+
+    def append(self, sample_time, value):
+        index = self.count % self.size
+        self.times[index] = sample_time
+        self.values[index] = value
+        self.count += 1
+        self.last_time = sample_time
+        self.last_value = value
+
+    def to_arrays(self):
+        """Return copies of the buffered times and values, oldest first."""
+        count = self.count
+        if count <= self.size:
+            return (self.times[:count].copy(), self.values[:count].copy())
+        index = count % self.size
+        return (
+            np.concatenate((self.times[index:], self.times[:index])),
+            np.concatenate((self.values[index:], self.values[:index]))
+        )
+
+
+class ADCSampler(object):
+    """Convert analog pins on a background thread into ring buffers.
+
+    While the sampler runs, read_raw on its pins returns the latest sample
+    without blocking. A single pin runs the ADC in continuous conversion mode;
+    multiple pins are scanned with batched single-shot conversions, holding
+    each ADC's I2C bus for the whole scan, at most once every interval
+    seconds. Pins with a refresh interval are skipped in scans until their
+    refresh interval elapses.
+    """
+    def __init__(
+        self, pins, buffer_size=1024, interval=None, continuous=None
+    ):
+        self.pins = [pin for pin in pins]
+        self.buffer_size = buffer_size
+        self.interval = interval
+        if continuous is None:
+            continuous = len(self.pins) == 1
+        elif continuous and len(self.pins) != 1:
+            raise ValueError(
+                'Continuous conversion mode requires exactly one pin!'
+            )
+        self.continuous = continuous
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.first_scan_event = threading.Event()
+        self.scan_count = 0
+        self.error = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, timeout=1.0):
+        if self.running:
+            return
+
+        for pin in self.pins:
+            pin.ring_buffer = RingBuffer(
+                size=self.buffer_size,
+                dtype=np.int32 if pin.oversampling == 1 else np.float64
+            )
+        self.stop_event.clear()
+        self.first_scan_event.clear()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        if not self.first_scan_event.wait(timeout):
+            self.stop()
+            raise RuntimeError('ADC sampler did not produce any samples!')
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for pin in self.pins:
+            pin.ring_buffer = None
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        try:
+            if self.continuous:
+                self.run_continuous()
+            else:
+                self.run_scan()
+        except Exception as e:
+            self.error = e
+            # Fall back to blocking conversions rather than stale samples
+            for pin in self.pins:
+                pin.ring_buffer = None
+            self.first_scan_event.set()
+
+    def run_scan(self):
+        while not self.stop_event.is_set():
+            scan_start_time = time.monotonic()
+            due_pins = [
+                pin for pin in self.pins
+                if pin.time_until_due(pin.clock.monotonic()) == 0
+            ]
+            conversion_times = [pin.clock.monotonic() for pin in due_pins]
+            for (pin, conversion_time, samples) in zip(
+                due_pins, conversion_times, scan_pins(due_pins)
+            ):
+                conversion = average_samples(samples)
+                pin.last_conversion = conversion
+                pin.last_conversion_time = conversion_time
+                pin.ring_buffer.append(conversion_time, conversion)
+            converted = bool(due_pins)
+            self.scan_count += 1
+            self.first_scan_event.set()
+            if self.interval is not None:
+                self.stop_event.wait(
+                    self.interval - (time.monotonic() - scan_start_time)
+                )
+            elif not converted:
+                self.stop_event.wait(min(
+                    pin.time_until_due(pin.clock.monotonic())
+                    for pin in self.pins
+                ))
+
+    def run_continuous(self):
+        (pin,) = self.pins
+        interval = self.interval
+        if interval is None:
+            interval = 1.0 / (pin.data_rate or default_data_rate)
+        pin.start_continuous()
+        try:
+            # Wait for the first conversion to complete
+            self.stop_event.wait(interval)
+            samples = []
+            while not self.stop_event.is_set():
+                samples.append(pin.adc.get_last_result())
+                if len(samples) == pin.oversampling:
+                    pin.ring_buffer.append(
+                        pin.clock.monotonic(), average_samples(samples)
+                    )
+                    samples = []
+                    self.scan_count += 1
+                    self.first_scan_event.set()
+                self.stop_event.wait(interval)
+        finally:
+            pin.adc.stop_adc()
 
 
 # Components
@@ -0,0 +1,266 @@
+"""Simulated GPIO and ADC backend driven by a lumped thermal plant model.
+
+Select this backend by setting the GPIO_BACKEND environment variable to
+'simulated' before importing gpio. By default the plant runs in real time;
+set GPIO_SIMULATION_CLOCK to 'simulated' to run on a SimulatedClock, which
+lets control sequences run faster than real time.
+"""
+import os
+import threading
+
+import numpy as np
+
+import scheduling
+import thermal
+
+
+# Clock
+
+simulation_clock = os.environ.get('GPIO_SIMULATION_CLOCK', 'system')
+if simulation_clock == 'system':
+    default_clock = scheduling.system_clock
+elif simulation_clock == 'simulated':
+    default_clock = scheduling.SimulatedClock()
+else:
+    raise ValueError('Unknown simulation clock: {}'.format(simulation_clock))
+
+
+# Plant Model
+
+default_thermal_model = thermal.fitted_thermal_model
+
+# Thermistor settings, matching thermal_lysis
+default_thermistor = thermal.Thermistor(
+    None, None,
+    bias_resistance=1960,  # Ohm
+    A=0.0010349722285233954,
+    B=0.00022717987892035313,
+    C=3.008424040777896e-07
+)
+
+analog_pin_differentials = {
+    0: (0, 1),
+    1: (0, 3),
+    2: (1, 3),
+    3: (2, 3)
+}
+
+gain_voltage_maxes = {
+    1: 4.096,
+    2: 2.048,
+    4: 1.024,
+    8: 0.512,
+    16: 0.256
+}
+
+
+class ThermalPlant(object):
+    """Thermal plant wired to simulated heater, fan and thermistor pins.
+
+    The heater and fan duties are read from the simulated GPIO pins, and the
+    plant is advanced to the current time whenever the thermistor is read.
+    """
+    def __init__(
+        self, gpio, model=default_thermal_model,
+        thermistor=default_thermistor, heater_pin=18, fan_pin=4,
+        thermistor_channel=0, reference_channel=3, reference_voltage=3.3,
+        noise=2.0, seed=0, initial_temperature=None, clock=None
+    ):
+        self.gpio = gpio
+        self.model = model
+        self.thermistor = thermistor
+        self.heater_pin = heater_pin
+        self.fan_pin = fan_pin
+        self.thermistor_channel = thermistor_channel
+        self.reference_channel = reference_channel
+        self.reference_voltage = reference_voltage
+        self.noise = noise  # standard deviation in ADC codes
+        self.seed = seed
+        self.clock = clock if clock is not None else default_clock
+        if initial_temperature is None:
+            initial_temperature = model.ambient_temperature
+        self.initial_temperature = initial_temperature
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.temperature = self.initial_temperature
+            self.sensor_temperature = self.initial_temperature
+            self.time = None
+            self.random = np.random.RandomState(self.seed)
+
+    def advance(self):
+        with self.lock:
+            current_time = self.clock.monotonic()
+            if self.time is not None and current_time > self.time:
+                (self.temperature, self.sensor_temperature) = self.model.step(
+                    self.temperature, self.sensor_temperature,
+                    self.gpio.get_duty(self.heater_pin),
+                    self.gpio.get_duty(self.fan_pin),
+                    current_time - self.time
+                )
+            self.time = current_time
+
+    def read_voltage(self, channel):
+        if channel == self.reference_channel:
+            return self.reference_voltage
+        if channel == self.thermistor_channel:
+            resistance = float(self.thermistor.inverse_steinhart_hart(
+                self.thermistor.convert_to_kelvin(self.sensor_temperature)
+            ))
+            return (
+                self.reference_voltage * resistance
+                / (resistance + self.thermistor.bias_resistance)
+            )
+        return 0.0
+
+    def read_code(self, channel, gain=1, reference_channel=None):
+        self.advance()
+        voltage = self.read_voltage(channel)
+        if reference_channel is not None:
+            voltage -= self.read_voltage(reference_channel)
+        with self.lock:
+            noise = self.random.normal(0, self.noise) if self.noise else 0
+        code = int(round(voltage / gain_voltage_maxes[gain] * 32767 + noise))
+        return max(-32768, min(32767, code))
+
+
+# GPIO
+
+class PWM(object):
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = 0
+
+    def start(self, duty_cycle):
+        self.gpio.pwms[self.pin] = self
+        self.ChangeDutyCycle(duty_cycle)
+
+    def stop(self):
+        self.gpio.pwms.pop(self.pin, None)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+
+class SimulatedGPIO(object):
+    """Stand-in for the RPi.GPIO module which records pin states."""
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+
+    def __init__(self):
+        self.mode = None
+        self.outputs = {}
+        self.pwms = {}
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction):
+        if direction == self.OUT:
+            self.outputs.setdefault(pin, False)
+
+    def output(self, pin, state):
+        self.outputs[pin] = bool(state)
+
+    def PWM(self, pin, frequency):
+        return PWM(self, pin, frequency)
+
+    def cleanup(self):
+        self.outputs.clear()
+        self.pwms.clear()
+
+    def get_duty(self, pin):
+        """Return the pin's duty cycle as a fraction between 0 and 1."""
+        if pin in self.pwms:
+            return self.pwms[pin].duty_cycle / 100.0
+        return 1.0 if self.outputs.get(pin, False) else 0.0
+
+
+GPIO = SimulatedGPIO()
+default_plant = ThermalPlant(GPIO)
+
+# Plants wired to each ADC address
+plants = {0x48: [default_plant]}
+
+
+def add_plant(address, plant):
+    """Wire a plant to an ADC, replacing any plant on its thermistor channel.
+    """
+    address_plants = plants.setdefault(address, [])
+    address_plants[:] = [
+        existing_plant for existing_plant in address_plants
+        if existing_plant.thermistor_channel != plant.thermistor_channel
+    ]
+    address_plants.append(plant)
+
+
+# ADC
+
+class ADS1115(object):
+    """Stand-in for Adafruit_ADS1x15.ADS1115 which reads from plants.
+
+    Each channel is read from the plant whose thermistor is wired to it, or
+    from the first plant wired to the ADC's address for other channels.
+    """
+    def __init__(self, address=0x48, busnum=None, plant=None, **kwargs):
+        self.address = address
+        self.busnum = busnum
+        if plant is not None:
+            self.plants = [plant]
+        else:
+            self.plants = plants.setdefault(address, [])
+        self.continuous = None
+
+    def find_plant(self, channel):
+        if not self.plants:
+            raise OSError(
+                'No simulated plant is wired to ADC address {:#x}'.format(
+                    self.address
+                )
+            )
+
+        for plant in self.plants:
+            if plant.thermistor_channel == channel:
+                return plant
+        return self.plants[0]
+
+    def read_code(self, channel, gain=1, reference_channel=None):
+        return self.find_plant(channel).read_code(
+            channel, gain=gain, reference_channel=reference_channel
+        )
+
+    def read_adc(self, channel, gain=1, data_rate=None):
+        return self.read_code(channel, gain=gain)
+
+    def read_adc_difference(self, differential, gain=1, data_rate=None):
+        (channel, reference_channel) = analog_pin_differentials[differential]
+        return self.read_code(
+            channel, gain=gain, reference_channel=reference_channel
+        )
+
+    def start_adc(self, channel, gain=1, data_rate=None):
+        self.continuous = (channel, None, gain)
+
+    def start_adc_difference(self, differential, gain=1, data_rate=None):
+        (channel, reference_channel) = analog_pin_differentials[differential]
+        self.continuous = (channel, reference_channel, gain)
+
+    def stop_adc(self):
+        self.continuous = None
+
+    def get_last_result(self):
+        if self.continuous is None:
+            return 0
+        (channel, reference_channel, gain) = self.continuous
+        return self.read_code(
+            channel, gain=gain, reference_channel=reference_channel
+        )
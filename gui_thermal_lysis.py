@@ -1,10 +1,126 @@
 import tkinter as tk
 
+import numpy as np
+
 import gpio
-from thermal_lysis import controller
+import live_control
+from thermal_lysis import (
+    adc_sampler, clock, control_loop_policy, controller, metrics_exporter,
+    start_adc_sampler
+)
 
 control_loop_interval = 50  # ms
 invalid_temperature_resample_interval = 10  # ms
+gui_refresh_interval = 100  # ms
+plot_refresh_interval = 500  # ms
+plot_max_buckets = 512  # decimated buckets of the whole run's history
+plot_recent_size = 1200  # full-resolution samples of the recent history
+
+
+class LivePlot(tk.Canvas):
+    """Canvas plot of a MinMaxHistory's temperature and duty channels.
+
+    The upper panel plots temperature and setpoint, and the lower panel
+    plots heater and fan duty. The plot shows either the recent samples at
+    full resolution, or the whole run's decimated history. Line items are
+    created once and only have their coordinates replaced on each redraw.
+    """
+    margin = 40  # px
+    duty_panel_fraction = 0.3
+    lines = (  # (channel, panel, color, dash)
+        (0, 'temperature', 'black', None),
+        (1, 'temperature', 'gray', (4, 2)),
+        (2, 'duty', 'red', None),
+        (3, 'duty', 'blue', None)
+    )
+
+    def __init__(self, master, history, width=480, height=320, **kwargs):
+        super().__init__(
+            master, width=width, height=height, bg='white', **kwargs
+        )
+        self.history = history
+        self.width = width
+        self.height = height
+        self.window = tk.StringVar(value='recent')
+        plot_bottom = height - self.margin
+        duty_top = plot_bottom - self.duty_panel_fraction * (
+            height - 2 * self.margin
+        )
+        self.panels = {
+            'temperature': (self.margin, duty_top - 10),
+            'duty': (duty_top, plot_bottom)
+        }
+        for (top, bottom) in self.panels.values():
+            self.create_rectangle(
+                self.margin, top, width - self.margin, bottom, outline='gray'
+            )
+        self.line_items = [
+            self.create_line(0, 0, 0, 0, fill=color, dash=dash, width=2)
+            for (_, _, color, dash) in self.lines
+        ]
+        self.temperature_labels = tuple(
+            self.create_text(self.margin - 4, y, anchor='e')
+            for y in self.panels['temperature']
+        )
+        for (y, text) in zip(self.panels['duty'], ('1', '0')):
+            self.create_text(self.margin - 4, y, anchor='e', text=text)
+        self.time_label = self.create_text(
+            width - self.margin, height - self.margin + 4, anchor='ne'
+        )
+
+    def channel_points(self, channel):
+        if self.window.get() == 'recent':
+            return np.array(
+                self.history.recent_points(channel), dtype=float
+            ).reshape(-1, 2)
+        return self.history.channel_points(channel)
+
+    def redraw(self):
+        points = [self.channel_points(line[0]) for line in self.lines]
+        times = np.concatenate([channel[:, 0] for channel in points])
+        if len(times) < 2:
+            return
+
+        (start_time, end_time) = (times.min(), times.max())
+        temperatures = np.concatenate((points[0][:, 1], points[1][:, 1]))
+        (min_temperature, max_temperature) = (
+            np.floor(temperatures.min() - 0.5),
+            np.ceil(temperatures.max() + 0.5)
+        )
+        ranges = {
+            'temperature': (min_temperature, max_temperature),
+            'duty': (0.0, 1.0)
+        }
+        x_scale = (self.width - 2 * self.margin) / max(
+            end_time - start_time, 1e-9
+        )
+        for (channel_points, (_, panel, _, _), item) in zip(
+            points, self.lines, self.line_items
+        ):
+            if len(channel_points) < 2:
+                self.itemconfig(item, state='hidden')
+                continue
+
+            (top, bottom) = self.panels[panel]
+            (low, high) = ranges[panel]
+            coordinates = np.empty_like(channel_points)
+            coordinates[:, 0] = (
+                self.margin + (channel_points[:, 0] - start_time) * x_scale
+            )
+            coordinates[:, 1] = bottom - (
+                (channel_points[:, 1] - low) / (high - low) * (bottom - top)
+            )
+            self.coords(item, *coordinates.ravel())
+            self.itemconfig(item, state='normal')
+        self.itemconfig(
+            self.temperature_labels[0], text='{:.0f}'.format(max_temperature)
+        )
+        self.itemconfig(
+            self.temperature_labels[1], text='{:.0f}'.format(min_temperature)
+        )
+        self.itemconfig(self.time_label, text='{:.1f} min'.format(
+            (end_time - start_time) / 60
+        ))
 
 
 class Application(tk.Frame):
@@ -22,7 +138,20 @@ class Application(tk.Frame):
         self.heater_setpoint_2.after_state_change = \
             self.on_heater_setpoint_2_state_change
 
-        self.updater()
+        # The controller runs on its own thread so that UI load can't stall
+        # it; the GUI only sends it commands and renders its latest state
+        self.control_thread = live_control.ControllerThread(
+            controller, control_loop_interval / 1000,
+            policy=control_loop_policy,
+            resample_interval=invalid_temperature_resample_interval / 1000,
+            clock=clock
+        )
+        self.setpoint = None
+        self.send_setpoint()
+        self.last_update = 0
+        self.control_thread.start()
+        self.refresh()
+        self.refresh_plot()
 
     # define methods #
 
@@ -34,7 +163,8 @@ class Application(tk.Frame):
             self.btn_heater_setpoint_1.config(relief='raised')
             self.btn_heater_setpoint_1.config(fg='black')
             print('Heater setpoint 1 disabled!')
-        controller.reset()
+        self.print_control_loop_statistics()
+        self.send_setpoint(reset=True)
 
     def on_heater_setpoint_2_state_change(self, state):
         if state:
@@ -44,7 +174,8 @@ class Application(tk.Frame):
             self.btn_heater_setpoint_2.config(relief='raised')
             self.btn_heater_setpoint_2.config(fg='black')
             print('Heater setpoint 2 disabled!')
-        controller.reset()
+        self.print_control_loop_statistics()
+        self.send_setpoint(reset=True)
 
     def toggle_heater_setpoint_1(self):
         self.heater_setpoint_1.toggle()
@@ -56,37 +187,70 @@ class Application(tk.Frame):
         if self.heater_setpoint_2.state:
             self.heater_setpoint_1.turn_off()
 
-    def updater(self):
-        setpoint = None
+    def print_control_loop_statistics(self):
+        print('Control loop: {}'.format(
+            self.control_thread.scheduler.statistics
+        ))
+
+    def read_setpoint(self):
+        try:
+            if self.heater_setpoint_1.state:
+                return float(self.entry_heater_setpoint_1.get())
+            elif self.heater_setpoint_2.state:
+                return float(self.entry_heater_setpoint_2.get())
+        except ValueError:
+            return self.setpoint  # Keep the last valid setpoint
+        return None
+
+    def send_setpoint(self, reset=False):
+        self.setpoint = self.read_setpoint()
+        self.control_thread.send(apply_setpoint, self.setpoint, reset)
+
+    def show_control_error(self, error):
+        """Stop controlling from the GUI after the control loop failed."""
+        self.entry_heater_temp.config(text='Error', fg='red')
+        for button in (self.btn_heater_setpoint_1, self.btn_heater_setpoint_2):
+            button.config(fg='black', state='disabled')
+        print('Heater control stopped with outputs off: {!r}'.format(error))
+
+    def refresh(self):
+        state = self.control_thread.state
+        if state.error is not None:
+            self.show_control_error(state.error)
+            return
+
+        if self.read_setpoint() != self.setpoint:
+            self.send_setpoint()
+
+        if (
+            state.updates != self.last_update
+            and state.process_variable is not None
+        ):
+            self.last_update = state.updates
+            self.history.update(
+                state.time,
+                (state.process_variable, state.setpoint)
+                + tuple(state.control_efforts)
+            )
+        if state.process_variable is None:
+            self.entry_heater_temp.config(text='-')
+        else:
+            self.entry_heater_temp.config(
+                text=format(state.process_variable, '.2f')
+            )
         if self.heater_setpoint_1.state:
-            setpoint = float(self.entry_heater_setpoint_1.get())
             btn_heater_setpoint = self.btn_heater_setpoint_1
         elif self.heater_setpoint_2.state:
-            setpoint = float(self.entry_heater_setpoint_2.get())
             btn_heater_setpoint = self.btn_heater_setpoint_2
-        controller.set_setpoint(setpoint)
-
-        if setpoint is None:
-            controller.file_reporter.file_suffix = \
-                '_uncontrolled'
-            controller.file_reporter.interval = 15
         else:
-            controller.file_reporter.interval = 0.5
-            controller.file_reporter.file_suffix = \
-                '_setpoint{:.1f}'.format(setpoint)
-
-        (temperature, control_efforts) = controller.update()
-        (heater_control_effort, fan_control_effort) = control_efforts
-        if temperature is None:
-            self.entry_heater_temp.config(text='-')
-            self.after(invalid_temperature_resample_interval, self.updater)
-            return
-
-        self.entry_heater_temp.config(text=format(temperature, '.2f'))
-        if setpoint is None:
+            btn_heater_setpoint = None
+        if btn_heater_setpoint is None:
             self.btn_heater_setpoint_1.config(fg='black')
             self.btn_heater_setpoint_2.config(fg='black')
-        else:
+        elif state.setpoint is not None and state.control_efforts:
+            (heater_control_effort, fan_control_effort) = (
+                state.control_efforts
+            )
             if heater_control_effort and fan_control_effort:
                 button_color = 'purple'
             elif heater_control_effort:
@@ -96,7 +260,11 @@ class Application(tk.Frame):
             else:
                 button_color = 'black'
             btn_heater_setpoint.config(fg=button_color)
-        self.after(control_loop_interval, self.updater)
+        self.after(gui_refresh_interval, self.refresh)
+
+    def refresh_plot(self):
+        self.plot.redraw()
+        self.after(plot_refresh_interval, self.refresh_plot)
 
     # create widgets #
     def create_widgets(self):
@@ -129,11 +297,48 @@ class Application(tk.Frame):
         self.label_heater_temp.grid(row=3, column=0)
         self.entry_heater_temp.grid(row=3, column=1)
 
+        # plot of temperature, setpoint, heater duty and fan duty
+        self.history = live_control.MinMaxHistory(
+            4, max_buckets=plot_max_buckets, recent_size=plot_recent_size
+        )
+        self.plot = LivePlot(self, self.history)
+        self.plot.grid(row=0, column=2, rowspan=5)
+        self.btn_plot_recent = tk.Radiobutton(
+            self, text='Recent', variable=self.plot.window, value='recent',
+            command=self.plot.redraw
+        )
+        self.btn_plot_run = tk.Radiobutton(
+            self, text='Whole Run', variable=self.plot.window, value='run',
+            command=self.plot.redraw
+        )
+        self.btn_plot_recent.grid(row=4, column=0)
+        self.btn_plot_run.grid(row=4, column=1)
+
+
+def apply_setpoint(setpoint, reset):
+    """Change the controller's setpoint; runs on the control thread."""
+    if setpoint is None:
+        controller.file_reporter.file_suffix = '_uncontrolled'
+        controller.file_reporter.interval = 15
+    else:
+        controller.file_reporter.interval = 0.5
+        controller.file_reporter.file_suffix = \
+            '_setpoint{:.1f}'.format(setpoint)
+    if reset:
+        controller.reset()
+    controller.set_setpoint(setpoint)
+
 
 # create GUI
+start_adc_sampler()
+metrics_exporter.start()
 root = tk.Tk()
 app = Application(master=root)
 app.mainloop()
 
 # exit routine
+app.control_thread.stop()
+app.print_control_loop_statistics()
+adc_sampler.stop()
+metrics_exporter.stop()
 gpio.cleanup()
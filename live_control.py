@@ -0,0 +1,268 @@
+"""Run a controller on its own thread and keep its history for plotting.
+
+These let a GUI show a live controller without touching it: the control
+loop runs on a ControllerThread which publishes immutable snapshots, and a
+MinMaxHistory keeps a bounded-memory history of the snapshots to plot.
+"""
+import collections
+import math
+import queue
+import threading
+
+import numpy as np
+
+import scheduling
+
+
+# Threaded Control
+
+class ControllerState(object):
+    """Snapshot of a controller after one update; never modified.
+
+    error is the exception which stopped the control loop, if any.
+    """
+    __slots__ = (
+        'time', 'process_variable', 'setpoint', 'setpoint_reached',
+        'control_efforts', 'updates', 'error'
+    )
+
+    def __init__(
+        self, time=None, process_variable=None, setpoint=None,
+        setpoint_reached=False, control_efforts=(), updates=0, error=None
+    ):
+        self.time = time
+        self.process_variable = process_variable
+        self.setpoint = setpoint
+        self.setpoint_reached = setpoint_reached
+        self.control_efforts = tuple(control_efforts)
+        self.updates = updates
+        self.error = error
+
+
+class ControllerThread(object):
+    """Run a controller's control loop on a dedicated thread.
+
+    Other threads, such as a GUI's event loop, never touch the controller
+    directly: they send commands through a queue, which the control thread
+    applies between updates, and read the state from the latest snapshot,
+    which the control thread replaces after each update. Snapshots are
+    immutable and published by a single reference assignment, so reading
+    them needs no lock and never blocks the control loop. After an invalid
+    reading, the process variable is resampled after resample_interval
+    seconds instead of at the next deadline. When the loop stops, whether
+    stopped or by an error, all outputs are turned off; an error is
+    published in a final snapshot.
+    """
+    def __init__(
+        self, controller, interval, policy='skip', resample_interval=None,
+        clock=None
+    ):
+        self.controller = controller
+        self.scheduler = scheduling.LoopScheduler(
+            interval, policy=policy, clock=clock
+        )
+        self.clock = self.scheduler.clock
+        self.resample_interval = resample_interval
+        self.commands = queue.Queue()
+        self.state = ControllerState()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def send(self, command, *args):
+        """Call command with args on the control thread before its update."""
+        self.commands.put((command, args))
+
+    def set_setpoint(self, setpoint):
+        self.send(self.controller.set_setpoint, setpoint)
+
+    def reset(self):
+        self.send(self.controller.reset)
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def apply_commands(self):
+        while True:
+            try:
+                (command, args) = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            command(*args)
+
+    def update(self):
+        self.apply_commands()
+        (process_variable, control_efforts) = self.controller.update()
+        previous_state = self.state
+        if process_variable is None:
+            control_efforts = previous_state.control_efforts
+        self.state = ControllerState(
+            time=self.clock.monotonic(), process_variable=process_variable,
+            setpoint=self.controller.controls[0].setpoint,
+            setpoint_reached=self.controller.setpoint_reached,
+            control_efforts=control_efforts,
+            updates=previous_state.updates + 1
+        )
+        return process_variable
+
+    def run(self):
+        try:
+            self.scheduler.start_iteration()
+            while not self.stop_event.is_set():
+                process_variable = self.update()
+                self.scheduler.finish_iteration()
+                delay = self.scheduler.time_until_next_iteration()
+                if (
+                    process_variable is None
+                    and self.resample_interval is not None
+                ):
+                    delay = min(delay, self.resample_interval)
+                if not self.clock.realtime:
+                    self.clock.sleep(delay)
+                elif self.stop_event.wait(delay):
+                    break
+                self.scheduler.start_iteration()
+        except Exception as e:
+            print('Control loop stopped by error: {!r}'.format(e))
+            previous_state = self.state
+            self.state = ControllerState(
+                time=self.clock.monotonic(),
+                process_variable=previous_state.process_variable,
+                setpoint=previous_state.setpoint,
+                setpoint_reached=previous_state.setpoint_reached,
+                updates=previous_state.updates, error=e
+            )
+        finally:
+            self.scheduler.finish_iteration()
+            for output in self.controller.outputs:
+                output.set_state(0)
+
+
+# Live History
+
+missing_point = (math.nan, math.nan)
+
+
+class MinMaxHistory(object):
+    """Bounded-memory history of a multichannel time series for plotting.
+
+    The latest recent_size samples are kept at full resolution in a ring
+    buffer. The whole history is decimated into at most max_buckets
+    buckets, each holding the minimum and maximum of each channel with
+    their times; whenever the buckets fill up, adjacent pairs are merged to
+    double the samples per bucket. Plotting each bucket's minimum and
+    maximum in time order keeps spikes visible, while memory use and
+    rendering cost stay constant however long the run. Channel values may
+    be None, which are skipped.
+    """
+    def __init__(self, channels, max_buckets=512, recent_size=1024):
+        if max_buckets < 2 or max_buckets % 2:
+            raise ValueError('max_buckets must be a positive even number')
+        self.channels = channels
+        self.max_buckets = max_buckets
+        self.recent = collections.deque(maxlen=recent_size)
+        shape = (max_buckets, channels)
+        self.min_values = np.empty(shape)
+        self.min_times = np.empty(shape)
+        self.max_values = np.empty(shape)
+        self.max_times = np.empty(shape)
+        self.reset()
+
+    def reset(self):
+        self.recent.clear()
+        self.buckets = 0
+        self.samples_per_bucket = 1
+        self.samples = 0
+        self.clear_pending()
+
+    def clear_pending(self):
+        self.pending_samples = 0
+        self.pending_min = [None] * self.channels
+        self.pending_max = [None] * self.channels
+
+    def update(self, sample_time, values):
+        self.samples += 1
+        self.recent.append((sample_time, tuple(values)))
+        for (i, value) in enumerate(values):
+            if value is None:
+                continue
+            pending_min = self.pending_min[i]
+            if pending_min is None or value < pending_min[1]:
+                self.pending_min[i] = (sample_time, value)
+            pending_max = self.pending_max[i]
+            if pending_max is None or value > pending_max[1]:
+                self.pending_max[i] = (sample_time, value)
+        self.pending_samples += 1
+        if self.pending_samples >= self.samples_per_bucket:
+            self.flush_pending()
+
+    def flush_pending(self):
+        bucket = self.buckets
+        for i in range(self.channels):
+            (self.min_times[bucket, i], self.min_values[bucket, i]) = (
+                self.pending_min[i] or missing_point
+            )
+            (self.max_times[bucket, i], self.max_values[bucket, i]) = (
+                self.pending_max[i] or missing_point
+            )
+        self.buckets += 1
+        self.clear_pending()
+        if self.buckets == self.max_buckets:
+            self.merge_buckets()
+
+    def merge_buckets(self):
+        half = self.max_buckets // 2
+        for (values, times, select) in (
+            (self.min_values, self.min_times, np.less_equal),
+            (self.max_values, self.max_times, np.greater_equal)
+        ):
+            # Comparisons with missing (nan) values are False
+            first = select(values[0::2], values[1::2]) | np.isnan(values[1::2])
+            values[:half] = np.where(first, values[0::2], values[1::2])
+            times[:half] = np.where(first, times[0::2], times[1::2])
+        self.buckets = half
+        self.samples_per_bucket *= 2
+
+    def channel_points(self, channel):
+        """Return the decimated (time, value) points of a channel."""
+        min_points = np.column_stack((
+            self.min_times[:self.buckets, channel],
+            self.min_values[:self.buckets, channel]
+        ))
+        max_points = np.column_stack((
+            self.max_times[:self.buckets, channel],
+            self.max_values[:self.buckets, channel]
+        ))
+        if self.pending_samples:
+            min_points = np.vstack((
+                min_points, self.pending_min[channel] or missing_point
+            ))
+            max_points = np.vstack((
+                max_points, self.pending_max[channel] or missing_point
+            ))
+        # Interleave each bucket's minimum and maximum in time order
+        swap = max_points[:, 0] < min_points[:, 0]
+        points = np.empty((2 * len(min_points), 2))
+        points[0::2] = np.where(swap[:, None], max_points, min_points)
+        points[1::2] = np.where(swap[:, None], min_points, max_points)
+        return points[~np.isnan(points[:, 1])]
+
+    def recent_points(self, channel):
+        """Return the full-resolution recent (time, value) points."""
+        return [
+            (sample_time, values[channel])
+            for (sample_time, values) in self.recent
+            if values[channel] is not None
+        ]
@@ -0,0 +1,254 @@
+"""Time controller updates and export the metrics for monitoring.
+
+A ControllerInstrumentation passed to a Controller records latency
+histograms of each stage of its updates, and a MetricsExporter writes
+snapshots of the metrics of any number of controllers to a file.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+
+# Instrumentation
+
+class LatencyHistogram(object):
+    """Histogram of durations in seconds, with fixed bucket upper bounds.
+
+    Bucket counts are preallocated, so recording a duration does not
+    allocate any containers. The last bucket counts durations above all
+    bounds.
+    """
+    default_bounds = tuple(1e-6 * 2 ** i for i in range(21))  # 1 us to ~1 s
+
+    def __init__(self, bounds=default_bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, duration):
+        self.counts[bisect.bisect_left(self.bounds, duration)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket holding it."""
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        cumulative_count = 0
+        for (bound, count) in zip(self.bounds, self.counts):
+            cumulative_count += count
+            if cumulative_count >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'bounds': list(self.bounds),
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99)
+        }
+
+
+class ControllerInstrumentation(object):
+    """Per-stage timings and event counts of a controller's updates.
+
+    Pass an instance to a Controller to time the read, control, output and
+    report stages of each update, and each control's effort computation.
+    Invalid readings and ADC errors (OSErrors raised while reading the
+    process variable) are also counted.
+    """
+    stages = ('read', 'control', 'output', 'report', 'update')
+
+    def __init__(
+        self, name='controller', bounds=LatencyHistogram.default_bounds
+    ):
+        self.name = name
+        self.bounds = bounds
+        self.histograms = {
+            stage: LatencyHistogram(bounds) for stage in self.stages
+        }
+        self.control_names = ()
+        self.control_histograms = ()
+        self.reset()
+
+    def add_controls(self, controls):
+        self.control_names = tuple(
+            '{}:{}'.format(i, type(control).__name__)
+            for (i, control) in enumerate(controls)
+        )
+        self.control_histograms = tuple(
+            LatencyHistogram(self.bounds) for _ in controls
+        )
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        for histogram in self.control_histograms:
+            histogram.reset()
+        self.updates = 0
+        self.invalid_readings = 0
+        self.adc_errors = 0
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'updates': self.updates,
+            'invalid_readings': self.invalid_readings,
+            'adc_errors': self.adc_errors,
+            'stages': {
+                stage: histogram.as_dict()
+                for (stage, histogram) in self.histograms.items()
+            },
+            'controls': {
+                name: histogram.as_dict()
+                for (name, histogram)
+                in zip(self.control_names, self.control_histograms)
+            }
+        }
+
+    def format_prometheus(self):
+        """Return the metrics as Prometheus exposition format lines.
+
+        Lines are grouped in a dict by metric family, whose values are pairs
+        of the family's type and its sample lines.
+        """
+        families = {}
+        controller_label = 'controller="{}"'.format(self.name)
+        for (metric, value) in (
+            ('updates', self.updates),
+            ('invalid_readings', self.invalid_readings),
+            ('adc_errors', self.adc_errors)
+        ):
+            family = 'thermal_controller_{}_total'.format(metric)
+            families[family] = ('counter', [
+                '{}{{{}}} {}'.format(family, controller_label, value)
+            ])
+        family = 'thermal_controller_stage_duration_seconds'
+        families[family] = ('histogram', [])
+        for (stage, histogram) in self.histograms.items():
+            families[family][1].extend(format_prometheus_histogram(
+                family, '{},stage="{}"'.format(controller_label, stage),
+                histogram
+            ))
+        family = 'thermal_controller_control_duration_seconds'
+        families[family] = ('histogram', [])
+        for (name, histogram) in zip(
+            self.control_names, self.control_histograms
+        ):
+            families[family][1].extend(format_prometheus_histogram(
+                family, '{},control="{}"'.format(controller_label, name),
+                histogram
+            ))
+        return families
+
+
+def format_prometheus_histogram(metric, labels, histogram):
+    lines = []
+    cumulative_count = 0
+    for (bound, count) in zip(histogram.bounds, histogram.counts):
+        cumulative_count += count
+        lines.append('{}_bucket{{{},le="{:g}"}} {}'.format(
+            metric, labels, bound, cumulative_count
+        ))
+    lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+        metric, labels, histogram.count
+    ))
+    lines.append('{}_sum{{{}}} {!r}'.format(metric, labels, histogram.total))
+    lines.append('{}_count{{{}}} {}'.format(metric, labels, histogram.count))
+    return lines
+
+
+# Export
+
+class MetricsExporter(object):
+    """Periodically rewrite a snapshot of controller metrics to a file.
+
+    The snapshot is written in Prometheus text exposition format or as JSON
+    on a background thread, and atomically replaces the previous snapshot so
+    that scrapers never read a partially-written file.
+    """
+    formats = ('prometheus', 'json')
+
+    def __init__(
+        self, instrumentations, filename, interval=10.0,
+        metrics_format='prometheus'
+    ):
+        if metrics_format not in self.formats:
+            raise ValueError(
+                'Unknown metrics format: {}'.format(metrics_format)
+            )
+        self.instrumentations = tuple(instrumentations)
+        self.filename = filename
+        self.interval = interval
+        self.metrics_format = metrics_format
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def format_snapshot(self):
+        if self.metrics_format == 'json':
+            return json.dumps({
+                'time': time.time(),
+                'controllers': [
+                    instrumentation.as_dict()
+                    for instrumentation in self.instrumentations
+                ]
+            }, indent=2)
+
+        # Each metric family's samples must be contiguous
+        families = {}
+        for instrumentation in self.instrumentations:
+            for (family, (metric_type, family_lines)) in (
+                instrumentation.format_prometheus().items()
+            ):
+                families.setdefault(family, (metric_type, []))[1].extend(
+                    family_lines
+                )
+        lines = []
+        for (family, (metric_type, family_lines)) in families.items():
+            lines.append('# TYPE {} {}'.format(family, metric_type))
+            lines.extend(family_lines)
+        return '\n'.join(lines)
+
+    def write(self):
+        temporary_filename = '{}.tmp'.format(self.filename)
+        with open(temporary_filename, 'w') as f:
+            print(self.format_snapshot(), file=f)
+        os.replace(temporary_filename, self.filename)
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.write()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write()
@@ -2,6 +2,7 @@ import argparse
 import asyncio
 import os
 import time
+from datetime import datetime
 
 from picamera import PiCamera
 
@@ -16,13 +17,39 @@ from picamera_mqtt.util.async import (
 )
 
 import gpio
+import scheduling
 
 
 root_path = os.path.dirname(os.path.abspath(__file__))
 
 
 class IlluminatedTimelapseHost(timelapse_host.TimelapseHost):
-    def __init__(self, *args, **kwargs):
+    """Timelapse host which illuminates each camera's sample while imaging.
+
+    Cameras are imaged in illumination groups: the cameras of a group are
+    imaged concurrently with all of their lasers on, while groups are
+    imaged one after another, so that cameras whose illumination would
+    interfere should be put in separate groups. By default, each camera is
+    in its own group. Each laser is turned off as soon as its camera's
+    image is received, and images are saved on a worker thread so that the
+    next group can be requested while the previous images are still being
+    decoded and written.
+
+    Iterations start on absolute deadlines of the event loop's monotonic
+    clock, so the timelapse does not drift; iterations which overrun skip
+    the deadlines they missed. If a camera's image is not received within
+    capture_timeout seconds, its laser is turned off and the frame is
+    recorded as missed. Each frame's acquisition latency, from request to
+    receipt, is logged per camera to a CSV file in the capture directory.
+    """
+    latency_log_header = (
+        'Camera', 'Image ID', 'Request Time', 'Latency (s)', 'Status'
+    )
+
+    def __init__(
+        self, *args, illumination_groups=None, capture_timeout=20.0,
+        **kwargs
+    ):
         super().__init__(*args, **kwargs)
 
         self.lasers = {
@@ -36,11 +63,187 @@ class IlluminatedTimelapseHost(timelapse_host.TimelapseHost):
         }
         for laser in self.lasers.values():
             laser.turn_off()
+        if illumination_groups is None:
+            illumination_groups = [
+                [target_name] for target_name in self.target_names
+            ]
+        grouped_targets = [
+            target_name
+            for illumination_group in illumination_groups
+            for target_name in illumination_group
+        ]
+        if sorted(grouped_targets) != sorted(self.target_names):
+            raise ValueError(
+                'Illumination groups must contain each camera once: {}'
+                .format(', '.join(self.target_names))
+            )
+        self.illumination_groups = [
+            list(illumination_group)
+            for illumination_group in illumination_groups
+        ]
+        self.image_saves = set()
+        self.iterations = 0
+        self.iteration_time_total = 0.0
+        self.iteration_time_max = 0.0
+        self.capture_timeout = capture_timeout
+        self.scheduler = scheduling.LoopScheduler(
+            self.acquisition_interval, policy='skip',
+            clock=scheduling.EventLoopClock(self.loop)
+        )
+        self.requested_image_ids = {}
+        self.request_times = {}
+        self.received_frames = {
+            target_name: 0 for target_name in self.target_names
+        }
+        self.missed_frames = {
+            target_name: 0 for target_name in self.target_names
+        }
+        self.latency_totals = {
+            target_name: 0.0 for target_name in self.target_names
+        }
+        self.latency_maxes = {
+            target_name: 0.0 for target_name in self.target_names
+        }
+        self.latency_log = None
+
+    def save_captured_image(self, capture):
+        image_save = self.loop.run_in_executor(
+            None, super().save_captured_image, dict(capture)
+        )
+        self.image_saves.add(image_save)
+        image_save.add_done_callback(self.image_saves.discard)
 
     def save_captured_metadata(self, capture):
         super().save_captured_metadata(capture)
         target_name = capture['metadata']['client_name']
-        self.images_received[target_name].set_result(True)
+        image_id = capture['metadata']['image_id']
+        image_received = self.images_received[target_name]
+        if (
+            image_id == self.requested_image_ids.get(target_name)
+            and not image_received.done()
+        ):
+            image_received.set_result(True)
+        elif (target_name, image_id) in self.request_times:
+            # Received after its capture timed out
+            (request_time, request_loop_time) = self.request_times.pop(
+                (target_name, image_id)
+            )
+            print('Received image {} from {} after it was missed.'.format(
+                image_id, target_name
+            ))
+            self.log_latency(
+                target_name, image_id, request_time,
+                self.loop.time() - request_loop_time, 'late'
+            )
+
+    async def acquire_image(self, target_name):
+        """Illuminate a camera's sample until its image is received.
+
+        Returns whether the image was received before the capture timeout.
+        """
+        self.lasers[target_name].turn_on()
+        try:
+            image_id = self.image_ids[target_name]
+            self.images_received[target_name] = self.loop.create_future()
+            self.requested_image_ids[target_name] = image_id
+            request_loop_time = self.loop.time()
+            self.request_times[(target_name, image_id)] = (
+                time.time(), request_loop_time
+            )
+            self.request_image(target_name, extra_metadata={
+                'host': 'illuminated_timelapse_host'
+            })
+            try:
+                await asyncio.wait_for(
+                    self.images_received[target_name], self.capture_timeout
+                )
+            except asyncio.TimeoutError:
+                print(
+                    'Warning: no image {} from {} within {} s; missed frame!'
+                    .format(image_id, target_name, self.capture_timeout)
+                )
+                self.missed_frames[target_name] += 1
+                self.log_latency(
+                    target_name, image_id,
+                    self.request_times[(target_name, image_id)][0], None,
+                    'missed'
+                )
+                return False
+        finally:
+            self.lasers[target_name].turn_off()
+
+        latency = self.loop.time() - request_loop_time
+        (request_time, _) = self.request_times.pop((target_name, image_id))
+        self.received_frames[target_name] += 1
+        self.latency_totals[target_name] += latency
+        self.latency_maxes[target_name] = max(
+            self.latency_maxes[target_name], latency
+        )
+        self.log_latency(
+            target_name, image_id, request_time, latency, 'received'
+        )
+        return True
+
+    def log_latency(
+        self, target_name, image_id, request_time, latency, status
+    ):
+        if self.latency_log is None:
+            os.makedirs(self.capture_dir, exist_ok=True)
+            filename = os.path.join(
+                self.capture_dir, 'acquisition_latency_{}.csv'.format(
+                    datetime.now().isoformat(sep='_')
+                )
+            )
+            print('Logging acquisition latencies to {}...'.format(filename))
+            self.latency_log = open(filename, 'w')
+            print(','.join(self.latency_log_header), file=self.latency_log)
+        print('{},{},{},{},{}'.format(
+            target_name, image_id,
+            datetime.fromtimestamp(request_time).isoformat(sep='_'),
+            '{:.3f}'.format(latency) if latency is not None else '', status
+        ), file=self.latency_log)
+        self.latency_log.flush()
+
+    def print_summary(self):
+        print('Acquisition loop: {}'.format(self.scheduler.statistics))
+        for target_name in self.target_names:
+            received_frames = self.received_frames[target_name]
+            print(
+                '{}: {} frames received, {} missed; latency mean {}, max {}'
+                .format(
+                    target_name, received_frames,
+                    self.missed_frames[target_name],
+                    '{:.2f} s'.format(
+                        self.latency_totals[target_name] / received_frames
+                    ) if received_frames else '-',
+                    '{:.2f} s'.format(self.latency_maxes[target_name])
+                    if received_frames else '-'
+                )
+            )
+        if self.latency_log is not None:
+            self.latency_log.close()
+            self.latency_log = None
+
+    def report_iteration(self, iteration_time, group_times):
+        self.iterations += 1
+        self.iteration_time_total += iteration_time
+        self.iteration_time_max = max(self.iteration_time_max, iteration_time)
+        print(
+            'Iteration {}: acquired images in {:.2f} s (groups: {}); '
+            'mean {:.2f} s, max {:.2f} s'.format(
+                self.iterations, iteration_time,
+                ', '.join(
+                    '{:.2f} s'.format(group_time) for group_time in group_times
+                ),
+                self.iteration_time_total / self.iterations,
+                self.iteration_time_max
+            )
+        )
+        if iteration_time > self.acquisition_interval:
+            print(
+                'Warning: acquisition took longer than the {} s interval!'
+                .format(self.acquisition_interval)
+            )
 
     async def run_iteration(self):
         """Run one iteration of the run loop."""
@@ -48,23 +251,36 @@ class IlluminatedTimelapseHost(timelapse_host.TimelapseHost):
             await asyncio.sleep(timelapse_host.param_receive_poll_interval)
             return
 
+        self.scheduler.start_iteration()
         requested_image = False
-        interval_start_time = time.time()
-        for target_name in self.target_names:
-            if self.image_ids[target_name] <= self.acquisition_length:
-                self.lasers[target_name].turn_on()
-                self.images_received[target_name] = self.loop.create_future()
-                self.request_image(target_name, extra_metadata={
-                    'host': 'illuminated_timelapse_host'
-                })
-                await self.images_received[target_name]
-                self.lasers[target_name].turn_off()
-                requested_image = True
-        interval_end_time = time.time()
-        await asyncio.sleep(
-            self.acquisition_interval - (interval_end_time - interval_start_time)
-        )
+        interval_start_time = self.loop.time()
+        group_times = []
+        for illumination_group in self.illumination_groups:
+            target_names = [
+                target_name for target_name in illumination_group
+                if self.image_ids[target_name] <= self.acquisition_length
+            ]
+            if not target_names:
+                continue
+
+            group_start_time = self.loop.time()
+            await asyncio.gather(*(
+                self.acquire_image(target_name)
+                for target_name in target_names
+            ))
+            group_times.append(self.loop.time() - group_start_time)
+            requested_image = True
+        interval_end_time = self.loop.time()
+        if requested_image:
+            self.report_iteration(
+                interval_end_time - interval_start_time, group_times
+            )
+        self.scheduler.finish_iteration()
+        await asyncio.sleep(self.scheduler.time_until_next_iteration())
         if not requested_image:
+            if self.image_saves:
+                await asyncio.wait(self.image_saves)
+            self.print_summary()
             print(
                 'No more images to request. Quitting in {} seconds...'
                 .format(timelapse_host.final_image_receive_timeout)
@@ -89,6 +305,21 @@ if __name__ == '__main__':
         '--number', '-n', type=int, default=5,
         help='Number of images to acquire. Default: 5'
     )
+    parser.add_argument(
+        '--timeout', '-t', type=float, default=20.0,
+        help=(
+            'Time to wait for each image before recording it as missed, in '
+            'seconds. Default: 20'
+        )
+    )
+    parser.add_argument(
+        '--groups', '-g', type=str, nargs='+', default=None,
+        help=(
+            'Illumination groups of cameras imaged concurrently, each a '
+            'comma-separated list of camera names, e.g. camera_1,camera_2 '
+            'camera_3. Default: each camera in its own group'
+        )
+    )
     data_path = os.path.join(root_path, 'output')
     parser.add_argument(
         '--output_dir', '-o', type=str, default=data_path,
@@ -101,6 +332,9 @@ if __name__ == '__main__':
     acquisition_interval = args.interval
     acquisition_length = args.number
     capture_dir = args.output_dir
+    illumination_groups = None
+    if args.groups is not None:
+        illumination_groups = [group.split(',') for group in args.groups]
     configuration = config.load_config_from_args(args)
 
     register_keyboard_interrupt_signals()
@@ -112,7 +346,9 @@ if __name__ == '__main__':
         topics=topics, capture_dir=capture_dir,
         acquisition_interval=acquisition_interval,
         acquisition_length=acquisition_length,
-        camera_params=configuration['targets']
+        camera_params=configuration['targets'],
+        illumination_groups=illumination_groups,
+        capture_timeout=args.timeout
     )
     run_function(mqttc.run)
     print('Finished!')
@@ -0,0 +1,223 @@
+import time
+
+
+# Clocks
+
+class Clock(object):
+    """Source of wall and monotonic time which can sleep.
+
+    Timing-dependent code takes a clock so that simulations can substitute
+    a SimulatedClock.
+    """
+    realtime = True
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, duration):
+        if duration > 0:
+            time.sleep(duration)
+
+
+class SimulatedClock(Clock):
+    """Clock which only advances when sleeping or when advanced explicitly.
+
+    Simulations driven by this clock run as fast as they can compute, with
+    timing that is independent of the host's speed and load.
+    """
+    realtime = False
+
+    def __init__(self, start_time=None):
+        if start_time is None:
+            start_time = time.time()
+        self.start_time = start_time
+        self.elapsed = 0.0
+
+    def time(self):
+        return self.start_time + self.elapsed
+
+    def monotonic(self):
+        return self.elapsed
+
+    def sleep(self, duration):
+        if duration > 0:
+            self.elapsed += duration
+
+    def advance(self, duration):
+        self.sleep(duration)
+
+
+class EventLoopClock(Clock):
+    """Clock on the monotonic time of an asyncio event loop.
+
+    Coroutines must await asyncio.sleep rather than sleep on this clock,
+    which would block the event loop.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+
+    def monotonic(self):
+        return self.loop.time()
+
+    def sleep(self, duration):
+        raise RuntimeError('Await asyncio.sleep on an event loop clock.')
+
+
+system_clock = Clock()
+
+
+# Loop Statistics
+
+def format_ms(duration):
+    if duration is None:
+        return '-'
+    return '{:.2f} ms'.format(1000 * duration)
+
+
+class LoopStatistics(object):
+    """Running statistics of a periodic loop's timing."""
+    def __init__(self, interval):
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        self.iterations = 0
+        self.overruns = 0
+        self.missed_deadlines = 0
+        self.jitter_total = 0.0
+        self.jitter_min = None
+        self.jitter_max = None
+        self.duration_total = 0.0
+        self.duration_max = None
+        self.durations = 0
+
+    def record_start(self, jitter):
+        self.iterations += 1
+        self.jitter_total += jitter
+        if self.jitter_min is None or jitter < self.jitter_min:
+            self.jitter_min = jitter
+        if self.jitter_max is None or jitter > self.jitter_max:
+            self.jitter_max = jitter
+
+    def record_finish(self, duration, overrun):
+        self.durations += 1
+        self.duration_total += duration
+        if self.duration_max is None or duration > self.duration_max:
+            self.duration_max = duration
+        if overrun:
+            self.overruns += 1
+
+    def record_missed_deadlines(self, missed_deadlines):
+        self.missed_deadlines += missed_deadlines
+
+    @property
+    def jitter_mean(self):
+        if not self.iterations:
+            return None
+        return self.jitter_total / self.iterations
+
+    @property
+    def duration_mean(self):
+        if not self.durations:
+            return None
+        return self.duration_total / self.durations
+
+    def as_dict(self):
+        return {
+            'interval': self.interval,
+            'iterations': self.iterations,
+            'overruns': self.overruns,
+            'missed_deadlines': self.missed_deadlines,
+            'jitter_mean': self.jitter_mean,
+            'jitter_min': self.jitter_min,
+            'jitter_max': self.jitter_max,
+            'duration_mean': self.duration_mean,
+            'duration_max': self.duration_max
+        }
+
+    def __str__(self):
+        return (
+            '{} iterations at {}, {} overruns, {} missed deadlines; '
+            'jitter mean {}, min {}, max {}; duration mean {}, max {}'
+        ).format(
+            self.iterations, format_ms(self.interval),
+            self.overruns, self.missed_deadlines,
+            format_ms(self.jitter_mean), format_ms(self.jitter_min),
+            format_ms(self.jitter_max),
+            format_ms(self.duration_mean), format_ms(self.duration_max)
+        )
+
+
+# Loop Scheduling
+
+class LoopScheduler(object):
+    """Schedule loop iterations on absolute deadlines of a monotonic clock.
+
+    Deadlines are spaced exactly interval seconds apart, so the loop period
+    does not drift with the duration of each iteration. When the loop falls
+    more than a full interval behind, the catch_up policy runs the missed
+    iterations back-to-back, while the skip policy drops them and resumes at
+    the latest missed deadline. Iterations started before their deadline
+    (e.g. to resample an invalid reading) do not consume the deadline.
+    """
+    policies = ('catch_up', 'skip')
+
+    def __init__(self, interval, policy='skip', clock=None):
+        if policy not in self.policies:
+            raise ValueError('Unknown scheduling policy: {}'.format(policy))
+        self.interval = interval
+        self.policy = policy
+        self.clock = clock if clock is not None else system_clock
+        self.statistics = LoopStatistics(interval)
+        self.reset()
+
+    def reset(self):
+        self.next_deadline = None
+        self.iteration_start_time = None
+        self.statistics.reset()
+
+    def time_until_next_iteration(self):
+        if self.next_deadline is None:
+            return 0
+        return max(0, self.next_deadline - self.clock.monotonic())
+
+    def start_iteration(self):
+        current_time = self.clock.monotonic()
+        self.iteration_start_time = current_time
+        if self.next_deadline is None:
+            self.next_deadline = current_time
+        lateness = current_time - self.next_deadline
+        if lateness < 0:
+            return
+
+        if lateness >= self.interval:
+            if self.policy == 'skip':
+                missed_deadlines = int(lateness // self.interval)
+                self.next_deadline += missed_deadlines * self.interval
+                lateness -= missed_deadlines * self.interval
+            else:
+                # This iteration runs during a later iteration's time slot
+                missed_deadlines = 1
+            self.statistics.record_missed_deadlines(missed_deadlines)
+        self.statistics.record_start(lateness)
+        self.next_deadline += self.interval
+
+    def finish_iteration(self):
+        if self.iteration_start_time is None:
+            return
+
+        current_time = self.clock.monotonic()
+        self.statistics.record_finish(
+            current_time - self.iteration_start_time,
+            current_time > self.next_deadline
+        )
+        self.iteration_start_time = None
+
+    def wait(self):
+        """Finish any current iteration and start the next one on schedule."""
+        self.finish_iteration()
+        self.clock.sleep(self.time_until_next_iteration())
+        self.start_iteration()
@@ -0,0 +1,382 @@
+"""Declarative setpoint profiles with ramps, holds and repeat blocks.
+
+A profile is a JSON (or, with PyYAML installed, YAML) object with an
+optional name and start value, and a list of steps:
+    {'type': 'setpoint', 'value': 90, 'duration': 10}
+        Step to value, wait until it is reached, then hold it for duration
+        min, or indefinitely if duration is null. Steps without a type are
+        setpoint steps, so setpoint record sequences are valid profiles.
+    {'type': 'ramp', 'value': 40, 'rate': 5}
+        Ramp linearly from the previous value (or start) at rate deg C/min.
+    {'type': 'hold', 'duration': 2}
+        Hold the previous value for duration min.
+    {'type': 'repeat', 'count': 3, 'steps': [...]}
+        Repeat the nested steps count times.
+Every step also takes a recording flag and a name, and every setpoint, ramp
+or hold step takes an until_reached flag which delays its timing until the
+value is reached. Segments compiled from a repeat block are numbered by the
+block's iteration as their cycle. Profiles are validated and compiled into
+a flat list of segments before they are run, and a ProfileCursor evaluates
+the setpoint of a compiled profile in constant time per control loop
+iteration.
+"""
+import json
+import numbers
+import os
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+class ProfileError(ValueError):
+    """Error in the structure or values of a setpoint profile."""
+
+
+# Segments
+
+class Segment(object):
+    """Linear segment from start_value to end_value over duration seconds.
+
+    A duration of None holds end_value indefinitely. If until_reached is
+    set, the duration only starts once the start value is reached. Cycle is
+    the iteration of the innermost repeat block containing the segment.
+    """
+    def __init__(
+        self, start_value, end_value, duration, until_reached=False,
+        recording=True, path='', name=None, cycle=None
+    ):
+        self.start_value = start_value
+        self.end_value = end_value
+        self.duration = duration
+        self.until_reached = until_reached
+        self.recording = recording
+        self.path = path
+        self.name = name if name is not None else path
+        self.cycle = cycle
+        if duration:
+            self.slope = (end_value - start_value) / duration
+        else:
+            self.slope = 0.0
+
+    def value_at(self, elapsed):
+        return self.start_value + self.slope * elapsed
+
+    def __str__(self):
+        if self.duration is None:
+            duration = 'indefinitely'
+        else:
+            duration = 'for {:.2f} min'.format(self.duration / 60)
+        if self.start_value == self.end_value:
+            description = 'Hold {:.1f} deg C {}'.format(
+                self.end_value, duration
+            )
+        else:
+            description = 'Ramp {:.1f} to {:.1f} deg C {}'.format(
+                self.start_value, self.end_value, duration
+            )
+        if self.until_reached:
+            description += ' once reached'
+        if self.cycle is not None:
+            return '{} (cycle {}): {}'.format(
+                self.name, self.cycle, description
+            )
+        return '{}: {}'.format(self.name, description)
+
+
+class SetpointProfile(object):
+    """Compiled setpoint profile, as a flat list of segments."""
+    def __init__(self, segments, name='profile'):
+        self.segments = list(segments)
+        self.name = name
+
+    @property
+    def duration(self):
+        """Total duration in seconds, excluding waits until reached."""
+        if any(segment.duration is None for segment in self.segments):
+            return None
+        return sum(segment.duration for segment in self.segments)
+
+    def cursor(self):
+        return ProfileCursor(self)
+
+    def __str__(self):
+        duration = self.duration
+        lines = ['Profile {}: {} segments, {}'.format(
+            self.name, len(self.segments),
+            'indefinite' if duration is None
+            else '{:.1f} min'.format(duration / 60)
+        )]
+        lines.extend(str(segment) for segment in self.segments)
+        return '\n'.join(lines)
+
+
+class ProfileCursor(object):
+    """Evaluate a profile's setpoint over monotonically increasing times.
+
+    Each segment starts when the previous one ends, except that segments
+    which wait until reached start once the setpoint is reached. Advancing
+    past a segment costs constant time, so each update costs constant time
+    amortized over the profile.
+    """
+    def __init__(self, profile):
+        self.profile = profile
+        self.segments = profile.segments
+        self.start(None)
+
+    def start(self, start_time):
+        self.index = 0
+        self.entry_time = start_time
+        self.segment_start_time = None
+
+    @property
+    def finished(self):
+        return self.index >= len(self.segments)
+
+    @property
+    def segment(self):
+        if self.finished:
+            return None
+        return self.segments[self.index]
+
+    def update(self, current_time, setpoint_reached=False):
+        """Return the setpoint at current_time, or None once finished.
+
+        setpoint_reached is whether the controller has reached the setpoint
+        returned by the previous update.
+        """
+        if self.entry_time is None:
+            self.entry_time = current_time
+        while self.index < len(self.segments):
+            segment = self.segments[self.index]
+            if self.segment_start_time is None:
+                if not segment.until_reached:
+                    self.segment_start_time = self.entry_time
+                elif setpoint_reached:
+                    self.segment_start_time = current_time
+                else:
+                    return segment.start_value
+
+            if segment.duration is None:
+                return segment.end_value
+            elapsed = current_time - self.segment_start_time
+            if elapsed < segment.duration:
+                return segment.value_at(elapsed)
+
+            self.entry_time = self.segment_start_time + segment.duration
+            self.segment_start_time = None
+            self.index += 1
+            if (
+                self.index < len(self.segments)
+                and self.segments[self.index].start_value != segment.end_value
+            ):
+                setpoint_reached = False
+        return None
+
+
+# Validation and Compilation
+
+step_keys = {
+    'setpoint': ('value', 'duration', 'until_reached', 'recording', 'name'),
+    'ramp': ('value', 'rate', 'start', 'until_reached', 'recording', 'name'),
+    'hold': ('duration', 'until_reached', 'recording', 'name'),
+    'repeat': ('count', 'steps', 'recording', 'name')
+}
+
+
+def require_number(step, key, path, default=None, required=True):
+    if key not in step:
+        if required:
+            raise ProfileError('{}: missing {}'.format(path, key))
+        return default
+
+    value = step[key]
+    if isinstance(value, bool) or not isinstance(value, numbers.Real):
+        raise ProfileError('{}: {} must be a number, not {!r}'.format(
+            path, key, value
+        ))
+    return float(value)
+
+
+def require_flag(step, key, path, default):
+    value = step.get(key, default)
+    if not isinstance(value, bool):
+        raise ProfileError('{}: {} must be true or false, not {!r}'.format(
+            path, key, value
+        ))
+    return value
+
+
+def check_value(value, path, min_value, max_value):
+    if min_value is not None and value < min_value:
+        raise ProfileError('{}: value {:.1f} is below {:.1f}'.format(
+            path, value, min_value
+        ))
+    if max_value is not None and value > max_value:
+        raise ProfileError('{}: value {:.1f} is above {:.1f}'.format(
+            path, value, max_value
+        ))
+
+
+def compile_steps(
+    steps, value, path, min_value=None, max_value=None, recording=True,
+    cycle=None
+):
+    """Compile steps starting from value into (segments, final value)."""
+    if not isinstance(steps, list) or not steps:
+        raise ProfileError('{}: steps must be a non-empty list'.format(path))
+
+    segments = []
+    for (i, step) in enumerate(steps):
+        step_path = '{}[{}]'.format(path, i)
+        if not isinstance(step, dict):
+            raise ProfileError('{}: step must be an object'.format(step_path))
+        step_type = step.get('type', 'setpoint')
+        if step_type not in step_keys:
+            raise ProfileError('{}: unknown step type {!r}'.format(
+                step_path, step_type
+            ))
+        unknown_keys = set(step) - set(step_keys[step_type]) - {'type'}
+        if unknown_keys:
+            raise ProfileError('{}: unknown keys for {} step: {}'.format(
+                step_path, step_type, ', '.join(sorted(unknown_keys))
+            ))
+        step_recording = require_flag(step, 'recording', step_path, recording)
+        step_name = step.get('name')
+        if step_name is not None and not isinstance(step_name, str):
+            raise ProfileError('{}: name must be a string'.format(step_path))
+
+        if step_type == 'repeat':
+            count = step.get('count')
+            if isinstance(count, bool) or not isinstance(count, int) or (
+                count < 1
+            ):
+                raise ProfileError(
+                    '{}: count must be a positive integer'.format(step_path)
+                )
+            # Later iterations start from where the previous one ends
+            for iteration in range(count):
+                (body, value) = compile_steps(
+                    step.get('steps'), value, '{}.steps'.format(step_path),
+                    min_value=min_value, max_value=max_value,
+                    recording=step_recording, cycle=iteration + 1
+                )
+                segments.extend(body)
+            continue
+
+        until_reached = require_flag(
+            step, 'until_reached', step_path, step_type == 'setpoint'
+        )
+        if step_type == 'setpoint':
+            start_value = require_number(step, 'value', step_path)
+            end_value = start_value
+            if step.get('duration', 0) is None:
+                duration = None
+            else:
+                duration = require_number(step, 'duration', step_path)
+        elif step_type == 'ramp':
+            end_value = require_number(step, 'value', step_path)
+            start_value = require_number(
+                step, 'start', step_path, default=value, required=False
+            )
+            if start_value is None:
+                raise ProfileError(
+                    '{}: ramp needs a start value or a previous step'.format(
+                        step_path
+                    )
+                )
+            rate = require_number(step, 'rate', step_path)
+            if rate <= 0:
+                raise ProfileError('{}: rate must be positive'.format(
+                    step_path
+                ))
+            duration = 60 * abs(end_value - start_value) / rate
+        else:
+            if value is None:
+                raise ProfileError(
+                    '{}: hold needs a previous step'.format(step_path)
+                )
+            start_value = value
+            end_value = value
+            duration = require_number(step, 'duration', step_path)
+        if duration is not None:
+            if duration < 0:
+                raise ProfileError('{}: duration must not be negative'.format(
+                    step_path
+                ))
+            if step_type != 'ramp':
+                duration *= 60
+        check_value(start_value, step_path, min_value, max_value)
+        check_value(end_value, step_path, min_value, max_value)
+        segments.append(Segment(
+            start_value, end_value, duration, until_reached=until_reached,
+            recording=step_recording, path=step_path, name=step_name,
+            cycle=cycle
+        ))
+        value = end_value
+    return (segments, value)
+
+
+def compile_profile(
+    profile, name=None, min_value=None, max_value=None
+):
+    """Validate and compile a profile object or list of steps.
+
+    Raises ProfileError for any invalid step or value outside of
+    [min_value, max_value].
+    """
+    if isinstance(profile, list):
+        profile = {'steps': profile}
+    if not isinstance(profile, dict):
+        raise ProfileError('Profile must be an object or a list of steps')
+    unknown_keys = set(profile) - {'name', 'start', 'steps'}
+    if unknown_keys:
+        raise ProfileError('Unknown profile keys: {}'.format(
+            ', '.join(sorted(unknown_keys))
+        ))
+
+    start_value = require_number(profile, 'start', 'profile', required=False)
+    if start_value is not None:
+        check_value(start_value, 'profile', min_value, max_value)
+    (segments, _) = compile_steps(
+        profile.get('steps'), start_value, 'steps', min_value=min_value,
+        max_value=max_value
+    )
+    for segment in segments[:-1]:
+        if segment.duration is None:
+            raise ProfileError(
+                '{}: only the last step may hold indefinitely'.format(
+                    segment.path
+                )
+            )
+    if name is None:
+        name = profile.get('name', 'profile')
+    return SetpointProfile(segments, name=name)
+
+
+def load_profile(filename, **kwargs):
+    """Load, validate and compile a JSON or YAML profile file."""
+    (base, extension) = os.path.splitext(filename)
+    with open(filename) as f:
+        if extension in ('.yaml', '.yml'):
+            if yaml is None:
+                raise ProfileError(
+                    'PyYAML must be installed to load {}'.format(filename)
+                )
+            try:
+                profile = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ProfileError('Invalid YAML in {}: {}'.format(
+                    filename, e
+                ))
+        else:
+            try:
+                profile = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ProfileError('Invalid JSON in {}: {}'.format(
+                    filename, e
+                ))
+    if not (isinstance(profile, dict) and 'name' in profile):
+        kwargs.setdefault('name', os.path.basename(base))
+    return compile_profile(profile, **kwargs)
@@ -0,0 +1,313 @@
+"""Publish controller telemetry to shared memory for other processes.
+
+A SharedMemoryReporter publishes a controller's reports to a ring in
+shared memory, which TelemetryReaders in any number of other processes,
+such as thermal_telemetry.py, read without slowing the control loop.
+"""
+import atexit
+import json
+import os
+import struct
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    resource_tracker = None
+    shared_memory = None
+
+import thermal
+
+
+# Ring Layout
+
+telemetry_magic = b'TLMRING2'
+# Magic, capacity, fields, header length, owner PID, published records
+telemetry_header_struct = struct.Struct('<8sIIIIQ')
+telemetry_sequence_struct = struct.Struct('<Q')
+telemetry_published_offset = (
+    telemetry_header_struct.size - telemetry_sequence_struct.size
+)
+created_shared_memory_names = set()  # by SharedMemoryReporters
+
+
+# Publishing and Reading
+
+def open_shared_memory(name):
+    """Attach to an existing shared memory block without owning it."""
+    if shared_memory is None:
+        raise RuntimeError('Shared-memory telemetry requires Python 3.8+')
+
+    block = shared_memory.SharedMemory(name=name)
+    # Only the creator should unlink the block when it exits
+    if block.name not in created_shared_memory_names:
+        resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Owned by another user
+        return True
+    return True
+
+
+class SharedMemoryReporter(thermal.ControllerReporter):
+    """Controller reporter which publishes records to a shared-memory ring.
+
+    Each record is written once into the next slot of a ring of capacity
+    slots, and any number of TelemetryReaders in other processes can read
+    the ring at their own pace without blocking the control loop. Each slot
+    is guarded by a seqlock: its sequence number is marked odd while the
+    slot is written, and readers discard records whose sequence changed
+    while they copied them. Records are float64 values named by the CSV
+    header fields, with the absolute report time as the time; unset values
+    are NaN. Resetting the reporter keeps the ring, which is only unlinked
+    on close or at interpreter exit. A ring left behind by a process which
+    has exited is replaced, but opening a ring whose owner is still running
+    raises FileExistsError.
+
+    The seqlock relies on the sequence numbers and the record being stored
+    to shared memory in program order. Python issues no memory barriers
+    between them, so on weakly-ordered CPUs such as the Raspberry Pi's ARM
+    cores, a reader on another core may rarely accept a torn record. The
+    telemetry is meant for monitoring, not for control decisions.
+    """
+    def __init__(self, name, *args, capacity=4096, interval=0, **kwargs):
+        super().__init__(*args, interval=interval, **kwargs)
+        if shared_memory is None:
+            raise RuntimeError(
+                'Shared-memory telemetry requires Python 3.8+'
+            )
+        self.name = name
+        self.capacity = capacity
+        self.block = None
+        self.record_struct = None
+        self.published = 0
+        self.enable()
+
+    def open_report(self):
+        if self.block is not None:
+            return
+
+        fields = self.header_fields()
+        header = json.dumps({'fields': fields}).encode('utf-8')
+        header_length = telemetry_header_struct.size + len(header)
+        self.header_length = header_length + (-header_length % 8)
+        self.record_struct = struct.Struct('<' + 'd' * len(fields))
+        self.slot_size = (
+            2 * telemetry_sequence_struct.size + self.record_struct.size
+        )
+        size = self.header_length + self.capacity * self.slot_size
+        try:
+            self.block = shared_memory.SharedMemory(
+                name=self.name, create=True, size=size
+            )
+        except FileExistsError:
+            self.unlink_stale_block()
+            self.block = shared_memory.SharedMemory(
+                name=self.name, create=True, size=size
+            )
+        created_shared_memory_names.add(self.block.name)
+        atexit.register(self.close)
+        self.buffer = self.block.buf
+        self.published = 0
+        telemetry_header_struct.pack_into(
+            self.buffer, 0, telemetry_magic, self.capacity, len(fields),
+            self.header_length, os.getpid(), self.published
+        )
+        self.buffer[telemetry_header_struct.size:header_length] = header
+        print('Publishing telemetry to shared memory {}...'.format(
+            self.name
+        ))
+
+    def unlink_stale_block(self):
+        """Unlink a ring of the same name left behind by an exited process.
+
+        Raises FileExistsError if the ring's owner is still running or if
+        the block is not a telemetry ring.
+        """
+        block = shared_memory.SharedMemory(name=self.name)
+        owner_pid = None
+        if block.size >= telemetry_header_struct.size:
+            (magic, _, _, _, pid, _) = telemetry_header_struct.unpack_from(
+                block.buf, 0
+            )
+            if magic == telemetry_magic:
+                owner_pid = pid
+        if owner_pid is None or process_exists(owner_pid):
+            block.close()
+            resource_tracker.unregister(block._name, 'shared_memory')
+            if owner_pid is None:
+                raise FileExistsError(
+                    'Shared memory {} is not a telemetry ring'.format(
+                        self.name
+                    )
+                )
+            raise FileExistsError(
+                'Telemetry shared memory {} is in use by process {}'.format(
+                    self.name, owner_pid
+                )
+            )
+
+        print('Replacing telemetry left behind by process {}...'.format(
+            owner_pid
+        ))
+        block.close()
+        block.unlink()
+
+    def report_header(self):
+        pass
+
+    def close_report(self):
+        pass
+
+    def close(self):
+        if self.block is None:
+            return
+
+        self.buffer = None
+        created_shared_memory_names.discard(self.block.name)
+        self.block.close()
+        self.block.unlink()
+        self.block = None
+        atexit.unregister(self.close)
+
+    def report(
+        self, report_time, process_variable,
+        setpoint=None, setpoint_reached=None, control_efforts=[]
+    ):
+        nan = float('nan')
+        record = self.published
+        offset = (
+            self.header_length + (record % self.capacity) * self.slot_size
+        )
+        end_offset = offset + self.slot_size - telemetry_sequence_struct.size
+        telemetry_sequence_struct.pack_into(
+            self.buffer, offset, 2 * record + 1
+        )
+        self.record_struct.pack_into(
+            self.buffer, offset + telemetry_sequence_struct.size,
+            report_time,
+            process_variable,
+            setpoint if setpoint is not None else nan,
+            setpoint - process_variable if setpoint is not None else nan,
+            *(
+                effort if effort is not None else nan
+                for effort in control_efforts
+            ),
+            setpoint_reached if setpoint_reached is not None else nan
+        )
+        telemetry_sequence_struct.pack_into(
+            self.buffer, end_offset, 2 * record + 2
+        )
+        telemetry_sequence_struct.pack_into(
+            self.buffer, offset, 2 * record + 2
+        )
+        self.published = record + 1
+        telemetry_sequence_struct.pack_into(
+            self.buffer, telemetry_published_offset, self.published
+        )
+
+
+class TelemetryReader(object):
+    """Reader of a SharedMemoryReporter's ring from any process.
+
+    Each read returns the records published since the previous read, oldest
+    first, as tuples of the ring's fields. Records which were overwritten
+    before they could be read, because the reader fell more than the ring's
+    capacity behind, are counted as dropped. By default, the reader starts
+    from the newest record; with from_start, it starts from the oldest
+    record still in the ring.
+    """
+    def __init__(self, name, from_start=False):
+        self.name = name
+        self.block = open_shared_memory(name)
+        self.buffer = self.block.buf
+        (
+            magic, self.capacity, fields, self.header_length, self.owner_pid,
+            published
+        ) = telemetry_header_struct.unpack_from(self.buffer, 0)
+        if magic != telemetry_magic:
+            raise ValueError('{} is not a telemetry ring'.format(name))
+        header = bytes(
+            self.buffer[telemetry_header_struct.size:self.header_length]
+        )
+        self.fields = tuple(
+            json.loads(header.rstrip(b'\x00').decode('utf-8'))['fields']
+        )
+        self.record_struct = struct.Struct('<' + 'd' * fields)
+        self.slot_size = (
+            2 * telemetry_sequence_struct.size + self.record_struct.size
+        )
+        if from_start:
+            self.next_record = max(0, published - self.capacity)
+        else:
+            self.next_record = max(0, published - 1)
+        self.dropped = 0
+
+    @property
+    def published(self):
+        # Reread in case the count was torn by a concurrent write
+        while True:
+            (published,) = telemetry_sequence_struct.unpack_from(
+                self.buffer, telemetry_published_offset
+            )
+            if published == telemetry_sequence_struct.unpack_from(
+                self.buffer, telemetry_published_offset
+            )[0]:
+                return published
+
+    def read_record(self, record):
+        """Return a record, or None if it was overwritten while read."""
+        offset = (
+            self.header_length + (record % self.capacity) * self.slot_size
+        )
+        expected_sequence = 2 * record + 2
+        # Read in the reverse of the writer's order: the end sequence is
+        # written after the data, and the start sequence is marked odd
+        # before the data is overwritten, so rereading the start sequence
+        # after the copy detects any write which began during the copy
+        (end_sequence,) = telemetry_sequence_struct.unpack_from(
+            self.buffer, offset + self.slot_size
+            - telemetry_sequence_struct.size
+        )
+        if end_sequence != expected_sequence:
+            return None
+
+        values = self.record_struct.unpack_from(
+            self.buffer, offset + telemetry_sequence_struct.size
+        )
+        (start_sequence,) = telemetry_sequence_struct.unpack_from(
+            self.buffer, offset
+        )
+        if start_sequence != expected_sequence:
+            return None
+        return values
+
+    def read(self):
+        published = self.published
+        if published < self.next_record:  # The ring was recreated
+            self.next_record = 0
+        if published - self.next_record > self.capacity:
+            self.dropped += published - self.capacity - self.next_record
+            self.next_record = published - self.capacity
+        records = []
+        for record in range(self.next_record, published):
+            values = self.read_record(record)
+            if values is None:
+                self.dropped += 1
+            else:
+                records.append(values)
+        self.next_record = published
+        return records
+
+    def close(self):
+        if self.block is None:
+            return
+
+        self.buffer = None
+        self.block.close()
+        self.block = None
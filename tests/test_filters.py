@@ -0,0 +1,98 @@
+import pytest
+
+import filters
+
+
+def feed(sample_filter, samples):
+    return [sample_filter.update(sample) for sample in samples]
+
+
+def test_outlier_rejection():
+    sample_filter = filters.OutlierRejectionFilter(1.0, max_rejections=3)
+    assert feed(sample_filter, [20.0, 20.5, 30.0, 21.0]) == [
+        20.0, 20.5, 20.5, 21.0
+    ]
+    assert sample_filter.rejections == 0
+    assert sample_filter.total_rejections == 1
+
+
+def test_outlier_rejection_gives_up_on_steps():
+    sample_filter = filters.OutlierRejectionFilter(1.0, max_rejections=3)
+    assert feed(sample_filter, [20.0, 30.0, 30.0, 30.0, 30.0, 30.5]) == [
+        20.0, 20.0, 20.0, 20.0, 30.0, 30.5
+    ]
+    assert sample_filter.total_rejections == 3
+
+
+def test_outlier_rejection_reset():
+    sample_filter = filters.OutlierRejectionFilter(1.0)
+    feed(sample_filter, [20.0, 30.0])
+    sample_filter.reset()
+    assert (sample_filter.rejections, sample_filter.total_rejections) == (
+        0, 0
+    )
+    assert sample_filter.update(30.0) == 30.0
+
+
+def test_invalid_samples_pass_through():
+    sample_filter = filters.OutlierRejectionFilter(1.0, max_rejections=1)
+    assert feed(sample_filter, [20.0, None, 30.0, None, 30.0]) == [
+        20.0, None, 20.0, None, 30.0
+    ]
+
+
+def test_running_median_warm_up():
+    sample_filter = filters.RunningMedianFilter(5)
+    # Even counts average the middle two samples
+    assert feed(sample_filter, [3.0, 1.0, 4.0, 1.0, 5.0]) == [
+        3.0, 2.0, 3.0, 2.0, 3.0
+    ]
+
+
+def test_running_median_window():
+    sample_filter = filters.RunningMedianFilter(3)
+    assert feed(sample_filter, [1.0, 2.0, 3.0, 100.0, 4.0, 5.0, 5.0]) == [
+        1.0, 1.5, 2.0, 3.0, 4.0, 5.0, 5.0
+    ]
+
+
+def test_running_median_reset():
+    sample_filter = filters.RunningMedianFilter(3)
+    feed(sample_filter, [1.0, 2.0, 3.0, 4.0])
+    sample_filter.reset()
+    assert feed(sample_filter, [10.0, 20.0]) == [10.0, 15.0]
+
+
+def test_moving_average():
+    sample_filter = filters.MovingAverageFilter(3)
+    assert feed(sample_filter, [3.0, 6.0, 9.0, 12.0, 0.0]) == [
+        3.0, 4.5, 6.0, 9.0, 7.0
+    ]
+
+
+def test_moving_average_reset():
+    sample_filter = filters.MovingAverageFilter(3)
+    feed(sample_filter, [3.0, 6.0, 9.0, 12.0])
+    sample_filter.reset()
+    assert feed(sample_filter, [1.0, 2.0, 3.0, 4.0]) == [
+        1.0, 1.5, 2.0, 3.0
+    ]
+
+
+def test_filter_chain_reset():
+    chain = filters.FilterChain((
+        filters.OutlierRejectionFilter(1.0),
+        filters.RunningMedianFilter(3)
+    ))
+    feed(chain, [20.0, 20.5, 21.0])
+    assert chain.delay == 1.0
+    chain.reset()
+    assert chain.update(50.0) == 50.0
+
+
+@pytest.mark.parametrize('filter_class', [
+    filters.MovingAverageFilter, filters.RunningMedianFilter
+])
+def test_window_must_be_positive(filter_class):
+    with pytest.raises(ValueError):
+        filter_class(0)
@@ -0,0 +1,72 @@
+import pytest
+
+import scheduling
+
+
+def build_scheduler(policy='skip'):
+    clock = scheduling.SimulatedClock()
+    return (scheduling.LoopScheduler(0.25, policy=policy, clock=clock), clock)
+
+
+def test_deadlines_do_not_drift():
+    (scheduler, clock) = build_scheduler()
+    start_times = []
+    for _ in range(4):
+        scheduler.wait()
+        start_times.append(clock.monotonic())
+        clock.advance(0.125)  # iteration duration
+    assert start_times == [0.0, 0.25, 0.5, 0.75]
+    statistics = scheduler.statistics
+    assert statistics.iterations == 4
+    assert statistics.missed_deadlines == 0
+    assert statistics.jitter_max == 0.0
+
+
+def test_early_iteration_keeps_deadline():
+    (scheduler, clock) = build_scheduler()
+    scheduler.start_iteration()
+    scheduler.finish_iteration()
+    clock.advance(0.125)
+    scheduler.start_iteration()  # e.g. resampling an invalid reading
+    assert scheduler.next_deadline == 0.25
+    assert scheduler.time_until_next_iteration() == 0.125
+    assert scheduler.statistics.iterations == 1
+    scheduler.finish_iteration()
+    assert scheduler.statistics.overruns == 0
+
+
+def test_skip_drops_missed_deadlines():
+    (scheduler, clock) = build_scheduler('skip')
+    scheduler.start_iteration()
+    clock.advance(0.875)
+    scheduler.finish_iteration()
+    assert scheduler.statistics.overruns == 1
+    scheduler.start_iteration()
+    statistics = scheduler.statistics
+    assert statistics.missed_deadlines == 2
+    assert statistics.jitter_max == 0.125  # behind the latest deadline
+    assert scheduler.next_deadline == 1.0
+    assert scheduler.time_until_next_iteration() == 0.125
+
+
+def test_catch_up_runs_missed_iterations():
+    (scheduler, clock) = build_scheduler('catch_up')
+    scheduler.start_iteration()
+    clock.advance(0.875)
+    scheduler.finish_iteration()
+    back_to_back = 0
+    while scheduler.time_until_next_iteration() == 0:
+        scheduler.start_iteration()
+        scheduler.finish_iteration()
+        back_to_back += 1
+    statistics = scheduler.statistics
+    assert back_to_back == 3
+    assert statistics.iterations == 4
+    assert statistics.missed_deadlines == 2
+    assert statistics.jitter_max == 0.625
+    assert scheduler.next_deadline == 1.0
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        scheduling.LoopScheduler(0.25, policy='drop')
@@ -0,0 +1,87 @@
+import pytest
+
+import scheduling
+import thermal
+
+
+def feed(detector, clock, errors, interval=1.0):
+    """Update the detector with errors at intervals; return the results."""
+    results = []
+    for error in errors:
+        results.append(detector.update(error))
+        clock.advance(interval)
+    return results
+
+
+def test_settles_after_dwell_time():
+    clock = scheduling.SimulatedClock()
+    detector = thermal.SettlingDetector(0.5, 10.0, clock=clock)
+    results = feed(detector, clock, [0.2] * 12)
+    assert results == [False] * 10 + [True] * 2
+    assert detector.settle_time == 10.0
+
+
+def test_dwell_restarts_after_overshoot():
+    clock = scheduling.SimulatedClock()
+    detector = thermal.SettlingDetector(0.5, 10.0, clock=clock)
+    results = feed(detector, clock, [0.2] * 5 + [-0.8] + [-0.2] * 11)
+    assert not any(results[:16])
+    assert results[16]
+    assert detector.settle_time == 16.0
+    assert detector.min_error == -0.2
+
+
+def test_rolling_min_max_and_std():
+    clock = scheduling.SimulatedClock()
+    detector = thermal.SettlingDetector(0.5, 3.0, max_std=0.1, clock=clock)
+    results = feed(
+        detector, clock, [0.4, -0.4, 0.4, -0.4, 0.1, 0.1, 0.1, 0.1]
+    )
+    assert (detector.min_error, detector.max_error) == (0.1, 0.1)
+    assert detector.std == pytest.approx(0.0, abs=1e-6)
+    # Swings within the band settle only once they leave the window
+    assert results == [False] * 7 + [True]
+
+
+def test_invalid_errors_are_skipped():
+    clock = scheduling.SimulatedClock()
+    detector = thermal.SettlingDetector(0.5, 2.0, clock=clock)
+    results = feed(detector, clock, [0.1, None, None, 0.1])
+    assert results == [False, False, False, True]
+
+
+def test_settling_latches_until_reset():
+    clock = scheduling.SimulatedClock()
+    detector = thermal.SettlingDetector(0.5, 2.0, clock=clock)
+    feed(detector, clock, [0.1] * 3)
+    assert detector.update(5.0)
+    assert detector.settle_time == 2.0
+    detector.reset()
+    assert not detector.update(0.1)
+    assert detector.settle_time is None
+
+
+def test_setpoint_change_resets_settling():
+    clock = scheduling.SimulatedClock()
+    control = thermal.ProportionalControl(
+        0.1, initial_setpoint=50.0,
+        settling_detector=thermal.SettlingDetector(0.5, 2.0, clock=clock)
+    )
+    for _ in range(3):
+        control.update(50.2)
+        clock.advance(1.0)
+    assert control.setpoint_reached
+    control.set_setpoint(50.0)
+    assert control.setpoint_reached
+    control.set_setpoint(60.0)
+    assert not control.setpoint_reached
+    assert control.settle_time is None
+    for _ in range(3):
+        control.update(50.2)
+        clock.advance(1.0)
+    assert not control.setpoint_reached
+    for _ in range(3):
+        control.update(59.9)
+        clock.advance(1.0)
+    assert control.setpoint_reached
+    assert control.settle_time == 5.0  # since the setpoint change
@@ -0,0 +1,47 @@
+import pytest
+
+import scheduling
+import thermal
+
+
+def build_controller(clock, min_on_time=5.0, min_off_time=5.0):
+    return thermal.SplitRangeHeaterFanController(
+        None, thermal.PIDControl(1.0, 0.0, 0.0, min_output=-1.0), None,
+        None,
+        fan_limiter=thermal.MinimumOnOffTime(
+            min_on_time=min_on_time, min_off_time=min_off_time,
+            min_effort=0.2, clock=clock
+        )
+    )
+
+
+def test_split_effort():
+    controller = build_controller(scheduling.SimulatedClock())
+    assert controller.split_effort(0.6) == (0.6, 0.0)
+    assert controller.split_effort(None) == (None, None)
+
+
+def test_held_on_fan_with_heating_request():
+    clock = scheduling.SimulatedClock()
+    controller = build_controller(clock)
+    assert controller.split_effort(-0.5) == (0.0, 0.5)
+    clock.advance(1.0)
+    assert controller.split_effort(0.6) == (0.0, 0.2)
+    clock.advance(5.0)
+    assert controller.split_effort(0.6) == (0.6, 0.0)
+    assert controller.fan_limiter.switches == 2
+
+
+def test_held_off_fan_with_cooling_request():
+    clock = scheduling.SimulatedClock()
+    controller = build_controller(clock)
+    controller.split_effort(-0.5)
+    clock.advance(5.0)
+    assert controller.split_effort(0.6) == (0.6, 0.0)
+    clock.advance(1.0)
+    assert controller.split_effort(-0.5) == (0.0, 0.0)
+
+
+def test_min_on_time_requires_min_effort():
+    with pytest.raises(ValueError):
+        thermal.MinimumOnOffTime(min_on_time=5.0, min_effort=0.0)
@@ -0,0 +1,97 @@
+import os
+import subprocess
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import pytest
+
+import telemetry
+
+
+class InterruptingStruct(object):
+    """Struct which calls interrupt right after unpacking, like a preempted
+    reader whose copy is followed by a write."""
+    def __init__(self, record_struct, interrupt):
+        self.record_struct = record_struct
+        self.interrupt = interrupt
+        self.size = record_struct.size
+
+    def unpack_from(self, buffer, offset=0):
+        values = self.record_struct.unpack_from(buffer, offset)
+        self.interrupt()
+        return values
+
+
+@pytest.fixture
+def ring():
+    reporter = telemetry.SharedMemoryReporter(
+        'test_telemetry_{}'.format(os.getpid()), capacity=2
+    )
+    for temperature in (25.0, 26.0):
+        reporter.update(temperature, setpoint=30.0, control_efforts=[0.5])
+    reader = telemetry.TelemetryReader(reporter.name, from_start=True)
+    yield (reporter, reader)
+    reader.close()
+    reporter.close()
+
+
+def begin_write(reporter, record):
+    """Perform only the first step of the writer's write of a record."""
+    offset = (
+        reporter.header_length
+        + (record % reporter.capacity) * reporter.slot_size
+    )
+    telemetry.telemetry_sequence_struct.pack_into(
+        reporter.buffer, offset, 2 * record + 1
+    )
+
+
+def test_read_complete_records(ring):
+    (_, reader) = ring
+    records = reader.read()
+    assert [record[1] for record in records] == [25.0, 26.0]
+    assert reader.dropped == 0
+
+
+def test_write_in_progress_before_read(ring):
+    (reporter, reader) = ring
+    begin_write(reporter, reporter.capacity)
+    assert reader.read_record(0) is None
+    assert reader.read_record(1) is not None
+
+
+def test_write_begun_during_copy(ring):
+    (reporter, reader) = ring
+    reader.record_struct = InterruptingStruct(
+        reader.record_struct,
+        lambda: begin_write(reporter, reporter.capacity)
+    )
+    assert reader.read_record(0) is None
+
+
+def test_ring_in_use(ring):
+    (reporter, _) = ring
+    other = telemetry.SharedMemoryReporter(reporter.name, capacity=2)
+    with pytest.raises(FileExistsError):
+        other.update(25.0, setpoint=30.0, control_efforts=[0.5])
+    assert reporter.block is not None
+
+
+def test_replace_stale_ring():
+    name = 'test_telemetry_stale_{}'.format(os.getpid())
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    block = shared_memory.SharedMemory(name=name, create=True, size=64)
+    telemetry.telemetry_header_struct.pack_into(
+        block.buf, 0, telemetry.telemetry_magic, 1, 1, 64, exited.pid, 0
+    )
+    block.close()  # Left behind without being unlinked
+    resource_tracker.unregister(block._name, 'shared_memory')
+
+    reporter = telemetry.SharedMemoryReporter(name, capacity=2)
+    reporter.update(25.0, setpoint=30.0, control_efforts=[0.5])
+    reader = telemetry.TelemetryReader(name, from_start=True)
+    assert reader.owner_pid == os.getpid()
+    assert [record[1] for record in reader.read()] == [25.0]
+    reader.close()
+    reporter.close()
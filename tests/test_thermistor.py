@@ -0,0 +1,41 @@
+import pytest
+
+import thermal
+
+
+class FixedPin(object):
+    def __init__(self, raw, gain=1):
+        self.raw = raw
+        self.gain = gain
+
+    def read_raw(self):
+        return self.raw
+
+
+def build_thermistor(**kwargs):
+    return thermal.Thermistor(
+        FixedPin(20000), FixedPin(4000), bias_resistance=1960,
+        A=0.0010349722285233954, B=0.00022717987892035313,
+        C=3.008424040777896e-07, **kwargs
+    )
+
+
+def test_lookup_table_matches_exact():
+    exact = build_thermistor()
+    lookup = build_thermistor(lookup_table_size=32768)
+    assert lookup.read() == pytest.approx(exact.read(), abs=0.02)
+
+
+@pytest.mark.parametrize('parameter,factor', [
+    ('bias_resistance', 1.5), ('A', 1.01), ('B', 1.01), ('C', 2.0)
+])
+def test_lookup_table_follows_parameters(parameter, factor):
+    exact = build_thermistor()
+    lookup = build_thermistor(lookup_table_size=32768)
+    original = lookup.read()
+    for thermistor in (exact, lookup):
+        setattr(
+            thermistor, parameter, getattr(thermistor, parameter) * factor
+        )
+    assert lookup.read() != pytest.approx(original, abs=0.1)
+    assert lookup.read() == pytest.approx(exact.read(), abs=0.02)
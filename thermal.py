@@ -1,10 +1,22 @@
+import atexit
+import collections
+import math
+import os
+import queue
+import struct
 import sys
+import threading
 import time
 from datetime import datetime
 
 import numpy as np
 from simple_pid import PID
 
+import scheduling
+
+
+root_path = os.path.dirname(os.path.abspath(__file__))
+
 
 # Components
 
@@ -13,43 +25,237 @@ class ProcessVariable(object):
         return None
 
 
+def lookup_table_parameter(name):
+    """Return a property which invalidates the lookup table when set."""
+    attribute = '_' + name
+
+    def get(self):
+        return getattr(self, attribute)
+
+    def set(self, value):
+        setattr(self, attribute, value)
+        self.lookup_table = None
+
+    return property(get, set)
+
+
 class Thermistor(ProcessVariable):
+    """Thermistor in a voltage divider with a bias resistor.
+
+    If differential is True, thermistor_pin is a differential pin measuring
+    the thermistor voltage relative to the reference voltage, so that the
+    referenced reading takes a single conversion. It must use the same gain
+    as the reference pin. If temperature_filter is specified, it filters
+    each temperature read, in Kelvin, before it is returned. Changing the
+    bias resistance or coefficients rebuilds the lookup table on the next
+    read.
+    """
+    bias_resistance = lookup_table_parameter('bias_resistance')
+    A = lookup_table_parameter('A')
+    B = lookup_table_parameter('B')
+    C = lookup_table_parameter('C')
+
     def __init__(
         self, reference_pin, thermistor_pin, bias_resistance=1962,
-        A=1.125308852122e-03, B=2.34711863267e-04, C=8.5663516e-08
+        A=1.125308852122e-03, B=2.34711863267e-04, C=8.5663516e-08,
+        lookup_table_size=None, differential=False, temperature_filter=None
     ):
         self.reference_pin = reference_pin
         self.thermistor_pin = thermistor_pin
+        self.differential = differential
+        if (
+            differential and reference_pin is not None
+            and thermistor_pin is not None
+            and reference_pin.gain != thermistor_pin.gain
+        ):
+            raise ValueError(
+                'Differential thermistor pin gain {} does not match '
+                'reference pin gain {}!'.format(
+                    thermistor_pin.gain, reference_pin.gain
+                )
+            )
         self.reading = None
         self.referenced_reading = None
         self.bias_resistance = bias_resistance
         self.A = A
         self.B = B
         self.C = C
+        self.lookup_table_size = lookup_table_size
+        self.lookup_table = None
+        if self.lookup_table_size is not None:
+            self.build_lookup_table()
+        self.temperature_filter = temperature_filter
 
     def calibrate_steinhart_hart(self, temperature_resistance_pairs, unit='C'):
         (temperatures, resistances) = zip(*temperature_resistance_pairs)
 
-        T = np.array(temperatures)
-        if unit == 'K':
-            pass
-        elif unit == 'C':
-            T = T + 273.15
-        else:
-            raise ValueError('Unknown temperature unit: {}'.format(unit))
+        T = self.convert_to_kelvin(np.array(temperatures), unit)
         b = 1 / T
 
         R = np.expand_dims(np.array(resistances), axis=1)
         A = np.hstack((np.ones_like(R), np.log(R), np.power(np.log(R), 3)))
         (coeffs, residuals, rank, singular_values) = np.linalg.lstsq(A, b)
-        (self.A, self.B, self.C) = coeffs
+        (self.A, self.B, self.C) = (float(coeff) for coeff in coeffs)
+        if self.lookup_table_size is not None:
+            self.build_lookup_table()
         return (coeffs, residuals)
 
+    def steinhart_hart(self, resistance):
+        """Convert resistance (scalar or array) to temperature in Kelvin."""
+        log_resistance = np.log(resistance)
+        return 1 / (
+            self.A + self.B * log_resistance
+            + self.C * np.power(log_resistance, 3)
+        )
+
+    def inverse_steinhart_hart(self, temperature):
+        """Convert temperature (scalar or array) in Kelvin to resistance."""
+        x = (self.A - 1 / np.asarray(temperature, dtype=float)) / self.C
+        y = np.sqrt(np.power(self.B / (3 * self.C), 3) + np.power(x, 2) / 4)
+        return np.exp(np.cbrt(y - x / 2) - np.cbrt(y + x / 2))
+
+    def convert_kelvin(self, temperature, unit='C'):
+        if unit == 'K':
+            return temperature
+        elif unit == 'C':
+            return temperature - 273.15
+        else:
+            raise ValueError('Unknown temperature unit: {}'.format(unit))
+
+    def convert_to_kelvin(self, temperature, unit='C'):
+        if unit == 'K':
+            return temperature
+        elif unit == 'C':
+            return temperature + 273.15
+        else:
+            raise ValueError('Unknown temperature unit: {}'.format(unit))
+
+    # Batch conversion
+
+    def compute_resistances(self, readings, referenced_readings):
+        """Convert arrays of raw readings to thermistor resistances.
+
+        Returns a (resistances, valid) pair of arrays. Samples with a
+        non-positive referenced reading are invalid and have NaN resistance.
+        """
+        readings = np.asarray(readings, dtype=float)
+        referenced_readings = np.asarray(referenced_readings, dtype=float)
+        valid = referenced_readings > 0
+        resistances = np.full(
+            np.broadcast(readings, referenced_readings).shape, np.nan
+        )
+        np.divide(
+            readings * self.bias_resistance, referenced_readings,
+            out=resistances, where=valid
+        )
+        return (resistances, valid)
+
+    def compute_temperatures(self, resistances, unit='C'):
+        """Convert an array of thermistor resistances to temperatures."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            temperatures = self.steinhart_hart(
+                np.asarray(resistances, dtype=float)
+            )
+        return self.convert_kelvin(temperatures, unit)
+
+    def convert_readings(self, readings, referenced_readings, unit='C'):
+        """Convert arrays of raw readings to temperatures.
+
+        Returns a (temperatures, valid) pair of arrays, where invalid samples
+        have NaN temperature.
+        """
+        (resistances, valid) = self.compute_resistances(
+            readings, referenced_readings
+        )
+        return (self.compute_temperatures(resistances, unit=unit), valid)
+
+    def convert_raw_readings(self, reference_readings, readings, unit='C'):
+        """Convert arrays of raw reference and thermistor pin readings."""
+        readings = np.asarray(readings)
+        return self.convert_readings(
+            readings, np.asarray(reference_readings) - readings, unit=unit
+        )
+
+    def recalibrate_temperatures(self, temperatures, thermistor, unit='C'):
+        """Convert temperatures measured with another thermistor's coefficients.
+
+        This recovers the measured resistances with the other thermistor's
+        coefficients and converts them with this thermistor's coefficients.
+        """
+        resistances = thermistor.inverse_steinhart_hart(
+            thermistor.convert_to_kelvin(
+                np.asarray(temperatures, dtype=float), unit
+            )
+        )
+        return self.compute_temperatures(resistances, unit=unit)
+
+    # Lookup table
+
+    def compute_lookup_table_fractions(self, size):
+        """Return the thermistor voltage fraction represented by each bucket.
+
+        The endpoint buckets correspond to zero and infinite resistance, so
+        they are saturated to their nearest interior neighbors.
+        """
+        fractions = np.linspace(0.0, 1.0, size)
+        return np.clip(fractions, fractions[1], fractions[-2])
+
+    def compute_lookup_table(self, size):
+        fractions = self.compute_lookup_table_fractions(size)
+        (resistances, _) = self.compute_resistances(fractions, 1 - fractions)
+        return self.compute_temperatures(resistances, unit='K')
+
+    def build_lookup_table(self):
+        """Build the Kelvin lookup table.
+
+        The table is kept as a list, whose indexing is much faster than an
+        array's. It is not cached to disk, since loading a cached array and
+        converting it to a list takes about as long as building it.
+        """
+        size = self.lookup_table_size
+        if size < 3:
+            raise ValueError('Lookup table size must be at least 3!')
+        table = self.compute_lookup_table(size)
+        self.lookup_table = table.tolist()
+        self.lookup_table_scale = float(size - 1)
+        self.lookup_table_max_index = size - 1
+        return table
+
+    def lookup_table_error(
+        self, min_temperature=0.0, max_temperature=150.0, unit='C'
+    ):
+        """Return the worst-case lookup table error within a temperature range.
+
+        Any reading mapped to a bucket lies within half a bucket of the
+        bucket's center, so the error bound is the largest temperature change
+        across half a bucket, over the buckets in the given range.
+        """
+        if self.lookup_table is None:
+            self.build_lookup_table()
+        size = self.lookup_table_size
+        fractions = self.compute_lookup_table_fractions(size)[1:-1]
+        half_step = 0.5 / (size - 1)
+        table = self.convert_kelvin(np.array(self.lookup_table[1:-1]), unit)
+        in_range = (table >= min_temperature) & (table <= max_temperature)
+        fractions = fractions[in_range]
+        table = table[in_range]
+        errors = [
+            np.abs(
+                self.convert_readings(bound, 1 - bound, unit=unit)[0] - table
+            )
+            for bound in (fractions - half_step, fractions + half_step)
+        ]
+        return float(max(np.max(errors[0]), np.max(errors[1])))
+
     def read_voltage(self):
         ref = self.reference_pin.read_raw()
-        reading = self.thermistor_pin.read_raw()
-        self.reading = reading
-        self.referenced_reading = ref - reading
+        if self.differential:
+            self.referenced_reading = -self.thermistor_pin.read_raw()
+            self.reading = ref - self.referenced_reading
+        else:
+            reading = self.thermistor_pin.read_raw()
+            self.reading = reading
+            self.referenced_reading = ref - reading
         return (self.reading, self.referenced_reading)
 
     def read_resistance(self):
@@ -59,31 +265,323 @@ class Thermistor(ProcessVariable):
 
         return reading * self.bias_resistance / referenced_reading
 
-    def read(self, unit='C'):
-        R = self.read_resistance()
-        if R is None:
+    def read_lookup_table(self):
+        (reading, referenced_reading) = self.read_voltage()
+        if referenced_reading <= 0:
             return None
 
-        T_Kelvin = float(
-            1 / (self.A + self.B * np.log(R) + self.C * np.power(np.log(R), 3))
+        index = int(
+            reading * self.lookup_table_scale / (reading + referenced_reading)
+            + 0.5
         )
-        if unit == 'K':
-            return T_Kelvin
-        elif unit == 'C':
-            T_Celsius = T_Kelvin - 273.15
-            return T_Celsius
+        if index < 0:
+            index = 0
+        elif index > self.lookup_table_max_index:
+            index = self.lookup_table_max_index
+        return self.lookup_table[index]
+
+    def read(self, unit='C'):
+        if self.lookup_table is None and self.lookup_table_size is not None:
+            self.build_lookup_table()
+        if self.lookup_table is not None:
+            T_Kelvin = self.read_lookup_table()
+            if T_Kelvin is None:
+                return None
         else:
-            raise ValueError('Unknown temperature unit: {}'.format(unit))
+            R = self.read_resistance()
+            if R is None:
+                return None
+
+            T_Kelvin = float(self.steinhart_hart(R))
+        if self.temperature_filter is not None:
+            T_Kelvin = self.temperature_filter.update(T_Kelvin)
+        return self.convert_kelvin(T_Kelvin, unit)
+
+
+# Plant Modeling
+
+class ThermalModel(object):
+    """Lumped thermal model of a heater block with fan cooling.
+
+    The block temperature T (deg C) follows
+        dT/dt = heating_rate * heater
+                - (ambient_loss_rate + fan_loss_rate * fan)
+                * (T - ambient_temperature)
+    for heater and fan duties between 0 and 1, and the thermistor
+    temperature lags T with a first-order sensor_time_constant (s).
+    """
+    parameter_names = (
+        'heating_rate', 'ambient_loss_rate', 'fan_loss_rate',
+        'ambient_temperature', 'sensor_time_constant'
+    )
+
+    def __init__(
+        self, heating_rate, ambient_loss_rate, fan_loss_rate,
+        ambient_temperature=25.0, sensor_time_constant=0.0
+    ):
+        self.heating_rate = heating_rate
+        self.ambient_loss_rate = ambient_loss_rate
+        self.fan_loss_rate = fan_loss_rate
+        self.ambient_temperature = ambient_temperature
+        self.sensor_time_constant = sensor_time_constant
+
+    @property
+    def parameters(self):
+        return tuple(getattr(self, name) for name in self.parameter_names)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, float(value))
+            for (name, value) in zip(self.parameter_names, self.parameters)
+        ))
+
+    def loss_rate(self, fan):
+        return self.ambient_loss_rate + self.fan_loss_rate * fan
+
+    def derivative(self, temperature, heater, fan):
+        return (
+            self.heating_rate * heater
+            - self.loss_rate(fan) * (temperature - self.ambient_temperature)
+        )
+
+    def equilibrium_temperature(self, heater, fan):
+        return (
+            self.ambient_temperature
+            + self.heating_rate * heater / self.loss_rate(fan)
+        )
+
+    def step(self, temperature, sensor_temperature, heater, fan, dt):
+        """Advance the block and sensor temperatures by dt seconds.
+
+        Inputs are held constant over the step, which is integrated exactly.
+        """
+        equilibrium = self.equilibrium_temperature(heater, fan)
+        temperature = (
+            equilibrium
+            + (temperature - equilibrium) * np.exp(-self.loss_rate(fan) * dt)
+        )
+        if self.sensor_time_constant > 0:
+            sensor_temperature += (temperature - sensor_temperature) * (
+                1 - np.exp(-dt / self.sensor_time_constant)
+            )
+        else:
+            sensor_temperature = temperature
+        return (float(temperature), float(sensor_temperature))
+
+    def simulate(self, times, heaters, fans, initial_temperature):
+        """Simulate sensor temperatures for recorded heater and fan duties."""
+        sensor_temperatures = np.empty(len(times))
+        temperature = initial_temperature
+        sensor_temperature = initial_temperature
+        for (i, dt) in enumerate(np.diff(times)):
+            sensor_temperatures[i] = sensor_temperature
+            (temperature, sensor_temperature) = self.step(
+                temperature, sensor_temperature, heaters[i], fans[i], dt
+            )
+        sensor_temperatures[-1] = sensor_temperature
+        return sensor_temperatures
+
+    def compute_rms_error(self, datasets):
+        errors = [
+            self.simulate(times, heaters, fans, temperatures[0])
+            - temperatures
+            for (times, temperatures, heaters, fans) in datasets
+        ]
+        return float(np.sqrt(np.mean(np.concatenate(errors) ** 2)))
+
+    @staticmethod
+    def load_report(filename):
+        """Load (times, temperatures, heater duties, fan duties) from a CSV.
+
+        The CSV must have the ControllerReporter column layout for a heater
+        and fan controller.
+        """
+        data = np.genfromtxt(
+            filename, delimiter=',', skip_header=1, usecols=(0, 1, 4, 5)
+        )
+        data = data[~np.isnan(data).any(axis=1)]
+        return tuple(data.T)
+
+    @classmethod
+    def fit(
+        cls, datasets, ambient_temperature=25.0, smoothing_window=10,
+        iterations=100, fixed_parameters=(), verbose=False
+    ):
+        """Fit model parameters to (times, temperatures, heaters, fans) data.
+
+        An initial guess comes from a least-squares fit of the smoothed
+        temperature derivative, which is then refined by a pattern search
+        minimizing the RMS error of open-loop simulations of the data.
+        Parameters named in fixed_parameters keep their initial guesses.
+        """
+        for name in fixed_parameters:
+            if name not in cls.parameter_names:
+                raise ValueError('Unknown model parameter: {}'.format(name))
+
+        window = np.ones(smoothing_window) / smoothing_window
+        (features, targets) = ([], [])
+        for (times, temperatures, heaters, fans) in datasets:
+            (times, temperatures, heaters, fans) = (
+                np.convolve(values, window, mode='valid')
+                for values in (times, temperatures, heaters, fans)
+            )
+            excess_temperatures = temperatures - ambient_temperature
+            features.append(np.column_stack((
+                heaters, -excess_temperatures, -fans * excess_temperatures
+            )))
+            targets.append(np.gradient(temperatures, times))
+        (coeffs, _, _, _) = np.linalg.lstsq(
+            np.vstack(features), np.concatenate(targets), rcond=None
+        )
+        parameters = np.array(
+            [max(coeff, 0) for coeff in coeffs] + [ambient_temperature, 0.0]
+        )
+        steps = np.maximum(0.1 * np.abs(parameters), [0, 0, 0, 1.0, 1.0])
+        best_error = cls(*parameters).compute_rms_error(datasets)
+        for iteration in range(iterations):
+            improved = False
+            for (i, name) in enumerate(cls.parameter_names):
+                if name in fixed_parameters:
+                    continue
+                for direction in (1, -1):
+                    candidate = parameters.copy()
+                    candidate[i] += direction * steps[i]
+                    if i != 3 and candidate[i] < 0:
+                        continue
+                    error = cls(*candidate).compute_rms_error(datasets)
+                    if error < best_error:
+                        (parameters, best_error) = (candidate, error)
+                        improved = True
+            if not improved:
+                steps /= 2
+            if verbose:
+                print('Iteration {}: RMS error {:.3f} deg C'.format(
+                    iteration, best_error
+                ))
+        return (cls(*parameters), best_error)
+
+    @classmethod
+    def fit_reports(cls, filenames, **kwargs):
+        return cls.fit(
+            [cls.load_report(filename) for filename in filenames], **kwargs
+        )
+
+
+# Fitted to the results/ CSVs with thermal_plant_fit.py --ambient 24.5; with
+# a free ambient temperature the fit settles above room temperature, which
+# would keep sequences from ever reaching their room temperature setpoints.
+fitted_thermal_model = ThermalModel(
+    heating_rate=0.488,  # deg C/s at full heater duty
+    ambient_loss_rate=0.00185,  # 1/s
+    fan_loss_rate=0.00251,  # 1/s at full fan duty
+    ambient_temperature=24.5,  # deg C
+    sensor_time_constant=20.9  # s
+)
 
 
 # Feedback Control
 
+class SettlingDetector(object):
+    """Detect when the error has settled within a band for a dwell time.
+
+    The errors of the last dwell_time seconds are kept with monotonic deques
+    of their rolling min and max, and running sums of their rolling
+    variance, so each update costs constant time amortized over the
+    samples. The error has settled once every error over the dwell time is
+    within +/- band and, if max_std is given, their standard deviation is
+    at most max_std. Settling latches until reset.
+    """
+    def __init__(self, band, dwell_time, max_std=None, clock=None):
+        self.band = band
+        self.dwell_time = dwell_time
+        self.max_std = max_std
+        self.clock = clock if clock is not None else scheduling.system_clock
+        self.samples = collections.deque()
+        self.min_samples = collections.deque()
+        self.max_samples = collections.deque()
+        self.reset()
+
+    def reset(self):
+        self.samples.clear()
+        self.min_samples.clear()
+        self.max_samples.clear()
+        self.total = 0.0
+        self.total_squared = 0.0
+        self.start_time = None
+        self.settled = False
+        self.settle_time = None
+
+    @property
+    def min_error(self):
+        return self.min_samples[0][1] if self.min_samples else None
+
+    @property
+    def max_error(self):
+        return self.max_samples[0][1] if self.max_samples else None
+
+    @property
+    def std(self):
+        count = len(self.samples)
+        if count < 2:
+            return 0.0
+        mean = self.total / count
+        variance = (self.total_squared - count * mean ** 2) / (count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def update(self, error):
+        """Add an error sample, and return whether the error has settled."""
+        if self.settled or error is None:
+            return self.settled
+
+        current_time = self.clock.monotonic()
+        if self.start_time is None:
+            self.start_time = current_time
+        sample = (current_time, error)
+        self.samples.append(sample)
+        self.total += error
+        self.total_squared += error ** 2
+        while self.min_samples and self.min_samples[-1][1] >= error:
+            self.min_samples.pop()
+        self.min_samples.append(sample)
+        while self.max_samples and self.max_samples[-1][1] <= error:
+            self.max_samples.pop()
+        self.max_samples.append(sample)
+        # Drop old samples, keeping the newest one which spans the dwell time
+        while (
+            len(self.samples) > 1
+            and current_time - self.samples[1][0] >= self.dwell_time
+        ):
+            old_sample = self.samples.popleft()
+            self.total -= old_sample[1]
+            self.total_squared -= old_sample[1] ** 2
+            if self.min_samples[0] is old_sample:
+                self.min_samples.popleft()
+            if self.max_samples[0] is old_sample:
+                self.max_samples.popleft()
+
+        if current_time - self.samples[0][0] < self.dwell_time:
+            return False
+        if self.max_error >= self.band or self.min_error <= -self.band:
+            return False
+        if self.max_std is not None and self.std > self.max_std:
+            return False
+
+        self.settled = True
+        self.settle_time = current_time - self.start_time
+        return True
+
+
 class Control(object):
     """Generic feedback control interface. Implement compute_control_effort.
+
+    By default, the setpoint is reached once one measurement is within
+    setpoint_reached_epsilon of it; with a settling detector, it is reached
+    once the measurements have settled.
     """
     def __init__(
         self, initial_setpoint=None, min_output=0.0, max_output=1.0,
         setpoint_reached_epsilon=0, output_increases_process_variable=True,
+        settling_detector=None
     ):
         self.setpoint = initial_setpoint
         self.min_output = min_output
@@ -92,10 +590,21 @@ class Control(object):
         self.setpoint_reached = False
         self.setpoint_reached_epsilon = setpoint_reached_epsilon
         self.output_increases_pv = output_increases_process_variable
+        self.settling_detector = settling_detector
         self.enabled = True
+        self.reference = None
+        self.feedforward_effort = None
 
     def reset_setpoint_reached(self):
         self.setpoint_reached = False
+        if self.settling_detector is not None:
+            self.settling_detector.reset()
+
+    @property
+    def settle_time(self):
+        if self.settling_detector is None:
+            return None
+        return self.settling_detector.settle_time
 
     def set_setpoint(self, setpoint):
         if setpoint == self.setpoint:
@@ -112,17 +621,40 @@ class Control(object):
     def disable(self):
         self.enabled = False
 
+    def set_feedforward(self, reference, effort):
+        """Track a reference instead of the setpoint, with an added effort.
+
+        The setpoint is still used to decide whether it has been reached.
+        Specify None for both to return to pure feedback on the setpoint.
+        """
+        self.reference = reference
+        self.feedforward_effort = effort
+
+    def set_output_limits(self, min_output, max_output):
+        self.min_output = min_output
+        self.max_output = max_output
+
     def compute_error(self, measurement):
         if self.setpoint is None or measurement is None:
             return None
 
         return self.setpoint - measurement
 
+    def compute_tracking_error(self, measurement):
+        if self.reference is None:
+            return self.compute_error(measurement)
+        if measurement is None:
+            return None
+
+        return self.reference - measurement
+
     def compute_setpoint_reached(self, measurement):
         error = self.compute_error(measurement)
         if error is None:
             return None
 
+        if self.settling_detector is not None:
+            return self.settling_detector.update(error)
         return (
             abs(self.compute_error(measurement))
             < self.setpoint_reached_epsilon
@@ -146,25 +678,46 @@ class Control(object):
 class InfiniteGainControl(Control):
     """Toggle control effort by comparing measurement with setpoint.
 
-    Equivalent to proportional control with infinite gain.
+    Equivalent to proportional control with infinite gain. If hysteresis is
+    nonzero, the effort only toggles once the error leaves a band of that
+    total width around the setpoint, e.g. for relay feedback autotuning.
+    A feedforward effort replaces the minimum effort, so that feedback can
+    only raise the effort above it.
     """
+    def __init__(self, *args, hysteresis=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hysteresis = hysteresis
+        self.last_effort = None
+
     def compute_control_effort(self, measurement):
         if self.setpoint is None or not self.enabled:
             return 0
         if measurement is None:
             return None
 
-        error = self.compute_error(measurement)
+        error = self.compute_tracking_error(measurement)
+        if (
+            self.hysteresis and self.last_effort is not None
+            and abs(error) <= self.hysteresis / 2
+        ):
+            return self.last_effort
+
+        if self.feedforward_effort is None:
+            min_output = self.min_output
+        else:
+            min_output = self.clamp_output(self.feedforward_effort)
         if self.output_increases_pv:
             if error > 0:
-                return self.max_output
+                effort = self.max_output
             else:
-                return self.min_output
+                effort = min_output
         else:
             if error < 0:
-                return self.max_output
+                effort = self.max_output
             else:
-                return self.min_output
+                effort = min_output
+        self.last_effort = effort
+        return effort
 
 
 class ProportionalControl(Control):
@@ -179,18 +732,30 @@ class ProportionalControl(Control):
         if measurement is None:
             return None
 
-        error = self.compute_error(measurement)
+        error = self.compute_tracking_error(measurement)
         gain = self.gain if self.output_increases_pv else -self.gain
-        return self.clamp_output(gain * error)
+        if self.feedforward_effort is None:
+            return self.clamp_output(gain * error)
+        return self.clamp_output(gain * error + self.feedforward_effort)
 
 
 class PIDControl(Control):
-    """Comute control effort using PID algorithm."""
+    """Comute control effort using PID algorithm.
+
+    With a feedforward reference, the PID acts on the tracking error, so
+    that proportional on measurement stays bounded along a transition. The
+    PID output limits are shifted so that the sum of the feedforward and
+    PID efforts stays within the output limits, which also keeps the
+    integral term from winding up.
+    """
     def __init__(
         self, kp, ki, kd, *args,
-        sample_time=None, proportional_on_measurement=False, **kwargs
+        sample_time=None, proportional_on_measurement=False, clock=None,
+        **kwargs
     ):
         super().__init__(*args, **kwargs)
+        self.clock = clock if clock is not None else scheduling.system_clock
+        self.last_time = self.clock.monotonic()
         self.pid = PID(
             Kp=kp, Ki=ki, Kd=kd, setpoint=self.setpoint,
             sample_time=sample_time,
@@ -201,17 +766,199 @@ class PIDControl(Control):
 
     def set_setpoint(self, setpoint):
         super().set_setpoint(setpoint)
-        if self.setpoint is not None:
+        if self.setpoint is not None and self.reference is None:
             self.pid.setpoint = self.setpoint
 
+    def set_feedforward(self, reference, effort):
+        if (reference is None) != (self.reference is None):
+            self.pid.reset()
+        super().set_feedforward(reference, effort)
+        if reference is not None:
+            self.pid.setpoint = 0.0
+        elif self.setpoint is not None:
+            self.pid.setpoint = self.setpoint
+        self.update_pid_output_limits()
+
+    def set_output_limits(self, min_output, max_output):
+        super().set_output_limits(min_output, max_output)
+        self.update_pid_output_limits()
+
+    def update_pid_output_limits(self):
+        if self.feedforward_effort is None:
+            self.pid.output_limits = (self.min_output, self.max_output)
+        else:
+            effort = self.clamp_output(self.feedforward_effort)
+            self.pid.output_limits = (
+                self.min_output - effort, self.max_output - effort
+            )
+
     def compute_control_effort(self, measurement):
         if measurement is None:
             return None
         if self.setpoint is None or not self.enabled:
             return 0
 
-        return self.pid(measurement)
+        current_time = self.clock.monotonic()
+        dt = max(current_time - self.last_time, 1e-16)
+        self.last_time = current_time
+        if self.reference is None:
+            effort = self.pid(measurement, dt=dt)
+        else:
+            effort = self.pid(measurement - self.reference, dt=dt)
+        if self.feedforward_effort is None:
+            return effort
+        return effort + self.clamp_output(self.feedforward_effort)
+
+
+class MinimumOnOffTime(object):
+    """Keep an actuator on, and off, for minimum times between switches.
+
+    Efforts below min_effort, e.g. a fan's stall duty, switch the actuator
+    off. A switch is deferred until the actuator has been on for
+    min_on_time or off for min_off_time; meanwhile, the effort is raised to
+    min_effort while the actuator stays on, or zeroed while it stays off.
+    A minimum on time therefore requires a positive min_effort.
+    """
+    def __init__(
+        self, min_on_time=0.0, min_off_time=0.0, min_effort=0.0, clock=None
+    ):
+        if min_on_time > 0 and min_effort <= 0:
+            raise ValueError(
+                'min_effort must be positive to hold the actuator on'
+            )
+        self.min_on_time = min_on_time
+        self.min_off_time = min_off_time
+        self.min_effort = min_effort
+        self.clock = clock if clock is not None else scheduling.system_clock
+        self.reset()
+
+    def reset(self):
+        self.on = False
+        self.switch_time = None
+        self.switches = 0
 
+    def limit(self, effort):
+        if effort is None:
+            return None
+
+        requested_on = effort > 0 and effort >= self.min_effort
+        if requested_on != self.on:
+            current_time = self.clock.monotonic()
+            min_time = self.min_on_time if self.on else self.min_off_time
+            if (
+                self.switch_time is None
+                or current_time - self.switch_time >= min_time
+            ):
+                self.on = requested_on
+                self.switch_time = current_time
+                self.switches += 1
+        if not self.on:
+            return 0.0
+        return max(effort, self.min_effort)
+
+
+# Feedforward Control
+
+class ModelFeedforward(object):
+    """Plan setpoint transitions and their efforts with a thermal model.
+
+    After a setpoint change, a reference block temperature moves from the
+    measured temperature towards the setpoint at a fraction of the fastest
+    rate which the model allows with the heater or fan fully on. Heating
+    leaves headroom for feedback to correct model errors by default, while
+    cooling uses the full fan rate, which feedback cannot exceed. The
+    feedforward heater and fan efforts are the model's inverse along the
+    reference, and hold the model's equilibrium at the setpoint once it is
+    reached. Feedback tracks the reference after the model's sensor lag.
+    """
+    def __init__(
+        self, model, heating_rate_fraction=0.8, cooling_rate_fraction=1.0,
+        discrete_fan=False, clock=None
+    ):
+        self.model = model
+        self.heating_rate_fraction = heating_rate_fraction
+        self.cooling_rate_fraction = cooling_rate_fraction
+        self.discrete_fan = discrete_fan
+        self.clock = clock if clock is not None else scheduling.system_clock
+        self.setpoint = None
+        self.reset()
+
+    def reset(self):
+        self.reference = None
+        self.sensor_reference = None
+        self.last_time = None
+
+    def set_setpoint(self, setpoint):
+        """Change the setpoint, continuing the reference from where it is.
+
+        Changing the setpoint every control loop iteration, as in a ramp,
+        makes the reference follow it at the ramp rate once it catches up.
+        """
+        self.setpoint = setpoint
+        if setpoint is None:
+            self.reset()
+
+    @property
+    def transitioning(self):
+        return self.reference is not None and self.reference != self.setpoint
+
+    def compute_rate(self, temperature):
+        """Return the planned rate of change of the reference, in deg C/s."""
+        if self.setpoint > temperature:
+            rate = self.heating_rate_fraction * self.model.derivative(
+                temperature, 1, 0
+            )
+            return max(rate, 0.0)
+        if self.setpoint < temperature:
+            rate = self.cooling_rate_fraction * self.model.derivative(
+                temperature, 0, 1
+            )
+            return min(rate, 0.0)
+        return 0.0
+
+    def compute_efforts(self, temperature, rate):
+        """Return the (heater, fan) duties making the model follow rate."""
+        model = self.model
+        excess_temperature = temperature - model.ambient_temperature
+        heating = rate + model.ambient_loss_rate * excess_temperature
+        if heating >= 0:
+            return (min(heating / model.heating_rate, 1.0), 0.0)
+        if excess_temperature <= 0 or model.fan_loss_rate <= 0:
+            return (0.0, 0.0)
+        fan = min(-heating / (model.fan_loss_rate * excess_temperature), 1.0)
+        if self.discrete_fan:
+            fan = 1.0 if fan >= 0.5 else 0.0
+        return (0.0, fan)
+
+    def update(self, measurement):
+        """Advance the reference to the current time.
+
+        Returns the sensor reference and the (heater, fan) feedforward
+        efforts, or Nones if there is no setpoint.
+        """
+        if self.setpoint is None or measurement is None:
+            return (None, (None, None))
+
+        current_time = self.clock.monotonic()
+        if self.reference is None:
+            self.reference = measurement
+            self.sensor_reference = measurement
+            self.last_time = current_time
+        dt = current_time - self.last_time
+        self.last_time = current_time
+        reference = self.reference + self.compute_rate(self.reference) * dt
+        if (reference - self.setpoint) * (self.reference - self.setpoint) <= 0:
+            reference = self.setpoint
+        rate = (reference - self.reference) / dt if dt > 0 else 0.0
+        self.reference = reference
+        time_constant = self.model.sensor_time_constant
+        if time_constant > 0:
+            self.sensor_reference += (reference - self.sensor_reference) * (
+                1 - math.exp(-dt / time_constant)
+            )
+        else:
+            self.sensor_reference = reference
+        return (self.sensor_reference, self.compute_efforts(reference, rate))
 
 # Control
 
@@ -220,9 +967,10 @@ class ControllerReporter(object):
         self, interval=0.5,
         process_variable='Temperature', process_variable_units='deg C',
         control_efforts=('Thermal Control Effort',),
-        file_prefix='', file_suffix=''
+        file_prefix='', file_suffix='', clock=None
     ):
         self.interval = interval
+        self.clock = clock if clock is not None else scheduling.system_clock
         self.start_time = None
         self.next_report_index = None
         self.enabled = False
@@ -231,6 +979,7 @@ class ControllerReporter(object):
         self.control_efforts = control_efforts
         self.file_prefix = file_prefix
         self.file_suffix = file_suffix
+        self.file_extension = '.csv'
         self.file = None
 
     def enable(self):
@@ -257,7 +1006,7 @@ class ControllerReporter(object):
         if not self.enabled or process_variable is None:
             return
 
-        current_time = time.time()
+        current_time = self.clock.time()
         if self.next_report_index is None:  # First report received!
             self.start_time = current_time
             self.next_report_index = 0
@@ -280,39 +1029,58 @@ class ControllerReporter(object):
         self.file = open(filename, 'w')
 
     def report_header(self):
-        header_string = (
-            'Time (s),'
-            '{} ({}),Setpoint ({}),Error ({}),'
-            '{}Setpoint Reached'
-        ).format(
-            self.process_variable, self.process_variable_units,
-            self.process_variable_units, self.process_variable_units,
-            '{},'.format(','.join(self.control_efforts))
-            if self.control_efforts else ''
-        )
-        print(header_string, file=self.file)
+        print(self.format_header(), file=self.file)
         self.file.flush()
 
+    def format_header(self):
+        return ','.join(self.header_fields())
+
+    def header_fields(self):
+        return (
+            [
+                'Time (s)',
+                '{} ({})'.format(
+                    self.process_variable, self.process_variable_units
+                ),
+                'Setpoint ({})'.format(self.process_variable_units),
+                'Error ({})'.format(self.process_variable_units)
+            ]
+            + list(self.control_efforts or ())
+            + ['Setpoint Reached']
+        )
+
     def generate_timestamp(self, time):
         return datetime.fromtimestamp(time).isoformat(sep='_')
 
     def generate_filename(self):
-        return '{}{}{}.csv'.format(
+        return '{}{}{}{}'.format(
             self.file_prefix,
             self.generate_timestamp(self.start_time),
-            self.file_suffix
+            self.file_suffix,
+            self.file_extension
         )
 
     def report(
         self, report_time, process_variable,
         setpoint=None, setpoint_reached=None, control_efforts=[]
+    ):
+        print(self.format_report(
+            report_time, process_variable,
+            setpoint=setpoint, setpoint_reached=setpoint_reached,
+            control_efforts=control_efforts
+        ), file=self.file)
+        self.file.flush()
+
+    def format_report(
+        self, report_time, process_variable,
+        setpoint=None, setpoint_reached=None, control_efforts=[]
     ):
         error = None
         if setpoint is not None:
             error = setpoint - process_variable
 
         control_efforts_string = self.format_control_efforts(control_efforts)
-        report_string = '{:.2f},{:.1f},{},{},{}{}'.format(
+        return '{:.2f},{:.1f},{},{},{}{}'.format(
             report_time - self.start_time,
             process_variable,
             '{:.1f}'.format(setpoint) if setpoint is not None else '',
@@ -322,9 +1090,6 @@ class ControllerReporter(object):
             setpoint_reached if setpoint_reached is not None else ''
         )
 
-        print(report_string, file=self.file)
-        self.file.flush()
-
     def format_control_efforts(self, control_efforts):
         formatted_control_efforts = [
             '{:.2f}'.format(float(effort)) if effort is not None else ''
@@ -333,11 +1098,281 @@ class ControllerReporter(object):
         return ','.join(formatted_control_efforts)
 
 
+class AsyncControllerReporter(ControllerReporter):
+    """Controller reporter which formats and writes rows on a background thread.
+
+    The control loop only enqueues each row's values. The writer thread
+    writes rows in batches, flushes the file every flush_rows rows or every
+    flush_interval seconds, and also fsyncs it on flush if fsync is True. If
+    the bounded queue fills up, rows are dropped and counted instead of
+    blocking the control loop. Open reports are closed at interpreter exit.
+    """
+    def __init__(
+        self, *args, queue_size=1024, flush_rows=20, flush_interval=5.0,
+        fsync=False, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.queue_size = queue_size
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.queue = None
+        self.writer_thread = None
+        self.dropped_rows = 0
+
+    def open_report(self):
+        super().open_report()
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.writer_thread = threading.Thread(
+            target=self.run_writer, args=(self.file, self.queue), daemon=True
+        )
+        self.writer_thread.start()
+        atexit.register(self.close_report)
+
+    def reset(self):
+        self.close_report()  # before the writer loses the start time
+        super().reset()
+
+    def close_report(self):
+        if self.writer_thread is not None:
+            self.queue.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+            self.queue = None
+            atexit.unregister(self.close_report)
+            if self.dropped_rows:
+                print('Warning: dropped {} rows from {}!'.format(
+                    self.dropped_rows, self.file.name
+                ))
+                self.dropped_rows = 0
+        super().close_report()
+
+    def report_header(self):
+        self.enqueue(())
+
+    def report(
+        self, report_time, process_variable,
+        setpoint=None, setpoint_reached=None, control_efforts=[]
+    ):
+        self.enqueue((
+            report_time, process_variable, setpoint, setpoint_reached,
+            tuple(control_efforts)
+        ))
+
+    def enqueue(self, row):
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.dropped_rows += 1
+
+    def format_row(self, row):
+        if not row:
+            return self.format_header()
+
+        (
+            report_time, process_variable, setpoint, setpoint_reached,
+            control_efforts
+        ) = row
+        return self.format_report(
+            report_time, process_variable,
+            setpoint=setpoint, setpoint_reached=setpoint_reached,
+            control_efforts=control_efforts
+        )
+
+    def flush_file(self, file):
+        file.flush()
+        if self.fsync:
+            os.fsync(file.fileno())
+
+    def run_writer(self, file, rows):
+        unflushed_rows = 0
+        last_flush_time = time.monotonic()
+        closing = False
+        while not closing:
+            timeout = None
+            if unflushed_rows:
+                timeout = max(
+                    0, last_flush_time + self.flush_interval - time.monotonic()
+                )
+            try:
+                batch = [rows.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while True:  # Drain everything else already queued
+                try:
+                    batch.append(rows.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                closing = True
+                batch = batch[:batch.index(None)]
+            if batch:
+                file.write(''.join(
+                    '{}\n'.format(self.format_row(row)) for row in batch
+                ))
+                unflushed_rows += len(batch)
+            current_time = time.monotonic()
+            if unflushed_rows and (
+                closing or unflushed_rows >= self.flush_rows
+                or current_time - last_flush_time >= self.flush_interval
+            ):
+                self.flush_file(file)
+                unflushed_rows = 0
+                last_flush_time = current_time
+
+
+class BinaryControllerReporter(ControllerReporter):
+    """Controller reporter which appends fixed-width records to a .npy file.
+
+    Each record is a row of a structured array whose field names are the
+    CSV header fields; unset values are stored as NaN and an unset setpoint
+    reached flag as -1. The .npy header is rewritten with the record count
+    on every flush, and load_binary_report recovers all complete records
+    even if the header is stale.
+    """
+    header_reserved_digits = 20
+
+    def __init__(self, *args, flush_rows=20, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file_extension = '.npy'
+        self.flush_rows = flush_rows
+        self.dtype = None
+        self.record_struct = None
+        self.records = 0
+        self.unflushed_records = 0
+
+    def open_report(self):
+        filename = self.generate_filename()
+        print('Logging to {}...'.format(filename))
+        self.file = open(filename, 'wb')
+
+    def close_report(self):
+        if self.file is not None:
+            self.flush_report()
+        super().close_report()
+
+    def report_header(self):
+        fields = self.header_fields()
+        self.dtype = np.dtype(
+            [(fields[0], '<f8')]
+            + [(field, '<f4') for field in fields[1:-1]]
+            + [(fields[-1], 'i1')]
+        )
+        self.record_struct = struct.Struct(
+            '<d' + 'f' * (len(fields) - 2) + 'b'
+        )
+        self.records = 0
+        self.write_npy_header()
+        self.file.flush()
+
+    def format_npy_header(self, records):
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}"
+        reserved_length = len(header.format(
+            self.dtype.descr, '9' * self.header_reserved_digits
+        ))
+        header = header.format(self.dtype.descr, records)
+        # Pad so that the data starts on a 64-byte boundary
+        total_length = 10 + reserved_length + 1
+        padding = (64 - total_length % 64) % 64
+        header = header.ljust(reserved_length + padding) + '\n'
+        return (
+            b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header))
+            + header.encode('latin1')
+        )
+
+    def write_npy_header(self):
+        self.file.seek(0)
+        self.file.write(self.format_npy_header(self.records))
+        self.file.seek(0, os.SEEK_END)
+
+    def flush_report(self):
+        self.write_npy_header()
+        self.file.flush()
+        self.unflushed_records = 0
+
+    def report(
+        self, report_time, process_variable,
+        setpoint=None, setpoint_reached=None, control_efforts=[]
+    ):
+        nan = float('nan')
+        self.file.write(self.record_struct.pack(
+            report_time - self.start_time,
+            process_variable,
+            setpoint if setpoint is not None else nan,
+            setpoint - process_variable if setpoint is not None else nan,
+            *(
+                effort if effort is not None else nan
+                for effort in control_efforts
+            ),
+            setpoint_reached if setpoint_reached is not None else -1
+        ))
+        self.records += 1
+        self.unflushed_records += 1
+        if self.unflushed_records >= self.flush_rows:
+            self.flush_report()
+
+
+def load_binary_report(filename):
+    """Memory-map the records of a BinaryControllerReporter file."""
+    with open(filename, 'rb') as f:
+        np.lib.format.read_magic(f)
+        (_, _, dtype) = np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+        size = os.fstat(f.fileno()).st_size
+    records = (size - offset) // dtype.itemsize
+    if records == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(
+        filename, dtype=dtype, mode='r', offset=offset, shape=(records,)
+    )
+
+
+def format_report_column(values, format_string):
+    strings = np.char.mod(format_string, values)
+    return np.where(np.isnan(values), '', strings)
+
+
+def convert_binary_report(filename, csv_filename=None):
+    """Convert a BinaryControllerReporter file to the ControllerReporter CSV.
+
+    Returns the name of the CSV file.
+    """
+    if csv_filename is None:
+        csv_filename = '{}.csv'.format(os.path.splitext(filename)[0])
+    records = load_binary_report(filename)
+    fields = records.dtype.names
+    columns = [format_report_column(records[fields[0]], '%.2f')]
+    for field in fields[1:4]:
+        columns.append(format_report_column(
+            records[field].astype(float), '%.1f'
+        ))
+    for field in fields[4:-1]:
+        columns.append(format_report_column(
+            records[field].astype(float), '%.2f'
+        ))
+    setpoint_reached = records[fields[-1]]
+    columns.append(np.where(
+        setpoint_reached < 0, '',
+        np.where(setpoint_reached > 0, 'True', 'False')
+    ))
+    rows = columns[0]
+    for column in columns[1:]:
+        rows = np.char.add(np.char.add(rows, ','), column)
+    with open(csv_filename, 'w') as f:
+        print(','.join(fields), file=f)
+        if len(rows):
+            print('\n'.join(rows.tolist()), file=f)
+    return csv_filename
+
+
 class ControllerPrinter(ControllerReporter):
     def __init__(
         self, interval=15, control_efforts=('Thermal Control Effort',),
+        clock=None
     ):
-        super().__init__(interval=interval, control_efforts=control_efforts)
+        super().__init__(
+            interval=interval, control_efforts=control_efforts, clock=clock
+        )
 
     def close_report(self):
         pass
@@ -347,13 +1382,19 @@ class ControllerPrinter(ControllerReporter):
 
 
 class Controller(object):
-    def __init__(self, controls, outputs, process_variable, reporters=[]):
+    def __init__(
+        self, controls, outputs, process_variable, reporters=[],
+        instrumentation=None
+    ):
         self.controls = [control for control in controls]
         self.outputs = [output for output in outputs]
         self.process_variable = process_variable
         self.reporters = [reporter for reporter in reporters]
         self.resettable_reporters = [reporter for reporter in reporters]
         self.disableable_reporters = [reporter for reporter in reporters]
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.add_controls(self.controls)
 
         for reporter in self.reporters:
             if reporter is not None:
@@ -361,7 +1402,7 @@ class Controller(object):
 
     @property
     def output_effort_names(self):
-        return (
+        return tuple(
             'Output {} Effort'.format(i) for (i, _) in enumerate(self.outputs)
         )
 
@@ -373,6 +1414,10 @@ class Controller(object):
     def setpoint_reached(self):
         return self.controls[0].setpoint_reached
 
+    @property
+    def settle_time(self):
+        return self.controls[0].settle_time
+
     def reset(self):
         self.reset_reporters()
         self.reset_controls()
@@ -397,6 +1442,9 @@ class Controller(object):
             control.reset_setpoint_reached()
 
     def update(self):
+        if self.instrumentation is not None:
+            return self.update_instrumented()
+
         process_variable = self.process_variable.read()
         if process_variable is None:
             return (None, (None,))
@@ -408,7 +1456,41 @@ class Controller(object):
         self.report(process_variable, control_efforts)
         return (process_variable, control_efforts)
 
+    def update_instrumented(self):
+        instrumentation = self.instrumentation
+        histograms = instrumentation.histograms
+        instrumentation.updates += 1
+        start_time = time.perf_counter()
+        try:
+            process_variable = self.process_variable.read()
+        except OSError:
+            instrumentation.adc_errors += 1
+            raise
+        read_time = time.perf_counter()
+        histograms['read'].record(read_time - start_time)
+        if process_variable is None:
+            instrumentation.invalid_readings += 1
+            histograms['update'].record(read_time - start_time)
+            return (None, (None,))
+
+        control_efforts = self.compute_control_efforts(process_variable)
+        control_time = time.perf_counter()
+        histograms['control'].record(control_time - read_time)
+        for (output, control_effort) in zip(self.outputs, control_efforts):
+            output.set_state(control_effort)
+        output_time = time.perf_counter()
+        histograms['output'].record(output_time - control_time)
+
+        self.report(process_variable, control_efforts)
+        report_time = time.perf_counter()
+        histograms['report'].record(report_time - output_time)
+        histograms['update'].record(report_time - start_time)
+        return (process_variable, control_efforts)
+
     def compute_control_efforts(self, process_variable):
+        if self.instrumentation is not None:
+            return self.compute_control_efforts_instrumented(process_variable)
+
         for control in self.controls:
             control.update(process_variable)
         return [
@@ -416,6 +1498,19 @@ class Controller(object):
             for control in self.controls
         ]
 
+    def compute_control_efforts_instrumented(self, process_variable):
+        control_efforts = []
+        for (control, histogram) in zip(
+            self.controls, self.instrumentation.control_histograms
+        ):
+            start_time = time.perf_counter()
+            control.update(process_variable)
+            control_efforts.append(
+                control.compute_control_effort(process_variable)
+            )
+            histogram.record(time.perf_counter() - start_time)
+        return control_efforts
+
     def report(self, process_variable, control_efforts):
         for reporter in self.reporters:
             if reporter is not None:
@@ -433,31 +1528,47 @@ class HeaterController(Controller):
         self, process_variable,
         heater_control, heater,
         additional_controls=[], additional_outputs=[],
-        file_reporter=None, print_reporter=None
+        file_reporter=None, print_reporter=None, telemetry_reporter=None,
+        instrumentation=None
     ):
         super().__init__(
             [heater_control] + additional_controls,
             [heater] + additional_outputs,
             process_variable,
-            [file_reporter, print_reporter]
+            [file_reporter, print_reporter, telemetry_reporter],
+            instrumentation=instrumentation
         )
         self.heater = heater
         self.heater_control = heater_control
         self.file_reporter = file_reporter
         self.print_reporter = print_reporter
+        self.telemetry_reporter = telemetry_reporter
+        # Telemetry is published even while recording is disabled
+        self.disableable_reporters = [file_reporter, print_reporter]
 
     @property
     def output_effort_names(self):
         return ('Heater PWM Duty',)
 
+    def enable_heater(self):
+        self.heater_control.enable()
+
+    def disable_heater(self):
+        self.heater_control.disable()
+
 
 class HeaterFanController(HeaterController):
+    """Heater and fan controller, optionally with model feedforward.
+
+    With a ModelFeedforward, the heater and fan controls track its planned
+    setpoint transitions and add its efforts to their feedback efforts.
+    """
     def __init__(
             self, process_variable,
             heater_control, heater,
             fan_control, fan, fan_setpoint_offset=0.0,
             additional_controls=[], additional_outputs=[],
-            **kwargs
+            feedforward=None, **kwargs
     ):
         super().__init__(
             process_variable, heater_control, heater,
@@ -468,6 +1579,7 @@ class HeaterFanController(HeaterController):
         self.fan = fan
         self.fan_control = fan_control
         self.fan_setpoint_offset = fan_setpoint_offset
+        self.feedforward = feedforward
 
     @property
     def output_effort_names(self):
@@ -477,7 +1589,242 @@ class HeaterFanController(HeaterController):
         super().set_setpoint(setpoint)
         if setpoint is not None:
             self.fan_control.set_setpoint(setpoint + self.fan_setpoint_offset)
+        if self.feedforward is not None:
+            self.feedforward.set_setpoint(setpoint)
+
+    def compute_control_efforts(self, process_variable):
+        if self.feedforward is not None:
+            (reference, (heater_effort, fan_effort)) = (
+                self.feedforward.update(process_variable)
+            )
+            self.heater_control.set_feedforward(reference, heater_effort)
+            self.fan_control.set_feedforward(
+                reference + self.fan_setpoint_offset
+                if reference is not None else None,
+                fan_effort
+            )
+        return super().compute_control_efforts(process_variable)
 
     @property
     def setpoint_reached(self):
         return self.heater_control.setpoint_reached
+
+    @property
+    def settle_time(self):
+        return self.heater_control.settle_time
+
+
+class SplitRangeHeaterFanController(HeaterController):
+    """Heater and fan controller driven by one split-range control effort.
+
+    The control's efforts range from -1 to 1: positive efforts drive the
+    heater, and negative efforts drive the fan, scaled by fan_gain, so the
+    heater and fan never run at once. The fan may be a PWMPin or a
+    DigitalPin, and a fan limiter such as MinimumOnOffTime keeps it from
+    switching too often; the heater stays off while the limiter holds the
+    fan on. With a ModelFeedforward, the control tracks its transitions and
+    adds the difference of its heater and scaled fan efforts.
+    """
+    def __init__(
+        self, process_variable, control, heater, fan, fan_gain=1.0,
+        fan_limiter=None, feedforward=None, **kwargs
+    ):
+        super().__init__(
+            process_variable, control, heater, additional_outputs=[fan],
+            **kwargs
+        )
+        self.fan = fan
+        self.fan_gain = fan_gain
+        self.fan_limiter = fan_limiter
+        self.feedforward = feedforward
+        self.heater_max_output = control.max_output
+
+    @property
+    def output_effort_names(self):
+        return ('Heater PWM Duty', 'Fan PWM Duty')
+
+    def set_setpoint(self, setpoint):
+        super().set_setpoint(setpoint)
+        if self.feedforward is not None:
+            self.feedforward.set_setpoint(setpoint)
+
+    def enable_heater(self):
+        self.heater_control.enable()
+        self.heater_control.set_output_limits(
+            self.heater_control.min_output, self.heater_max_output
+        )
+
+    def disable_heater(self):
+        """Limit the control to cooling, so that only the fan is used."""
+        self.heater_control.set_output_limits(
+            self.heater_control.min_output, 0.0
+        )
+
+    def compute_control_efforts(self, process_variable):
+        if self.feedforward is not None:
+            (reference, (heater_effort, fan_effort)) = (
+                self.feedforward.update(process_variable)
+            )
+            if heater_effort is None:
+                effort = None
+            else:
+                effort = heater_effort - fan_effort / self.fan_gain
+            self.heater_control.set_feedforward(reference, effort)
+        (effort,) = super().compute_control_efforts(process_variable)
+        return self.split_effort(effort)
+
+    def split_effort(self, effort):
+        """Split a control effort into (heater, fan) efforts."""
+        if effort is None:
+            return (None, None)
+
+        if effort < 0:
+            fan_effort = min(-effort * self.fan_gain, 1.0)
+        else:
+            fan_effort = 0.0
+        if self.fan_limiter is not None:
+            fan_effort = self.fan_limiter.limit(fan_effort)
+            if self.fan_limiter.on:  # Even while heating is requested
+                return (0.0, max(fan_effort, self.fan_limiter.min_effort))
+        if fan_effort > 0:
+            return (0.0, fan_effort)
+        return (max(effort, 0.0), 0.0)
+
+
+# Setpoint Sequences
+
+def print_setpoint_reached(controller, prefix=''):
+    if controller.settle_time is not None:
+        print('{}Settled at setpoint after {:.1f} s!'.format(
+            prefix, controller.settle_time
+        ))
+    else:
+        print('{}Reached setpoint!'.format(prefix))
+
+
+def iterate_setpoint_record(
+    controller, setpoint_record, clock=None, name=None
+):
+    """Control to a setpoint record, yielding before each controller update.
+
+    The record's value is controlled to until it is reached, and then held
+    for the record's duration in minutes, or indefinitely if the duration is
+    None. Driving the updates from the caller lets one scheduler interleave
+    the updates of several controllers.
+    """
+    if clock is None:
+        clock = scheduling.system_clock
+    prefix = '{}: '.format(name) if name is not None else ''
+    controller.reset()
+    setpoint = setpoint_record['value']
+    recording = setpoint_record['recording']
+    duration = setpoint_record['duration']
+    if controller.file_reporter is not None:
+        controller.file_reporter.file_suffix = '_setpoint{:.1f},{:.1f}'.format(
+            setpoint, duration
+        )
+
+    controller.set_setpoint(setpoint)
+    print('{}Setpoint is now {:.1f}...'.format(prefix, setpoint))
+    if recording:
+        controller.enable_reporters()
+    else:
+        controller.disable_reporters()
+
+    # Control to setpoint
+    while not controller.setpoint_reached:
+        yield
+        controller.update()
+    # Control to duration
+    print_setpoint_reached(controller, prefix)
+    setpoint_reached_time = clock.monotonic()
+    if duration is None:
+        print(
+            '{}Holding at setpoint indefinitely. '
+            'Press Ctrl+C to stop holding and quit.'.format(prefix)
+        )
+    else:
+        print('{}Holding for {:.1f} min...'.format(prefix, duration))
+
+    while (
+        duration is None
+        or clock.monotonic() - setpoint_reached_time < 60 * duration
+    ):
+        yield
+        controller.update()
+
+
+def iterate_setpoint_sequence(controller, setpoint_record_sequence, **kwargs):
+    for setpoint_record in setpoint_record_sequence:
+        yield from iterate_setpoint_record(
+            controller, setpoint_record, **kwargs
+        )
+
+
+def iterate_flight_record(controller, flight_record, **kwargs):
+    """Control to a preflight or postflight record.
+
+    The heater is disabled if the system starts above the record's value,
+    so that only the fan is used to reach it.
+    """
+    if controller.process_variable.read() > flight_record['value']:
+        controller.disable_heater()
+    else:
+        controller.enable_heater()
+    yield from iterate_setpoint_record(controller, flight_record, **kwargs)
+
+
+def iterate_profile(
+    controller, profile, clock=None, name=None, monitor=None
+):
+    """Control through a compiled setpoint profile.
+
+    Yields before each controller update, like iterate_setpoint_record. The
+    profile's cursor sets the setpoint before each update, and reporters
+    are enabled or disabled as each segment starts. A monitor is given the
+    cursor, time, measurement, setpoint and setpoint reached after each
+    update, and the time when the profile finishes.
+    """
+    if clock is None:
+        clock = scheduling.system_clock
+    prefix = '{}: '.format(name) if name is not None else ''
+    controller.reset()
+    if controller.file_reporter is not None:
+        controller.file_reporter.file_suffix = '_profile{}'.format(
+            profile.name
+        )
+
+    cursor = profile.cursor()
+    cursor.start(clock.monotonic())
+    segment_index = None
+    while True:
+        setpoint = cursor.update(
+            clock.monotonic(), controller.setpoint_reached
+        )
+        if setpoint is None:
+            break
+        if cursor.index != segment_index:
+            segment_index = cursor.index
+            segment = cursor.segment
+            print('{}{}'.format(prefix, segment))
+            if segment.recording:
+                controller.enable_reporters()
+            else:
+                controller.disable_reporters()
+            waiting = (
+                segment.until_reached and cursor.segment_start_time is None
+            )
+        elif waiting and cursor.segment_start_time is not None:
+            waiting = False
+            print_setpoint_reached(controller, prefix)
+        controller.set_setpoint(setpoint)
+        yield
+        (process_variable, _) = controller.update()
+        if monitor is not None:
+            monitor.update(
+                cursor, clock.monotonic(), process_variable, setpoint,
+                controller.setpoint_reached
+            )
+    if monitor is not None:
+        monitor.finish(clock.monotonic())
+    print('{}Finished profile {}!'.format(prefix, profile.name))
@@ -0,0 +1,122 @@
+"""Tune the lysis heater's PID gains with relay feedback.
+
+The heater is toggled around the target temperature until the temperature
+oscillates in a limit cycle, whose amplitude and period give the PID gains
+by the selected tuning rule. The gains are saved for this device to the PID
+config, from which thermal_lysis.py loads them. Tuning takes a few minutes.
+"""
+import argparse
+
+import autotuning
+import gpio
+import scheduling
+from thermal_lysis import (
+    adc_sampler, clock, control_loop_interval, control_loop_policy,
+    controller, device_name, metrics_exporter, pid_config_path,
+    start_adc_sampler
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Tune PID gains of the heater with relay feedback.'
+    )
+    parser.add_argument(
+        '--target', '-t', type=float, default=60.0,
+        help='Temperature to oscillate around, in deg C. Default: 60'
+    )
+    parser.add_argument(
+        '--rule', '-r', choices=sorted(autotuning.pid_tuning_rules),
+        default='tyreus_luyben',
+        help='Tuning rule for the PID gains. Default: tyreus_luyben'
+    )
+    parser.add_argument(
+        '--cycles', '-c', type=int, default=3,
+        help='Oscillation cycles to measure. Default: 3'
+    )
+    parser.add_argument(
+        '--discard-cycles', type=int, default=1,
+        help='Initial oscillation cycles to discard. Default: 1'
+    )
+    parser.add_argument(
+        '--hysteresis', type=float, default=0.2,
+        help='Total width of the relay hysteresis band, in deg C. '
+        'Default: 0.2'
+    )
+    parser.add_argument(
+        '--relay-min', type=float, default=0.0,
+        help='Heater duty cycle below the relay band. Default: 0'
+    )
+    parser.add_argument(
+        '--relay-max', type=float, default=1.0,
+        help='Heater duty cycle above the relay band. Default: 1'
+    )
+    parser.add_argument(
+        '--max-duration', type=float, default=30.0,
+        help='Time limit for tuning, in min. Default: 30'
+    )
+    parser.add_argument(
+        '--device', '-d', default=device_name,
+        help='Device name to save the gains for. Default: hostname'
+    )
+    parser.add_argument(
+        '--config', default=pid_config_path,
+        help='PID config to save the gains to. Default: {}'.format(
+            pid_config_path
+        )
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the gains without saving them.'
+    )
+    args = parser.parse_args()
+
+    autotuner = autotuning.RelayAutotuner(
+        controller.process_variable, controller.heater, args.target,
+        fan=controller.fan, relay_min=args.relay_min,
+        relay_max=args.relay_max, hysteresis=args.hysteresis,
+        cycles=args.cycles, discard_cycles=args.discard_cycles,
+        max_duration=60 * args.max_duration, clock=clock
+    )
+    scheduler = scheduling.LoopScheduler(
+        control_loop_interval / 1000, policy=control_loop_policy, clock=clock
+    )
+    start_adc_sampler()
+    metrics_exporter.start()
+    print('Relay autotuning around {:.1f} deg C...'.format(args.target))
+    try:
+        for _ in autotuner.iterate():
+            scheduler.wait()
+        scheduler.finish_iteration()
+        result = autotuner.compute_result(args.rule)
+        print(
+            'Oscillation amplitude {:.3f} deg C, period {:.1f} s; ultimate '
+            'gain {:.4f} after {:.1f} min'.format(
+                result['amplitude'], result['ultimate_period'],
+                result['ultimate_gain'], result['duration'] / 60
+            )
+        )
+        for rule in sorted(autotuning.pid_tuning_rules):
+            print('{}{:<20} Kp={:.5f}, Ki={:.5f}, Kd={:.5f}'.format(
+                '*' if rule == args.rule else ' ', rule,
+                *autotuning.compute_pid_gains(
+                    result['ultimate_gain'], result['ultimate_period'], rule
+                )
+            ))
+        if args.dry_run:
+            print('Dry run; not saving gains.')
+        else:
+            autotuning.save_pid_gains(args.config, args.device, result)
+            print('Saved {} gains for {} to {}'.format(
+                args.rule, args.device, args.config
+            ))
+    except KeyboardInterrupt:
+        print('Quitting early...')
+    print('Control loop: {}'.format(scheduler.statistics))
+    adc_sampler.stop()
+    metrics_exporter.stop()
+    gpio.cleanup()
+
+
+if __name__ == '__main__':
+    main()
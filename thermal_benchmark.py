@@ -0,0 +1,364 @@
+"""Benchmark the stages of a thermal controller's update.
+
+Runs against the simulated GPIO backend unless GPIO_BACKEND is set, so ADC
+read latencies measure the simulated plant rather than the I2C bus. Results
+can be saved as JSON and compared against a saved baseline to catch
+regressions in the control loop.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault('GPIO_BACKEND', 'simulated')
+
+import gpio
+import metrics
+import thermal
+
+root_path = os.path.dirname(os.path.abspath(__file__))
+
+# Controller settings, matching thermal_lysis
+bias_resistance = 1960  # Ohm
+A = 0.0010349722285233954
+B = 0.00022717987892035313
+C = 3.008424040777896e-07
+setpoint = 90.0  # deg C
+setpoint_reached_epsilon = 0.5  # deg C
+fan_setpoint_offset = 0.25  # deg C
+pid_gains = (0.0775, 0.00125, 0.0)  # Kp, Ki, Kd
+
+# Measurements which alternate around the setpoint
+measurements = (88.0, 89.5, 90.25, 91.0)  # deg C
+
+percentiles = (50, 90, 99)
+
+
+# Controller Components
+
+def build_thermistor(adc, **kwargs):
+    return thermal.Thermistor(
+        gpio.AnalogPin(adc, 3, refresh_interval=1.0),
+        gpio.DifferentialAnalogPin(adc, 0, ref_pin=3),
+        bias_resistance=bias_resistance, A=A, B=B, C=C,
+        differential=True, **kwargs
+    )
+
+
+def build_controls():
+    return {
+        'InfiniteGainControl': thermal.InfiniteGainControl(
+            setpoint_reached_epsilon=setpoint_reached_epsilon
+        ),
+        'ProportionalControl': thermal.ProportionalControl(
+            0.1, setpoint_reached_epsilon=setpoint_reached_epsilon
+        ),
+        'PIDControl': thermal.PIDControl(
+            *pid_gains, setpoint_reached_epsilon=setpoint_reached_epsilon,
+            proportional_on_measurement=True
+        )
+    }
+
+
+def build_reporters(report_dir, queue_size):
+    return {
+        'ControllerReporter': thermal.ControllerReporter(
+            interval=0, file_prefix=os.path.join(report_dir, 'sync_')
+        ),
+        'AsyncControllerReporter': thermal.AsyncControllerReporter(
+            interval=0, file_prefix=os.path.join(report_dir, 'async_'),
+            queue_size=queue_size
+        ),
+        'BinaryControllerReporter': thermal.BinaryControllerReporter(
+            interval=0, file_prefix=os.path.join(report_dir, 'binary_')
+        )
+    }
+
+
+def build_heater_controller(adc, file_reporter=None):
+    return thermal.HeaterController(
+        build_thermistor(adc, lookup_table_size=32768),
+        thermal.PIDControl(
+            *pid_gains, setpoint_reached_epsilon=setpoint_reached_epsilon,
+            proportional_on_measurement=True
+        ),
+        gpio.PWMPin(18),
+        file_reporter=file_reporter
+    )
+
+
+def build_heater_fan_controller(
+    adc, file_reporter=None, instrumentation=None
+):
+    return thermal.HeaterFanController(
+        build_thermistor(adc, lookup_table_size=32768),
+        thermal.PIDControl(
+            *pid_gains, setpoint_reached_epsilon=setpoint_reached_epsilon,
+            proportional_on_measurement=True
+        ),
+        gpio.PWMPin(18),
+        thermal.InfiniteGainControl(
+            setpoint_reached_epsilon=setpoint_reached_epsilon,
+            output_increases_process_variable=False
+        ),
+        gpio.DigitalPin(4),
+        fan_setpoint_offset=fan_setpoint_offset,
+        file_reporter=file_reporter, instrumentation=instrumentation
+    )
+
+
+# Measurement
+
+def measure_latencies(function, number, warmup):
+    """Return the latencies of repeated calls of function in seconds."""
+    for i in range(warmup):
+        function(i)
+    latencies = np.empty(number, dtype=np.int64)
+    perf_counter_ns = time.perf_counter_ns
+    for i in range(number):
+        start_time = perf_counter_ns()
+        function(i)
+        latencies[i] = perf_counter_ns() - start_time
+    return latencies * 1e-9
+
+
+def summarize_latencies(latencies):
+    summary = {
+        'mean': float(np.mean(latencies)),
+        'min': float(np.min(latencies)),
+        'max': float(np.max(latencies))
+    }
+    for (percentile, value) in zip(
+        percentiles, np.percentile(latencies, percentiles)
+    ):
+        summary['p{}'.format(percentile)] = float(value)
+    return summary
+
+
+def benchmark_stages(number, warmup):
+    """Return the latencies of each stage of the controller update."""
+    stages = {}
+    adc = gpio.ADC()
+
+    def measure(name, function):
+        stages[name] = measure_latencies(function, number, warmup)
+
+    # Process variable
+    exact = build_thermistor(adc)
+    lookup = build_thermistor(adc, lookup_table_size=32768)
+    resistances = [exact.read_resistance() for _ in range(64)]
+    measure('adc.read_voltage', lambda i: lookup.read_voltage())
+    measure(
+        'thermistor.steinhart_hart',
+        lambda i: exact.convert_kelvin(
+            exact.steinhart_hart(resistances[i % len(resistances)])
+        )
+    )
+    measure('thermistor.read.exact', lambda i: exact.read())
+    measure('thermistor.read.lookup_table', lambda i: lookup.read())
+
+    # Controls
+    for (name, control) in build_controls().items():
+        control.set_setpoint(setpoint)
+
+        def compute(i, control=control):
+            measurement = measurements[i % len(measurements)]
+            control.update(measurement)
+            return control.compute_control_effort(measurement)
+
+        measure('control.{}'.format(name), compute)
+
+    # Outputs
+    heater = gpio.PWMPin(18)
+    fan = gpio.DigitalPin(4)
+    measure('output.PWMPin', lambda i: heater.set_state((i % 100) / 100))
+    measure('output.DigitalPin', lambda i: fan.set_state(i % 2))
+
+    with tempfile.TemporaryDirectory() as report_dir:
+        # Reporters
+        # Size async queues so that no rows, including headers, are dropped
+        queue_size = number + warmup + 1
+        reporters = build_reporters(report_dir, queue_size)
+        for (name, reporter) in reporters.items():
+            reporter.control_efforts = ('Heater PWM Duty', 'Fan PWM Duty')
+            reporter.reset()
+            measure(
+                'reporter.{}'.format(name),
+                lambda i, reporter=reporter: reporter.update(
+                    measurements[i % len(measurements)], setpoint=setpoint,
+                    setpoint_reached=False, control_efforts=(0.5, 1.0)
+                )
+            )
+            reporter.close_report()
+
+        # Full controller updates
+        controllers = {
+            'HeaterController': build_heater_controller(adc),
+            'HeaterFanController': build_heater_fan_controller(adc),
+            'HeaterFanController+ControllerInstrumentation':
+                build_heater_fan_controller(
+                    adc, instrumentation=metrics.ControllerInstrumentation()
+                ),
+            'HeaterFanController+AsyncControllerReporter':
+                build_heater_fan_controller(
+                    adc, file_reporter=thermal.AsyncControllerReporter(
+                        interval=0,
+                        file_prefix=os.path.join(report_dir, 'controller_'),
+                        queue_size=queue_size
+                    )
+                )
+        }
+        for (name, controller) in controllers.items():
+            controller.reset()
+            controller.set_setpoint(setpoint)
+            measure(
+                'update.{}'.format(name),
+                lambda i, controller=controller: controller.update()
+            )
+            if controller.file_reporter is not None:
+                controller.file_reporter.close_report()
+
+    gpio.cleanup()
+    return stages
+
+
+# Results
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=root_path,
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_results(stages, number):
+    return {
+        'commit': get_commit(),
+        'backend': gpio.backend,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'number': number,
+        'stages': {
+            name: summarize_latencies(latencies)
+            for (name, latencies) in stages.items()
+        }
+    }
+
+
+def format_us(value):
+    return '{:.2f}'.format(1e6 * value)
+
+
+def print_results(results):
+    print('Commit {}, {} backend, Python {} on {}; {} calls per stage'.format(
+        results['commit'], results['backend'], results['python'],
+        results['machine'], results['number']
+    ))
+    columns = (
+        ['mean', 'min'] + ['p{}'.format(p) for p in percentiles] + ['max']
+    )
+    name_width = max(len(name) for name in results['stages'])
+    print('{}  {}'.format(
+        'Stage (us)'.ljust(name_width),
+        ''.join(column.rjust(10) for column in columns)
+    ))
+    for (name, summary) in results['stages'].items():
+        print('{}  {}'.format(
+            name.ljust(name_width),
+            ''.join(format_us(summary[column]).rjust(10) for column in columns)
+        ))
+
+
+def compare_results(results, baseline, tolerance, statistic='p50'):
+    """Print the ratio of each stage's latency to the baseline.
+
+    Returns the names of stages slower than tolerance times the baseline.
+    """
+    print('Comparing {} against baseline commit {}:'.format(
+        statistic, baseline.get('commit')
+    ))
+    regressions = []
+    name_width = max(len(name) for name in results['stages'])
+    for (name, summary) in results['stages'].items():
+        if name not in baseline['stages']:
+            print('{}  {:>10}'.format(name.ljust(name_width), 'new'))
+            continue
+
+        baseline_value = baseline['stages'][name][statistic]
+        ratio = summary[statistic] / baseline_value
+        regressed = ratio > tolerance
+        if regressed:
+            regressions.append(name)
+        print('{}  {:>10} -> {:>10} us  {:.2f}x{}'.format(
+            name.ljust(name_width), format_us(baseline_value),
+            format_us(summary[statistic]), ratio,
+            '  REGRESSION' if regressed else ''
+        ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the stages of thermal controller updates.'
+    )
+    parser.add_argument(
+        '--number', '-n', type=int, default=20000,
+        help='Number of timed calls per stage. Default: 20000'
+    )
+    parser.add_argument(
+        '--warmup', '-w', type=int, default=1000,
+        help='Number of untimed calls before each stage. Default: 1000'
+    )
+    parser.add_argument(
+        '--save', '-s', default=None,
+        help='Save the results as JSON to this file.'
+    )
+    parser.add_argument(
+        '--compare', '-c', default=None,
+        help='Compare the results against JSON saved by --save.'
+    )
+    parser.add_argument(
+        '--tolerance', '-t', type=float, default=1.25,
+        help=(
+            'Latency ratio above which a stage counts as a regression. '
+            'Default: 1.25'
+        )
+    )
+    parser.add_argument(
+        '--statistic', default='p50',
+        choices=['mean', 'min', 'max'] + [
+            'p{}'.format(percentile) for percentile in percentiles
+        ],
+        help='Latency statistic to compare. Default: p50'
+    )
+    args = parser.parse_args()
+
+    stages = benchmark_stages(args.number, args.warmup)
+    results = build_results(stages, args.number)
+    print_results(results)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Saved results to {}'.format(args.save))
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(
+            results, baseline, args.tolerance, statistic=args.statistic
+        )
+        if regressions:
+            print('Regressions in {}'.format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""Run independent setpoint sequences on several lysis chambers at once.
+
+Each chamber has its own thermistor, heater and fan, and chambers share
+ADS1115 ADCs across their channels and addresses. One loop scheduler
+interleaves the chambers' updates, so that their ADC conversions are spread
+evenly over each control loop interval instead of issued back to back.
+"""
+import gpio
+import metrics
+import scheduling
+import thermal
+
+
+# Reporting settings
+setpoint_reached_epsilon = 0.5  # deg C
+setpoint_settling_dwell_time = 10.0  # s within epsilon to reach setpoint
+file_reporter_interval = 0.5
+file_reporter_flush_rows = 20
+file_reporter_flush_interval = 5.0  # s
+metrics_filename = 'thermal_chambers_metrics.prom'
+metrics_export_interval = 10.0  # s
+
+# ADC settings
+reference_channel = 3
+reference_refresh_interval = 1.0  # s
+
+# Chamber wiring; thermistors are read differentially against the reference
+chamber_settings = [
+    {
+        'name': 'chamber_1',
+        'adc_address': 0x48,
+        'thermistor_channel': 0,
+        'heater_pin': 18,
+        'fan_pin': 4
+    },
+    {
+        'name': 'chamber_2',
+        'adc_address': 0x48,
+        'thermistor_channel': 1,
+        'heater_pin': 13,
+        'fan_pin': 5
+    },
+    {
+        'name': 'chamber_3',
+        'adc_address': 0x49,
+        'thermistor_channel': 0,
+        'heater_pin': 12,
+        'fan_pin': 6
+    },
+]
+
+# Setpoint sequence settings
+control_loop_interval = 50  # ms; each chamber is updated once per interval
+control_loop_policy = 'skip'  # or 'catch_up'
+room_temperature = 25.0  # deg C
+lysis_temperature = 90.0  # deg C
+lysis_duration = 10.0  # min
+rpa_prep_temperature = 40.0  # deg C
+rpa_prep_duration = 10.0  # min
+
+preflight_record = {
+    'value': room_temperature,
+    'duration': 0,
+    'recording': False
+}
+postflight_record = {
+    'value': room_temperature,
+    'duration': 0,
+    'recording': False
+}
+setpoint_record_sequence = [
+    {
+        'value': lysis_temperature,
+        'duration': lysis_duration,
+        'recording': True
+    },
+    {
+        'value': rpa_prep_temperature,
+        'duration': rpa_prep_duration,
+        'recording': True
+    },
+]
+# Setpoint sequences of chambers which don't run setpoint_record_sequence
+chamber_setpoint_record_sequences = {}
+
+
+class Chamber(object):
+    """Controller of one chamber, running its own setpoint sequence."""
+    def __init__(
+        self, name, controller, setpoint_record_sequence,
+        preflight_record=None, postflight_record=None, clock=None
+    ):
+        self.name = name
+        self.controller = controller
+        self.setpoint_record_sequence = setpoint_record_sequence
+        self.preflight_record = preflight_record
+        self.postflight_record = postflight_record
+        self.clock = clock if clock is not None else scheduling.system_clock
+        self.steps = None
+        self.finished = True
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        self.updates = 0
+        self.last_update_time = None
+        self.period_total = 0.0
+        self.period_min = None
+        self.period_max = None
+
+    def iterate_steps(self):
+        kwargs = {'clock': self.clock, 'name': self.name}
+        if self.preflight_record is not None:
+            yield from thermal.iterate_flight_record(
+                self.controller, self.preflight_record, **kwargs
+            )
+        self.controller.enable_heater()
+        yield from thermal.iterate_setpoint_sequence(
+            self.controller, self.setpoint_record_sequence, **kwargs
+        )
+        if self.postflight_record is not None:
+            yield from thermal.iterate_flight_record(
+                self.controller, self.postflight_record, **kwargs
+            )
+
+    def start(self):
+        self.reset_statistics()
+        self.finished = False
+        self.steps = self.iterate_steps()
+        self.step()  # Set up the first setpoint record
+
+    def step(self):
+        """Run the next controller update of the setpoint sequence."""
+        try:
+            next(self.steps)
+        except StopIteration:
+            self.finish()
+
+    def record_update(self, update_time):
+        self.updates += 1
+        if self.last_update_time is not None:
+            period = update_time - self.last_update_time
+            self.period_total += period
+            if self.period_min is None or period < self.period_min:
+                self.period_min = period
+            if self.period_max is None or period > self.period_max:
+                self.period_max = period
+        self.last_update_time = update_time
+
+    def finish(self):
+        self.finished = True
+        for output in self.controller.outputs:
+            output.set_state(0)
+        for reporter in self.controller.reporters:
+            if reporter is not None:
+                reporter.close_report()
+        print('{}: Finished!'.format(self.name))
+
+    @property
+    def period_mean(self):
+        if self.updates < 2:
+            return None
+        return self.period_total / (self.updates - 1)
+
+    def __str__(self):
+        return '{}: {} updates; period mean {}, min {}, max {}'.format(
+            self.name, self.updates,
+            scheduling.format_ms(self.period_mean),
+            scheduling.format_ms(self.period_min),
+            scheduling.format_ms(self.period_max)
+        )
+
+
+class ChamberManager(object):
+    """Interleave the updates of several chambers on one loop scheduler.
+
+    Each control loop interval is divided into one time slot per chamber,
+    which updates the chamber's controller. Slots of finished chambers stay
+    idle, so the other chambers keep their loop period.
+    """
+    def __init__(self, chambers, interval, policy='skip', clock=None):
+        self.chambers = list(chambers)
+        self.interval = interval
+        self.clock = clock if clock is not None else scheduling.system_clock
+        self.scheduler = scheduling.LoopScheduler(
+            interval / len(self.chambers), policy=policy, clock=self.clock
+        )
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def finished(self):
+        return all(chamber.finished for chamber in self.chambers)
+
+    @property
+    def updates(self):
+        return sum(chamber.updates for chamber in self.chambers)
+
+    @property
+    def throughput(self):
+        """Aggregate controller updates per second."""
+        if self.start_time is None:
+            return None
+        end_time = (
+            self.end_time if self.end_time is not None
+            else self.clock.monotonic()
+        )
+        if end_time <= self.start_time:
+            return None
+        return self.updates / (end_time - self.start_time)
+
+    def run(self):
+        self.scheduler.reset()
+        for chamber in self.chambers:
+            chamber.start()
+        self.start_time = self.clock.monotonic()
+        self.end_time = None
+        try:
+            while not self.finished:
+                for chamber in self.chambers:
+                    self.scheduler.wait()
+                    if chamber.finished:
+                        continue
+
+                    chamber.step()
+                    if not chamber.finished:
+                        chamber.record_update(self.clock.monotonic())
+        finally:
+            self.scheduler.finish_iteration()
+            self.end_time = self.clock.monotonic()
+
+    def format_statistics(self):
+        throughput = self.throughput
+        lines = [
+            'Control loop slots: {}'.format(self.scheduler.statistics),
+            'Aggregate throughput: {} updates/s over {} chambers'.format(
+                '{:.1f}'.format(throughput) if throughput is not None else '-',
+                len(self.chambers)
+            )
+        ]
+        lines.extend(str(chamber) for chamber in self.chambers)
+        buses = []
+        for chamber in self.chambers:
+            for pin in (
+                chamber.controller.process_variable.reference_pin,
+                chamber.controller.process_variable.thermistor_pin
+            ):
+                if pin.adc.bus not in buses:
+                    buses.append(pin.adc.bus)
+        lines.extend(
+            'I2C bus {}: {}'.format(
+                bus.busnum if bus.busnum is not None else 'default', bus
+            )
+            for bus in buses
+        )
+        return '\n'.join(lines)
+
+
+def wire_simulated_plants(chamber_settings):
+    """Give each chamber its own plant on the simulated backend."""
+    for (i, settings) in enumerate(chamber_settings):
+        gpio.gpio_sim.add_plant(
+            settings['adc_address'], gpio.gpio_sim.ThermalPlant(
+                gpio.GPIO, heater_pin=settings['heater_pin'],
+                fan_pin=settings['fan_pin'],
+                thermistor_channel=settings['thermistor_channel'],
+                reference_channel=reference_channel, seed=i
+            )
+        )
+
+
+def build_chambers(chamber_settings, clock=None):
+    """Build chambers whose thermistors share ADCs and reference pins."""
+    if clock is None:
+        clock = gpio.default_clock
+    adcs = {}
+    reference_pins = {}
+    chambers = []
+    for settings in chamber_settings:
+        name = settings['name']
+        address = settings['adc_address']
+        if address not in adcs:
+            adcs[address] = gpio.ADC(address=address)
+            reference_pins[address] = gpio.AnalogPin(
+                adcs[address], reference_channel,
+                refresh_interval=reference_refresh_interval, clock=clock
+            )
+        controller = thermal.HeaterFanController(
+            thermal.Thermistor(  # Temperature sensor
+                reference_pins[address],  # Reference
+                gpio.DifferentialAnalogPin(  # Sensor
+                    adcs[address], settings['thermistor_channel'],
+                    ref_pin=reference_channel, clock=clock
+                ),
+                bias_resistance=1960,  # Ohm
+                A=0.0010349722285233954,
+                B=0.00022717987892035313,
+                C=3.008424040777896e-07,
+                lookup_table_size=32768,  # buckets; max error ~0.01 deg C
+                differential=True
+            ),
+            thermal.PIDControl(  # Heater control
+                0.0775, 0.00125, 0.0,  # Kp, Ki, Kd
+                setpoint_reached_epsilon=setpoint_reached_epsilon,
+                settling_detector=thermal.SettlingDetector(
+                    setpoint_reached_epsilon, setpoint_settling_dwell_time,
+                    clock=clock
+                ),
+                proportional_on_measurement=True,
+                clock=clock
+            ),
+            gpio.PWMPin(settings['heater_pin']),  # Heater
+            thermal.InfiniteGainControl(
+                setpoint_reached_epsilon=setpoint_reached_epsilon,
+                output_increases_process_variable=False
+            ),  # Fan control
+            gpio.DigitalPin(settings['fan_pin']),  # Fan
+            fan_setpoint_offset=0.25,  # deg C
+            file_reporter=thermal.AsyncControllerReporter(
+                interval=file_reporter_interval,
+                file_prefix='thermal_chambers_{}_'.format(name),
+                flush_rows=file_reporter_flush_rows,
+                flush_interval=file_reporter_flush_interval,
+                clock=clock
+            ),
+            instrumentation=metrics.ControllerInstrumentation(name=name)
+        )
+        chambers.append(Chamber(
+            name, controller,
+            chamber_setpoint_record_sequences.get(
+                name, setpoint_record_sequence
+            ),
+            preflight_record=preflight_record,
+            postflight_record=postflight_record,
+            clock=clock
+        ))
+    return chambers
+
+
+def main():
+    clock = gpio.default_clock
+    if gpio.backend == 'simulated':
+        wire_simulated_plants(chamber_settings)
+    chambers = build_chambers(chamber_settings, clock=clock)
+    manager = ChamberManager(
+        chambers, control_loop_interval / 1000, policy=control_loop_policy,
+        clock=clock
+    )
+    metrics_exporter = metrics.MetricsExporter(
+        [chamber.controller.instrumentation for chamber in chambers],
+        metrics_filename, interval=metrics_export_interval
+    )
+    metrics_exporter.start()
+    try:
+        manager.run()
+    except KeyboardInterrupt:
+        print('Quitting early...')
+    print(manager.format_statistics())
+    metrics_exporter.stop()
+    gpio.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""Run PCR-style thermal cycling on the lysis heater.
+
+Cycling protocols are setpoint profiles whose repeat block iterations are
+the cycles; the default protocol is an initial denaturation followed by
+denature/anneal cycles. The whole run is recorded in one continuous report.
+As each segment of the protocol finishes, its ramp rate, time to setpoint,
+overshoot and hold accuracy are written to a cycle report and folded into
+running statistics per step, so memory use stays constant however many
+cycles are run.
+"""
+import argparse
+import math
+from datetime import datetime
+
+import setpoint_profiles
+
+
+# Cycling protocol settings
+initial_denature_temperature = 95.0  # deg C
+initial_denature_duration = 2.0  # min
+denature_temperature = 95.0  # deg C
+denature_duration = 0.25  # min
+anneal_temperature = 60.0  # deg C
+anneal_duration = 0.5  # min
+cycles = 40
+min_temperature = 20.0  # deg C
+max_temperature = 100.0  # deg C
+
+
+def build_protocol(cycles=cycles):
+    return {
+        'name': 'thermal_cycling',
+        'steps': [
+            {
+                'name': 'initial_denature',
+                'value': initial_denature_temperature,
+                'duration': initial_denature_duration
+            },
+            {
+                'type': 'repeat',
+                'count': cycles,
+                'steps': [
+                    {
+                        'name': 'denature',
+                        'value': denature_temperature,
+                        'duration': denature_duration
+                    },
+                    {
+                        'name': 'anneal',
+                        'value': anneal_temperature,
+                        'duration': anneal_duration
+                    }
+                ]
+            }
+        ]
+    }
+
+
+# Statistics
+
+class RunningStatistics(object):
+    """Mean, standard deviation and range of values, in constant memory."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.sum_squared_deviations = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, value):
+        if value is None:
+            return
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.sum_squared_deviations += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return None
+        return math.sqrt(self.sum_squared_deviations / (self.count - 1))
+
+    def __str__(self):
+        if not self.count:
+            return '-'
+        return '{:.2f} +/- {:.2f} ({:.2f} to {:.2f})'.format(
+            self.mean, self.std or 0.0, self.min, self.max
+        )
+
+
+class SegmentStatistics(object):
+    """Incremental statistics of one run of a profile segment.
+
+    The approach lasts from the start of the segment until the temperature
+    first enters the band around, or crosses, the segment's end value, and
+    gives the ramp rate and time to setpoint. The remainder of the segment
+    is the hold, which gives the hold error. The overshoot past the
+    setpoint is tracked over the whole segment, and the settle time is when
+    the controller first reports the setpoint as reached.
+    """
+    def __init__(self, segment, start_time, start_temperature, band=0.5):
+        self.segment = segment
+        self.start_time = start_time
+        self.start_temperature = start_temperature
+        self.band = band
+        self.direction = (
+            1 if segment.end_value >= start_temperature else -1
+        )
+        self.time_to_setpoint = None
+        self.settle_time = None
+        self.ramp_rate = None
+        self.overshoot = 0.0
+        self.hold_samples = 0
+        self.hold_error_sum = 0.0
+        self.hold_squared_error_sum = 0.0
+        self.hold_max_error = 0.0
+        self.last_time = start_time
+        self.last_temperature = start_temperature
+
+    def update(self, current_time, temperature, setpoint, setpoint_reached):
+        self.last_time = current_time
+        self.last_temperature = temperature
+        error = temperature - setpoint
+        self.overshoot = max(self.overshoot, self.direction * error)
+        if setpoint_reached and self.settle_time is None:
+            self.settle_time = current_time - self.start_time
+        if self.time_to_setpoint is None:
+            target_error = temperature - self.segment.end_value
+            if (
+                abs(target_error) > self.band
+                and self.direction * target_error < 0
+            ):
+                return
+
+            self.time_to_setpoint = current_time - self.start_time
+            if self.time_to_setpoint > 0:
+                self.ramp_rate = (
+                    (temperature - self.start_temperature)
+                    / self.time_to_setpoint
+                )
+        self.hold_samples += 1
+        self.hold_error_sum += error
+        self.hold_squared_error_sum += error ** 2
+        self.hold_max_error = max(self.hold_max_error, abs(error))
+
+    def finish(self):
+        if self.ramp_rate is None and self.last_time > self.start_time:
+            # Never reached, e.g. a ramp segment; use its average rate
+            self.ramp_rate = (
+                (self.last_temperature - self.start_temperature)
+                / (self.last_time - self.start_time)
+            )
+
+    @property
+    def hold_mean_error(self):
+        if not self.hold_samples:
+            return None
+        return self.hold_error_sum / self.hold_samples
+
+    @property
+    def hold_rms_error(self):
+        if not self.hold_samples:
+            return None
+        return math.sqrt(self.hold_squared_error_sum / self.hold_samples)
+
+    def as_row(self):
+        return (
+            self.segment.cycle, self.segment.name, self.segment.end_value,
+            self.last_time - self.start_time, self.time_to_setpoint,
+            self.settle_time, self.ramp_rate, self.overshoot,
+            self.hold_mean_error, self.hold_rms_error, self.hold_max_error
+        )
+
+
+def format_value(value, format_string='{:.3f}'):
+    if value is None:
+        return ''
+    return format_string.format(value)
+
+
+class CyclingMonitor(object):
+    """Monitor of a profile run which summarizes each segment and cycle.
+
+    Pass to thermal.iterate_profile as its monitor. Only the statistics of
+    the current segment and cycle are kept, along with running statistics
+    per step name.
+    """
+    header = (
+        'Cycle', 'Step', 'Setpoint (deg C)', 'Duration (s)',
+        'Time to Setpoint (s)', 'Settle Time (s)', 'Ramp Rate (deg C/s)',
+        'Overshoot (deg C)', 'Hold Mean Error (deg C)',
+        'Hold RMS Error (deg C)', 'Hold Max Error (deg C)'
+    )
+    summaries = (
+        ('time_to_setpoint', 'time to setpoint (s)'),
+        ('settle_time', 'settle time (s)'),
+        ('ramp_rate', 'ramp rate (deg C/s)'),
+        ('overshoot', 'overshoot (deg C)'),
+        ('hold_rms_error', 'hold RMS error (deg C)')
+    )
+
+    def __init__(self, file_prefix='', verbose=True, band=0.5):
+        self.file_prefix = file_prefix
+        self.band = band
+        self.verbose = verbose
+        self.file = None
+        self.segment_index = None
+        self.segment_statistics = None
+        self.cycle = None
+        self.cycle_statistics = []
+        self.step_statistics = {}
+        self.completed_cycles = 0
+
+    def open_report(self):
+        self.filename = '{}{}_cycles.csv'.format(
+            self.file_prefix, datetime.now().isoformat(sep='_')
+        )
+        print('Logging cycle statistics to {}...'.format(self.filename))
+        self.file = open(self.filename, 'w')
+        self.file.write(','.join(self.header) + '\n')
+
+    def update(
+        self, cursor, current_time, temperature, setpoint, setpoint_reached
+    ):
+        if temperature is None:
+            return
+
+        if cursor.index != self.segment_index:
+            self.finish_segment()
+            segment = cursor.segment
+            if segment.cycle != self.cycle:
+                self.finish_cycle()
+                self.cycle = segment.cycle
+            self.segment_index = cursor.index
+            self.segment_statistics = SegmentStatistics(
+                segment, current_time, temperature, band=self.band
+            )
+        self.segment_statistics.update(
+            current_time, temperature, setpoint, setpoint_reached
+        )
+
+    def finish_segment(self):
+        statistics = self.segment_statistics
+        if statistics is None:
+            return
+
+        statistics.finish()
+        if self.file is None:
+            self.open_report()
+        self.file.write(','.join(
+            format_value(value, '{}') if i < 2 else format_value(value)
+            for (i, value) in enumerate(statistics.as_row())
+        ) + '\n')
+        self.file.flush()
+        if statistics.segment.cycle is not None:
+            self.cycle_statistics.append(statistics)
+            if statistics.segment.name not in self.step_statistics:
+                self.step_statistics[statistics.segment.name] = {
+                    attribute: RunningStatistics()
+                    for (attribute, _) in self.summaries
+                }
+            step_statistics = self.step_statistics[statistics.segment.name]
+            for (attribute, _) in self.summaries:
+                step_statistics[attribute].update(
+                    getattr(statistics, attribute)
+                )
+        self.segment_statistics = None
+
+    def finish_cycle(self):
+        if self.cycle is None or not self.cycle_statistics:
+            self.cycle_statistics = []
+            return
+
+        self.completed_cycles += 1
+        if self.verbose:
+            print('Cycle {}: {}'.format(self.cycle, '; '.join(
+                '{} reached in {} s at {} deg C/s, settled in {} s, '
+                'overshoot {} deg C, hold RMS error {} deg C'.format(
+                    statistics.segment.name,
+                    format_value(statistics.time_to_setpoint, '{:.1f}'),
+                    format_value(statistics.ramp_rate, '{:.2f}'),
+                    format_value(statistics.settle_time, '{:.1f}'),
+                    format_value(statistics.overshoot, '{:.2f}'),
+                    format_value(statistics.hold_rms_error, '{:.3f}')
+                )
+                for statistics in self.cycle_statistics
+            )))
+        self.cycle_statistics = []
+
+    def finish(self, current_time=None):
+        self.finish_segment()
+        self.finish_cycle()
+        self.cycle = None
+        self.segment_index = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def format_summary(self):
+        lines = ['{} cycles completed'.format(self.completed_cycles)]
+        for (name, step_statistics) in self.step_statistics.items():
+            lines.extend(
+                '{} {}: {}'.format(name, label, step_statistics[attribute])
+                for (attribute, label) in self.summaries
+            )
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run PCR-style thermal cycling on the lysis heater.'
+    )
+    parser.add_argument(
+        'filename', nargs='?', default=None,
+        help='Cycling profile to run. Default: the built-in protocol'
+    )
+    parser.add_argument(
+        '--cycles', '-n', type=int, default=cycles,
+        help=(
+            'Number of cycles of the built-in protocol. Default: {}'.format(
+                cycles
+            )
+        )
+    )
+    parser.add_argument(
+        '--check', action='store_true',
+        help='Only validate the profile and print its segments.'
+    )
+    args = parser.parse_args()
+
+    kwargs = {'min_value': min_temperature, 'max_value': max_temperature}
+    try:
+        if args.filename is None:
+            profile = setpoint_profiles.compile_profile(
+                build_protocol(args.cycles), **kwargs
+            )
+        else:
+            profile = setpoint_profiles.load_profile(args.filename, **kwargs)
+    except (OSError, setpoint_profiles.ProfileError) as e:
+        parser.error(str(e))
+    print('Profile {}: {} segments'.format(
+        profile.name, len(profile.segments)
+    ))
+    if args.check:
+        print(profile)
+        return
+
+    # Importing thermal_lysis initializes the hardware
+    import gpio
+    import thermal_lysis
+
+    thermal_lysis.start_adc_sampler()
+    thermal_lysis.metrics_exporter.start()
+    monitor = CyclingMonitor(
+        file_prefix='{}_'.format(profile.name),
+        band=thermal_lysis.setpoint_reached_epsilon
+    )
+    try:
+        thermal_lysis.run_profile(
+            profile, thermal_lysis.control_loop_interval,
+            preflight_record=thermal_lysis.preflight_record,
+            postflight_record=thermal_lysis.postflight_record,
+            monitor=monitor
+        )
+    except KeyboardInterrupt:
+        print('Quitting early...')
+        monitor.finish()
+    print(monitor.format_summary())
+    thermal_lysis.adc_sampler.stop()
+    thermal_lysis.metrics_exporter.stop()
+    gpio.cleanup()
+
+
+if __name__ == '__main__':
+    main()
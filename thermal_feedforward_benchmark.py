@@ -0,0 +1,233 @@
+"""Compare setpoint transitions across controller configurations.
+
+Runs the lysis sequence's setpoint steps on the simulated plant, on a
+simulated clock, with pure feedback, with model feedforward, and with
+split-range heater and fan control, with a digital or PWM fan. For each
+step, measures the time until the setpoint is reached, the overshoot past
+the setpoint while holding, the RMS error while holding, the number of fan
+switches, and the time for which the heater and fan were both on. The
+feedforward model can be made to misestimate the plant, to check how
+feedback copes with model errors.
+"""
+import argparse
+import math
+import os
+
+os.environ.setdefault('GPIO_BACKEND', 'simulated')
+os.environ.setdefault('GPIO_SIMULATION_CLOCK', 'simulated')
+
+import filters
+import gpio
+import scheduling
+import thermal
+
+setpoint_reached_epsilon = 0.5  # deg C
+control_loop_interval = 0.05  # s
+fan_min_on_time = 5.0  # s
+fan_min_off_time = 5.0  # s
+steps = (
+    ('heat to lysis', 90.0),
+    ('cool to RPA prep', 40.0),
+    ('cool to room', 25.0)
+)
+
+
+def build_controller(
+    heater, fan, thermistor, model, clock, feedforward=False,
+    split_range=False
+):
+    fan_pwm = isinstance(fan, gpio.PWMPin)
+    heater_control = thermal.PIDControl(
+        0.0775, 0.00125, 0.0,  # Kp, Ki, Kd
+        min_output=-1.0 if split_range else 0.0,
+        setpoint_reached_epsilon=setpoint_reached_epsilon,
+        proportional_on_measurement=True,
+        clock=clock
+    )
+    if feedforward:
+        feedforward = thermal.ModelFeedforward(
+            model, discrete_fan=not fan_pwm, clock=clock
+        )
+    else:
+        feedforward = None
+    if split_range:
+        return thermal.SplitRangeHeaterFanController(
+            thermistor, heater_control, heater, fan,
+            fan_limiter=thermal.MinimumOnOffTime(
+                min_on_time=fan_min_on_time, min_off_time=fan_min_off_time,
+                min_effort=0.2 if fan_pwm else 0.5, clock=clock
+            ),
+            feedforward=feedforward
+        )
+    return thermal.HeaterFanController(
+        thermistor, heater_control, heater,
+        thermal.InfiniteGainControl(
+            setpoint_reached_epsilon=setpoint_reached_epsilon,
+            output_increases_process_variable=False
+        ),
+        fan,
+        fan_setpoint_offset=0.25,
+        feedforward=feedforward
+    )
+
+
+def run_step(controller, setpoint, hold_duration, timeout, clock):
+    scheduler = scheduling.LoopScheduler(control_loop_interval, clock=clock)
+    controller.reset()
+    controller.set_setpoint(setpoint)
+    start_time = clock.monotonic()
+    start_temperature = controller.process_variable.read()
+    direction = 1 if setpoint >= start_temperature else -1
+    reached_time = None
+    errors = []
+    fan_on = False
+    fan_switches = 0
+    overlap_time = 0.0
+    while True:
+        scheduler.wait()
+        (temperature, _) = controller.update()
+        elapsed = clock.monotonic() - start_time
+        if bool(controller.fan.state) != fan_on:
+            fan_on = not fan_on
+            fan_switches += 1
+        if controller.heater.state and fan_on:
+            overlap_time += control_loop_interval
+        if temperature is None:
+            continue
+        if reached_time is None:
+            if controller.setpoint_reached:
+                reached_time = elapsed
+            elif elapsed > timeout:
+                break
+        else:
+            errors.append(temperature - setpoint)
+            if elapsed - reached_time >= hold_duration:
+                break
+    return {
+        'reached_time': reached_time,
+        'overshoot': max(
+            [0.0] + [direction * error for error in errors]
+        ),
+        'rms_error': (
+            math.sqrt(sum(error ** 2 for error in errors) / len(errors))
+            if errors else None
+        ),
+        'fan_switches': fan_switches,
+        'overlap_time': overlap_time
+    }
+
+
+def format_result(result):
+    switching = '{:>12}{:>12.1f}'.format(
+        result['fan_switches'], result['overlap_time']
+    )
+    if result['reached_time'] is None:
+        return '{:>12}{:>12}{:>12}{}'.format('timeout', '-', '-', switching)
+    return '{:>12.1f}{:>12.2f}{:>12.3f}{}'.format(
+        result['reached_time'], result['overshoot'], result['rms_error'],
+        switching
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare setpoint transitions across controllers.'
+    )
+    parser.add_argument(
+        '--hold', type=float, default=3.0,
+        help='Time to hold each setpoint, in min. Default: 3'
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=30.0,
+        help='Time limit to reach each setpoint, in min. Default: 30'
+    )
+    parser.add_argument(
+        '--model-error', type=float, default=0.0,
+        help=(
+            'Fraction by which the feedforward model overestimates the '
+            "plant's heating and fan cooling rates. Default: 0"
+        )
+    )
+    parser.add_argument(
+        '--configurations', '-c', nargs='+',
+        choices=('feedback', 'feedforward', 'split', 'split_pwm'),
+        help='Controller configurations to run. Default: all'
+    )
+    args = parser.parse_args()
+    if gpio.backend != 'simulated':
+        parser.error('The benchmark requires the simulated GPIO backend.')
+
+    clock = gpio.default_clock
+    plant = gpio.gpio_sim.default_plant
+    plant_model = plant.model
+    model = thermal.ThermalModel(
+        plant_model.heating_rate * (1 + args.model_error),
+        plant_model.ambient_loss_rate,
+        plant_model.fan_loss_rate * (1 + args.model_error),
+        ambient_temperature=plant_model.ambient_temperature,
+        sensor_time_constant=plant_model.sensor_time_constant
+    )
+    adc = gpio.ADC()
+    thermistor = thermal.Thermistor(
+        gpio.AnalogPin(adc, 3),
+        gpio.DifferentialAnalogPin(adc, 0, ref_pin=3),
+        bias_resistance=1960,  # Ohm
+        A=0.0010349722285233954,
+        B=0.00022717987892035313,
+        C=3.008424040777896e-07,
+        lookup_table_size=32768,
+        differential=True,
+        temperature_filter=filters.FilterChain((
+            filters.OutlierRejectionFilter(1.0),
+            filters.RunningMedianFilter(5)
+        ))
+    )
+    heater = gpio.PWMPin(18)
+    digital_fan = gpio.DigitalPin(4)
+    pwm_fan = gpio.PWMPin(5)
+    configurations = (
+        ('feedback', digital_fan, {}),
+        ('feedforward', digital_fan, {'feedforward': True}),
+        ('split', digital_fan, {'feedforward': True, 'split_range': True}),
+        ('split_pwm', pwm_fan, {'feedforward': True, 'split_range': True})
+    )
+
+    print('Feedforward model: {}'.format(model))
+    print('{:<14}{:<18}{:>12}{:>12}{:>12}{:>12}{:>12}'.format(
+        'Control', 'Step', 'Reach (s)', 'Overshoot', 'RMS error',
+        'Fan switch', 'Overlap (s)'
+    ))
+    for (name, fan, kwargs) in configurations:
+        if args.configurations and name not in args.configurations:
+            continue
+        plant.fan_pin = fan.pin
+        plant.reset()
+        thermistor.temperature_filter.reset()
+        controller = build_controller(
+            heater, fan, thermistor, model, clock, **kwargs
+        )
+        total_time = 0.0
+        for (step_name, setpoint) in steps:
+            result = run_step(
+                controller, setpoint, 60 * args.hold, 60 * args.timeout,
+                clock
+            )
+            if result['reached_time'] is not None and total_time is not None:
+                total_time += result['reached_time']
+            else:
+                total_time = None
+            print('{:<14}{:<18}{}'.format(
+                name, step_name, format_result(result)
+            ))
+        print('{:<14}{:<18}{:>12}'.format(
+            name, 'total',
+            '{:.1f}'.format(total_time) if total_time is not None
+            else 'timeout'
+        ))
+        for output in controller.outputs:
+            output.set_state(0)
+    gpio.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Benchmark temperature filters and ADC oversampling.
+
+For each filter, measures the cost per sample, the reduction of Gaussian
+noise, the largest error caused by isolated spikes, and the lag of the
+filter's ramp response. Oversampling is measured on the simulated GPIO
+backend unless GPIO_BACKEND is set.
+"""
+import argparse
+import os
+import time
+import timeit
+
+import numpy as np
+
+os.environ.setdefault('GPIO_BACKEND', 'simulated')
+
+import filters
+import gpio
+
+temperature = 90.0  # deg C
+noise = 0.1  # deg C, standard deviation
+spike = 5.0  # deg C
+spike_probability = 0.01
+ramp_rate = 0.01  # deg C per sample
+
+
+def build_filters():
+    return {
+        'none': filters.Filter(),
+        'moving_average_5': filters.MovingAverageFilter(5),
+        'moving_average_20': filters.MovingAverageFilter(20),
+        'ema_0.2': filters.ExponentialMovingAverageFilter(0.2),
+        'ema_0.05': filters.ExponentialMovingAverageFilter(0.05),
+        'median_3': filters.RunningMedianFilter(3),
+        'median_5': filters.RunningMedianFilter(5),
+        'outlier_1.0': filters.OutlierRejectionFilter(1.0),
+        'outlier_1.0+median_5': filters.FilterChain((
+            filters.OutlierRejectionFilter(1.0), filters.RunningMedianFilter(5)
+        ))
+    }
+
+
+def apply_filter(sample_filter, samples):
+    sample_filter.reset()
+    return np.array([sample_filter.update(sample) for sample in samples])
+
+
+def measure_filter(sample_filter, number, random):
+    warmup = 100
+    noisy = temperature + random.normal(0, noise, number)
+    filtered = apply_filter(sample_filter, noisy.tolist())
+    noise_ratio = np.std(filtered[warmup:]) / np.std(noisy[warmup:])
+
+    spiky = np.full(number, temperature)
+    spikes = random.random_sample(number) < spike_probability
+    spiky[spikes] += spike
+    filtered = apply_filter(sample_filter, spiky.tolist())
+    spike_error = np.max(np.abs(filtered[warmup:] - temperature))
+
+    ramp = temperature + ramp_rate * np.arange(number)
+    filtered = apply_filter(sample_filter, ramp.tolist())
+    ramp_lag = np.mean(ramp[warmup:] - filtered[warmup:]) / ramp_rate
+
+    samples = noisy.tolist()
+    sample_filter.reset()
+    cost = timeit.timeit(
+        lambda: [sample_filter.update(sample) for sample in samples], number=1
+    ) / number
+    return {
+        'cost': cost,
+        'noise_ratio': noise_ratio,
+        'spike_error': spike_error,
+        'ramp_lag': ramp_lag,
+        'delay': sample_filter.delay
+    }
+
+
+def measure_oversampling(oversampling, conversions):
+    adc = gpio.ADC()
+    pin = gpio.DifferentialAnalogPin(
+        adc, 0, ref_pin=3, oversampling=oversampling
+    )
+    start_time = time.perf_counter()
+    readings = [pin.convert() for _ in range(conversions)]
+    duration = time.perf_counter() - start_time
+    return {
+        'conversion_time': duration / conversions,
+        'noise': np.std(readings)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark temperature filters and ADC oversampling.'
+    )
+    parser.add_argument(
+        '--number', '-n', type=int, default=100000,
+        help='Number of samples to filter. Default: 100000'
+    )
+    parser.add_argument(
+        '--conversions', '-c', type=int, default=100,
+        help='Number of oversampled conversions to time. Default: 100'
+    )
+    parser.add_argument(
+        '--oversampling', '-o', type=int, nargs='+', default=[1, 2, 4, 8],
+        help='Oversampling factors to measure. Default: 1 2 4 8'
+    )
+    args = parser.parse_args()
+
+    random = np.random.RandomState(0)
+    print(
+        'Filters at {:.1f} deg C with {:.2f} deg C noise, {:.1f} deg C spikes '
+        'in {:.0%} of samples, and a {:.3f} deg C/sample ramp:'.format(
+            temperature, noise, spike, spike_probability, ramp_rate
+        )
+    )
+    print('{:<22}{:>12}{:>12}{:>14}{:>12}{:>10}'.format(
+        'Filter', 'Cost (us)', 'Noise ratio', 'Spike error', 'Ramp lag',
+        'Delay'
+    ))
+    for (name, sample_filter) in build_filters().items():
+        result = measure_filter(sample_filter, args.number, random)
+        print('{:<22}{:>12.2f}{:>12.3f}{:>14.3f}{:>12.2f}{:>10.2f}'.format(
+            name, 1e6 * result['cost'], result['noise_ratio'],
+            result['spike_error'], result['ramp_lag'], result['delay']
+        ))
+
+    print('Oversampling on the {} backend:'.format(gpio.backend))
+    print('{:<22}{:>18}{:>18}'.format(
+        'Oversampling', 'Conversion (ms)', 'Noise (codes)'
+    ))
+    for oversampling in args.oversampling:
+        result = measure_oversampling(oversampling, args.conversions)
+        print('{:<22}{:>18.2f}{:>18.2f}'.format(
+            oversampling, 1000 * result['conversion_time'], result['noise']
+        ))
+    gpio.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,175 @@
-import time
+import os
+import socket
 
+import autotuning
+import filters
 import gpio
+import metrics
+import scheduling
+import telemetry
 import thermal
 
 
 # Reporting settings
 setpoint_reached_epsilon = 0.5  # deg C
+setpoint_settling_dwell_time = 10.0  # s within epsilon to reach setpoint
 file_reporter_interval = 0.5
+file_reporter_flush_rows = 20
+file_reporter_flush_interval = 5.0  # s
 print_reporter_interval = 15  # s
 
+# Telemetry settings; read the telemetry with thermal_telemetry.py
+telemetry_name = 'thermal_lysis'  # specify None to disable
+telemetry_capacity = 4096  # records
+
+# Metrics settings
+metrics_filename = 'thermal_lysis_metrics.prom'
+metrics_format = 'prometheus'  # or 'json'
+metrics_export_interval = 10.0  # s
+
+# ADC sampling settings
+adc_sample_interval = 0.01  # s
+reference_refresh_interval = 1.0  # s
+thermistor_oversampling = 1  # conversions averaged per thermistor sample
+
+# Temperature filter settings; see thermal_filter_benchmark.py for tradeoffs
+outlier_max_deviation = 1.0  # deg C between consecutive readings
+median_filter_window = 5  # samples
+
+# PID settings; gains tuned by thermal_autotune.py override the defaults
+pid_config_path = os.path.join(thermal.root_path, 'config', 'thermal_pid.json')
+device_name = socket.gethostname()
+default_pid_gains = (0.0775, 0.00125, 0.0)  # Kp, Ki, Kd
+pid_gains = autotuning.load_pid_gains(
+    pid_config_path, device_name, default_pid_gains
+)
+
+# Feedforward settings; fit the model to reports with thermal_plant_fit.py
+# and specify it, e.g. thermal.fitted_thermal_model, to enable feedforward
+feedforward_model = None  # specify None for pure feedback
+feedforward_heating_rate_fraction = 0.8  # of the full heater rate
+
+# Fan settings
+# Split-range control drives the heater and fan from one PID effort; enable
+# it only with gains tuned for split-range control, as the default and
+# autotuned gains are tuned for the heater alone
+split_range_control = False
+fan_pwm = False  # specify True if the fan can be driven by PWM
+fan_pwm_frequency = 100  # Hz
+fan_gain = 1.0  # fan duty per unit of negative split-range effort
+fan_min_on_time = 5.0  # s
+fan_min_off_time = 5.0  # s
+fan_min_duty = 0.2 if fan_pwm else 0.5  # duty below which the fan is off
+
 # Controller initialization
+clock = gpio.default_clock
+if feedforward_model is not None:
+    feedforward = thermal.ModelFeedforward(
+        feedforward_model,
+        heating_rate_fraction=feedforward_heating_rate_fraction,
+        discrete_fan=not fan_pwm,
+        clock=clock
+    )
+else:
+    feedforward = None
 adc = gpio.ADC()
-controller = thermal.HeaterFanController(
-    thermal.Thermistor(  # Temperature sensor
-        gpio.AnalogPin(adc, 3),  # Reference
-        gpio.AnalogPin(adc, 0),  # Sensor
-        bias_resistance=1960,  # Ohm
-        A=0.0010349722285233954,
-        B=0.00022717987892035313,
-        C=3.008424040777896e-07
-    ),
-    thermal.PIDControl(  # Heater control
-        0.0775, 0.00125, 0.0,  # Kp, Ki, Kd
-        setpoint_reached_epsilon=setpoint_reached_epsilon,
-        proportional_on_measurement=True
+reference_pin = gpio.AnalogPin(
+    adc, 3, refresh_interval=reference_refresh_interval
+)
+thermistor_pin = gpio.DifferentialAnalogPin(
+    adc, 0, ref_pin=3, oversampling=thermistor_oversampling
+)
+thermistor = thermal.Thermistor(  # Temperature sensor
+    reference_pin,  # Reference
+    thermistor_pin,  # Sensor
+    bias_resistance=1960,  # Ohm
+    A=0.0010349722285233954,
+    B=0.00022717987892035313,
+    C=3.008424040777896e-07,
+    lookup_table_size=32768,  # buckets; max error ~0.01 deg C
+    differential=True,
+    temperature_filter=filters.FilterChain((
+        filters.OutlierRejectionFilter(outlier_max_deviation),
+        filters.RunningMedianFilter(median_filter_window)
+    ))
+)
+heater_control = thermal.PIDControl(
+    *pid_gains,  # Kp, Ki, Kd
+    min_output=-1.0 if split_range_control else 0.0,
+    setpoint_reached_epsilon=setpoint_reached_epsilon,
+    settling_detector=thermal.SettlingDetector(
+        setpoint_reached_epsilon, setpoint_settling_dwell_time,
+        clock=clock
     ),
-    gpio.PWMPin(18),  # Heater
-    thermal.InfiniteGainControl(
-        setpoint_reached_epsilon=setpoint_reached_epsilon,
-        output_increases_process_variable=False
-    ),  # Fan control
-    gpio.DigitalPin(4),  # Fan
-    fan_setpoint_offset=0.25,  # deg C
-    file_reporter=thermal.ControllerReporter(
+    proportional_on_measurement=True,
+    clock=clock
+)
+heater = gpio.PWMPin(18)
+if fan_pwm:
+    fan = gpio.PWMPin(4, frequency=fan_pwm_frequency)
+else:
+    fan = gpio.DigitalPin(4)
+reporter_kwargs = {
+    'file_reporter': thermal.AsyncControllerReporter(
         interval=file_reporter_interval,
-        file_prefix='thermal_lysis_'
+        file_prefix='thermal_lysis_',
+        flush_rows=file_reporter_flush_rows,
+        flush_interval=file_reporter_flush_interval,
+        clock=clock
+    ),
+    'print_reporter': thermal.ControllerPrinter(
+        interval=print_reporter_interval,
+        clock=clock
     ),
-    print_reporter=thermal.ControllerPrinter(
-        interval=print_reporter_interval
+    'instrumentation': metrics.ControllerInstrumentation(
+        name='thermal_lysis'
+    )
+}
+if telemetry_name is not None:
+    reporter_kwargs['telemetry_reporter'] = telemetry.SharedMemoryReporter(
+        telemetry_name, capacity=telemetry_capacity, clock=clock
     )
+if split_range_control:
+    controller = thermal.SplitRangeHeaterFanController(
+        thermistor, heater_control, heater, fan,
+        fan_gain=fan_gain,
+        fan_limiter=thermal.MinimumOnOffTime(
+            min_on_time=fan_min_on_time, min_off_time=fan_min_off_time,
+            min_effort=fan_min_duty, clock=clock
+        ),
+        feedforward=feedforward,
+        **reporter_kwargs
+    )
+else:
+    controller = thermal.HeaterFanController(
+        thermistor, heater_control, heater,
+        thermal.InfiniteGainControl(
+            setpoint_reached_epsilon=setpoint_reached_epsilon,
+            output_increases_process_variable=False
+        ),  # Fan control
+        fan,
+        fan_setpoint_offset=0.25,  # deg C
+        feedforward=feedforward,
+        **reporter_kwargs
+    )
+metrics_exporter = metrics.MetricsExporter(
+    (controller.instrumentation,), metrics_filename,
+    interval=metrics_export_interval, metrics_format=metrics_format
 )
+adc_sampler = gpio.ADCSampler(
+    (reference_pin, thermistor_pin), interval=adc_sample_interval
+)
+
+
+def start_adc_sampler():
+    """Start background ADC sampling; call from each entry point."""
+    if clock.realtime:
+        adc_sampler.start()
+
 
 # Setpoint sequence settings
 control_loop_interval = 50  # ms
+control_loop_policy = 'skip'  # or 'catch_up'
 room_temperature = 25.0  # deg C
 lysis_temperature = 90.0  # deg C
 lysis_duration = 10.0  # deg C
@@ -74,60 +201,80 @@ setpoint_record_sequence = [
 ]
 
 
-def run_controller_record(controller, control_loop_interval, setpoint_record):
-    controller.reset()
-    setpoint = setpoint_record['value']
-    recording = setpoint_record['recording']
-    duration = setpoint_record['duration']
-    if controller.file_reporter is not None:
-        controller.file_reporter.file_suffix = '_setpoint{:.1f},{:.1f}'.format(
-            setpoint, duration
+def run_controller_record(
+    controller, control_loop_interval, setpoint_record, scheduler=None
+):
+    if scheduler is None:
+        scheduler = scheduling.LoopScheduler(
+            control_loop_interval / 1000, policy=control_loop_policy,
+            clock=clock
         )
+    run_controller_steps(
+        thermal.iterate_setpoint_record(
+            controller, setpoint_record, clock=clock
+        ),
+        scheduler
+    )
 
-    controller.set_setpoint(setpoint)
-    print('Setpoint is now {:.1f}...'.format(setpoint))
-    if recording:
-        controller.enable_reporters()
-    else:
-        controller.disable_reporters()
-
-    # Control to setpoint
-    while not controller.setpoint_reached:
-        controller.update()
-        time.sleep(control_loop_interval / 1000)
-    # Control to duration
-    print('Reached setpoint!')
-    setpoint_reached_time = time.time()
-    if duration is None:
-        print(
-            'Holding at setpoint indefinitely. '
-            'Press Ctrl+C to stop holding and quit.'
-        )
-    else:
-        print('Holding for {:.1f} min...'.format(duration))
 
-    while (
-        duration is None or time.time() - setpoint_reached_time < 60 * duration
-    ):
-        controller.update()
-        time.sleep(control_loop_interval / 1000)
+def run_controller_steps(steps, scheduler):
+    """Run each controller update of steps on the scheduler's deadlines."""
+    for _ in steps:
+        scheduler.wait()
+    scheduler.finish_iteration()
+    print('Control loop: {}'.format(scheduler.statistics))
 
 
 def run_controller_sequence(
-        controller, control_loop_interval, setpoint_record_sequence
+        controller, control_loop_interval, setpoint_record_sequence,
+        scheduler=None
 ):
     for setpoint_record in setpoint_record_sequence:
         run_controller_record(
-            controller, control_loop_interval, setpoint_record
+            controller, control_loop_interval, setpoint_record,
+            scheduler=scheduler
         )
     print('Finished!')
 
 
+def add_sequence_reporter(sequence_name, file_suffix):
+    """Add a reporter which records a whole sequence in one report."""
+    controller.file_reporter.file_prefix = '{}_'.format(sequence_name)
+    sequence_reporter = thermal.AsyncControllerReporter(
+        interval=file_reporter_interval,
+        file_prefix='{}_'.format(sequence_name),
+        file_suffix=file_suffix,
+        flush_rows=file_reporter_flush_rows,
+        flush_interval=file_reporter_flush_interval,
+        clock=clock
+    )
+    sequence_reporter.control_efforts = controller.output_effort_names
+    controller.reporters.insert(0, sequence_reporter)
+    controller.enable_reporters()
+    controller.disableable_reporters = [
+        controller.file_reporter, sequence_reporter
+    ]
+    return sequence_reporter
+
+
+def run_flight_record(flight_record, scheduler):
+    run_controller_steps(
+        thermal.iterate_flight_record(
+            controller, flight_record, clock=clock
+        ),
+        scheduler
+    )
+
+
 def run_control_sequence(
     setpoint_record_sequence, control_loop_interval, sequence_name,
-    preflight_record=None, postflight_record=None
+    preflight_record=None, postflight_record=None, scheduler=None
 ):
-    controller.file_reporter.file_prefix = '{}_'.format(sequence_name)
+    if scheduler is None:
+        scheduler = scheduling.LoopScheduler(
+            control_loop_interval / 1000, policy=control_loop_policy,
+            clock=clock
+        )
     # Build sequence reporter
     sequence_string = '-'.join(
         '{:.1f},{:.1f}'.format(
@@ -135,47 +282,62 @@ def run_control_sequence(
         )
         for setpoint_record in setpoint_record_sequence
     )
-    sequence_reporter = thermal.ControllerReporter(
-        interval=file_reporter_interval,
-        file_prefix='{}_'.format(sequence_name),
-        file_suffix='_setpoints{}'.format(sequence_string)
+    sequence_reporter = add_sequence_reporter(
+        sequence_name, '_setpoints{}'.format(sequence_string)
     )
-    sequence_reporter.control_efforts = controller.output_effort_names
-    controller.reporters.insert(0, sequence_reporter)
-    controller.enable_reporters()
-    controller.disableable_reporters = [
-        controller.file_reporter, sequence_reporter
-    ]
     # Preflight
     if preflight_record is not None:
         print('Preflight: controlling system to starting temperature.')
-        if controller.process_variable.read() > preflight_record['value']:
-            controller.heater_control.disable()
-        else:
-            controller.heater_control.enable()
-        run_controller_record(
-            controller, control_loop_interval, preflight_record
-        )
+        run_flight_record(preflight_record, scheduler)
         sequence_reporter.reset()
     # Run sequence
-    controller.heater_control.enable()
+    controller.enable_heater()
     run_controller_sequence(
-        controller, control_loop_interval, setpoint_record_sequence
+        controller, control_loop_interval, setpoint_record_sequence,
+        scheduler=scheduler
     )
     # Postflight
     # Note: assumes that only the fan is needed to reach postflight setpoint.
     if postflight_record is not None:
         print('Postflight: controlling system to ending temperature.')
-        if controller.process_variable.read() > postflight_record['value']:
-            controller.heater_control.disable()
-        else:
-            controller.heater_control.enable()
-        run_controller_record(
-            controller, control_loop_interval, postflight_record
+        run_flight_record(postflight_record, scheduler)
+
+
+def run_profile(
+    profile, control_loop_interval, preflight_record=None,
+    postflight_record=None, scheduler=None, monitor=None
+):
+    """Run a compiled setpoint profile from setpoint_profiles.
+
+    The whole profile is recorded in one report.
+    """
+    if scheduler is None:
+        scheduler = scheduling.LoopScheduler(
+            control_loop_interval / 1000, policy=control_loop_policy,
+            clock=clock
         )
+    sequence_reporter = add_sequence_reporter(
+        profile.name, '_profile{}'.format(profile.name)
+    )
+    if preflight_record is not None:
+        print('Preflight: controlling system to starting temperature.')
+        run_flight_record(preflight_record, scheduler)
+        sequence_reporter.reset()
+    controller.enable_heater()
+    run_controller_steps(
+        thermal.iterate_profile(
+            controller, profile, clock=clock, monitor=monitor
+        ),
+        scheduler
+    )
+    if postflight_record is not None:
+        print('Postflight: controlling system to ending temperature.')
+        run_flight_record(postflight_record, scheduler)
 
 
 def main():
+    start_adc_sampler()
+    metrics_exporter.start()
     try:
         run_control_sequence(
             setpoint_record_sequence, control_loop_interval, 'thermal_lysis',
@@ -184,6 +346,9 @@ def main():
         )
     except KeyboardInterrupt:
         print('Quitting early...')
+    print('I2C bus: {}'.format(adc.bus))
+    adc_sampler.stop()
+    metrics_exporter.stop()
     gpio.cleanup()
 
 
@@ -1,7 +1,8 @@
 import gpio
 from thermal_lysis import (
     run_control_sequence, control_loop_interval,
-    preflight_record, postflight_record
+    preflight_record, postflight_record, adc_sampler, metrics_exporter,
+    start_adc_sampler
 )
 
 min_value = 30  # deg C
@@ -31,6 +32,8 @@ setpoint_record_sequence = (
 
 
 def main():
+    start_adc_sampler()
+    metrics_exporter.start()
     try:
         run_control_sequence(
             setpoint_record_sequence, control_loop_interval,
@@ -40,6 +43,8 @@ def main():
         )
     except KeyboardInterrupt:
         print('Quitting early...')
+    adc_sampler.stop()
+    metrics_exporter.stop()
     gpio.cleanup()
 
 
@@ -0,0 +1,54 @@
+import argparse
+import glob
+import os
+
+import thermal
+
+root_path = os.path.dirname(os.path.abspath(__file__))
+results_path = os.path.join(root_path, 'results')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fit a lumped thermal model to controller reports.'
+    )
+    parser.add_argument(
+        'filenames', nargs='*',
+        help=(
+            'CSV reports of a heater and fan controller. '
+            'Default: all CSV files in {}'.format(results_path)
+        )
+    )
+    parser.add_argument(
+        '--iterations', '-n', type=int, default=100,
+        help='Number of pattern search iterations. Default: 100'
+    )
+    parser.add_argument(
+        '--ambient', '-a', type=float, default=None,
+        help=(
+            'Fix the ambient temperature in deg C instead of fitting it. '
+            'Default: fit, starting from 25'
+        )
+    )
+    args = parser.parse_args()
+    filenames = args.filenames
+    if not filenames:
+        filenames = sorted(glob.glob(os.path.join(results_path, '*.csv')))
+
+    print('Fitting to {}...'.format(', '.join(filenames)))
+    if args.ambient is None:
+        kwargs = {}
+    else:
+        kwargs = {
+            'ambient_temperature': args.ambient,
+            'fixed_parameters': ('ambient_temperature',)
+        }
+    (model, error) = thermal.ThermalModel.fit_reports(
+        filenames, iterations=args.iterations, verbose=True, **kwargs
+    )
+    print(model)
+    print('RMS error: {:.3f} deg C'.format(error))
+
+
+if __name__ == '__main__':
+    main()
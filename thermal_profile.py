@@ -0,0 +1,59 @@
+"""Run a setpoint profile on the lysis heater.
+
+Profiles are described in setpoint_profiles; examples are in
+config/profiles. The profile is validated before the heater hardware is
+initialized, so an invalid profile never turns on the heater.
+"""
+import argparse
+
+import setpoint_profiles
+
+min_temperature = 20.0  # deg C
+max_temperature = 100.0  # deg C
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run a setpoint profile on the lysis heater.'
+    )
+    parser.add_argument(
+        'filename', help='JSON or YAML profile to run.'
+    )
+    parser.add_argument(
+        '--check', action='store_true',
+        help='Only validate the profile and print its segments.'
+    )
+    args = parser.parse_args()
+
+    try:
+        profile = setpoint_profiles.load_profile(
+            args.filename, min_value=min_temperature,
+            max_value=max_temperature
+        )
+    except (OSError, setpoint_profiles.ProfileError) as e:
+        parser.error(str(e))
+    print(profile)
+    if args.check:
+        return
+
+    # Importing thermal_lysis initializes the hardware
+    import gpio
+    import thermal_lysis
+
+    thermal_lysis.start_adc_sampler()
+    thermal_lysis.metrics_exporter.start()
+    try:
+        thermal_lysis.run_profile(
+            profile, thermal_lysis.control_loop_interval,
+            preflight_record=thermal_lysis.preflight_record,
+            postflight_record=thermal_lysis.postflight_record
+        )
+    except KeyboardInterrupt:
+        print('Quitting early...')
+    thermal_lysis.adc_sampler.stop()
+    thermal_lysis.metrics_exporter.stop()
+    gpio.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+import argparse
+
+import thermal
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert binary controller reports to CSV reports.'
+    )
+    parser.add_argument(
+        'filenames', nargs='+',
+        help='.npy files written by BinaryControllerReporter.'
+    )
+    args = parser.parse_args()
+    for filename in args.filenames:
+        csv_filename = thermal.convert_binary_report(filename)
+        print('Converted {} to {}'.format(filename, csv_filename))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Read controller telemetry from shared memory in a separate process.
+
+Prints the records which a controller publishes with SharedMemoryReporter,
+such as thermal_lysis.py, at this reader's own pace; any number of readers
+may run at once without slowing the control loop. With --max-age, warns
+whenever the controller stops publishing, as a watchdog.
+"""
+import argparse
+import math
+import time
+
+import telemetry
+
+
+def format_record(fields, record):
+    return ', '.join(
+        '{}: {}'.format(
+            field, '-' if math.isnan(value) else '{:.2f}'.format(value)
+        )
+        for (field, value) in zip(fields, record)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Print controller telemetry from shared memory.'
+    )
+    parser.add_argument(
+        'name', nargs='?', default='thermal_lysis',
+        help='Name of the telemetry shared memory. Default: thermal_lysis'
+    )
+    parser.add_argument(
+        '--interval', '-i', type=float, default=1.0,
+        help='Time between reads, in s. Default: 1'
+    )
+    parser.add_argument(
+        '--all', '-a', action='store_true',
+        help='Print every record instead of only the latest of each read.'
+    )
+    parser.add_argument(
+        '--from-start', action='store_true',
+        help='Start from the oldest record still in the ring.'
+    )
+    parser.add_argument(
+        '--max-age', type=float, default=None,
+        help='Warn when no records were published for this long, in s.'
+    )
+    args = parser.parse_args()
+    try:
+        reader = telemetry.TelemetryReader(
+            args.name, from_start=args.from_start
+        )
+    except FileNotFoundError:
+        parser.error('No telemetry is being published to {}'.format(
+            args.name
+        ))
+
+    last_record_time = time.monotonic()
+    try:
+        while True:
+            records = reader.read()
+            current_time = time.monotonic()
+            if records:
+                last_record_time = current_time
+            elif (
+                args.max_age is not None
+                and current_time - last_record_time > args.max_age
+            ):
+                print('Warning: no telemetry for {:.1f} s!'.format(
+                    current_time - last_record_time
+                ))
+            if not args.all:
+                records = records[-1:]
+            for record in records:
+                print(format_record(reader.fields, record))
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print('Quitting...')
+    print('Dropped {} records'.format(reader.dropped))
+    reader.close()
+
+
+if __name__ == '__main__':
+    main()
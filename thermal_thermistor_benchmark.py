@@ -0,0 +1,95 @@
+import argparse
+import time
+import timeit
+
+import numpy as np
+
+import thermal
+
+# Thermistor settings, matching thermal_lysis
+bias_resistance = 1960  # Ohm
+A = 0.0010349722285233954
+B = 0.00022717987892035313
+C = 3.008424040777896e-07
+reference_reading = 26400  # ADC code of the reference voltage
+
+min_temperature = 0.0  # deg C
+max_temperature = 150.0  # deg C
+
+
+class ReplayPin(object):
+    """Analog pin which replays a fixed sequence of raw readings."""
+    def __init__(self, raw_readings):
+        self.raw_readings = [int(reading) for reading in raw_readings]
+        self.index = 0
+
+    def read_raw(self):
+        reading = self.raw_readings[self.index]
+        self.index = (self.index + 1) % len(self.raw_readings)
+        return reading
+
+
+def build_thermistor(readings, **kwargs):
+    return thermal.Thermistor(
+        ReplayPin([reference_reading]), ReplayPin(readings),
+        bias_resistance=bias_resistance, A=A, B=B, C=C, **kwargs
+    )
+
+
+def measure_read_cost(thermistor, number):
+    return timeit.timeit(thermistor.read, number=number) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark thermistor temperature conversion.'
+    )
+    parser.add_argument(
+        '--size', '-s', type=int, default=32768,
+        help='Number of lookup table buckets. Default: 32768'
+    )
+    parser.add_argument(
+        '--number', '-n', type=int, default=100000,
+        help='Number of reads to time. Default: 100000'
+    )
+    args = parser.parse_args()
+
+    # Sweep the readings which occur between the min and max temperatures
+    readings = np.arange(1, reference_reading)
+    exact = build_thermistor(readings)
+    temperatures = np.array([exact.read() for _ in readings])
+    readings = readings[
+        (temperatures >= min_temperature) & (temperatures <= max_temperature)
+    ]
+    exact = build_thermistor(readings)
+    temperatures = np.array([exact.read() for _ in readings])
+
+    start_time = time.perf_counter()
+    lookup = build_thermistor(readings, lookup_table_size=args.size)
+    build_time = time.perf_counter() - start_time
+    lookup_temperatures = np.array([lookup.read() for _ in readings])
+
+    print('Lookup table: {} buckets'.format(args.size))
+    print('Build time: {:.1f} ms'.format(1000 * build_time))
+    print(
+        'Error bound from {:.0f} to {:.0f} deg C: {:.5f} deg C'.format(
+            min_temperature, max_temperature,
+            lookup.lookup_table_error(min_temperature, max_temperature)
+        )
+    )
+    print(
+        'Max error over all ADC codes from {:.0f} to {:.0f} deg C: '
+        '{:.5f} deg C'.format(
+            min_temperature, max_temperature,
+            np.max(np.abs(lookup_temperatures - temperatures))
+        )
+    )
+    exact_cost = measure_read_cost(exact, args.number)
+    lookup_cost = measure_read_cost(lookup, args.number)
+    print('Exact read: {:.2f} us'.format(1e6 * exact_cost))
+    print('Lookup table read: {:.2f} us'.format(1e6 * lookup_cost))
+    print('Speedup: {:.1f}x'.format(exact_cost / lookup_cost))
+
+
+if __name__ == '__main__':
+    main()
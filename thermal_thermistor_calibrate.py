@@ -1,8 +1,7 @@
 import readline
 
-import Adafruit_ADS1x15
-
 import gpio
+import thermal
 
 def read_float(prompt):
     while True:
@@ -53,10 +52,10 @@ def collect_measurements(thermistor):
     return temperature_resistance_pairs
 
 def main():
-    adc = Adafruit_ADS1x15.ADS1115()
+    adc = gpio.ADC()
     ref_voltage = gpio.AnalogPin(adc, 3)
     bias_resistance = read_bias_resistance()
-    thermistor = gpio.Thermistor(
+    thermistor = thermal.Thermistor(
         ref_voltage, gpio.AnalogPin(adc, 0), bias_resistance=bias_resistance
     )
 